@@ -21,9 +21,11 @@ import logging
 from math import ceil
 import re
 from threading import Event
+from time import monotonic
 from typing import Dict, List, Optional, Tuple
 from hax.exception import (BytecountException, HAConsistencyException,
                            InterruptedException)
+from hax.metrics import UPDATER_ITERATION
 from hax.motr import Motr, log_exception
 from hax.types import (ByteCountStats, Fid, ObjHealth, PverInfo,
                        StoppableThread)
@@ -131,6 +133,7 @@ class ByteCountUpdater(StoppableThread):
                 if not motr.is_spiel_ready():
                     wait_for_event(self.event, self.interval_sec)
                     continue
+                started = monotonic()
                 processes: List[Tuple[Fid, ObjHealth]] = \
                     self.consul.get_proc_fids_with_status(['ios'])
                 if not processes:
@@ -158,6 +161,7 @@ class ByteCountUpdater(StoppableThread):
                 except BytecountException as e:
                     LOG.exception('Failed due to %s. Aborting this iteration.'
                                   ' Waiting for next attempt.', e.message)
+                UPDATER_ITERATION.observe(monotonic() - started, 'bytecount')
                 wait_for_event(self.event, self.interval_sec)
         except InterruptedException:
             # No op. _sleep() has interrupted before the timeout exceeded:
@@ -17,49 +17,312 @@
 #
 
 import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from functools import wraps
-from typing import Any, Callable, Dict, Optional, TypeVar, cast
+from time import monotonic
+from typing import (Any, Callable, Deque, FrozenSet, Hashable, Iterator, List,
+                    Mapping, Optional, Set, Tuple, Type, TypeVar, cast)
 
 from hax.log import TRACE
 
 __all__ = [
-    'supports_consul_cache', 'uses_consul_cache', 'invalidates_consul_cache'
+    'supports_consul_cache', 'uses_consul_cache', 'invalidates_consul_cache',
+    'InvocationCache', 'configure_shared_cache', 'get_shared_cache',
+    'record_kv_read', 'record_non_kv_read', 'invalidate_kv_key',
+    'pending_kv_writes', 'keyed_by_class'
 ]
 
 LOG = logging.getLogger('hax')
 
+# (KV key, recurse) pairs that the cached value has been computed from.
+# None means that the dependencies are unknown.
+KVDeps = Optional[FrozenSet[Tuple[str, bool]]]
+
+_MISSING = object()
+
+C = TypeVar('C')
+
+# Classes whose instances are interchangeable for the cache (see
+# keyed_by_class())
+_keyed_by_class: Set[type] = set()
+
+
+class _Entry:
+    __slots__ = ('value', 'expires', 'deps')
+
+    def __init__(self, value: Any, expires: Optional[float], deps: KVDeps):
+        self.value = value
+        self.expires = expires
+        self.deps = deps
+
+
+def _depends_on(deps: KVDeps, key: str, recurse: bool) -> bool:
+    if deps is None:
+        return True
+    for dep_key, dep_recurse in deps:
+        if dep_key == key:
+            return True
+        if dep_recurse and key.startswith(dep_key):
+            return True
+        if recurse and dep_key.startswith(key):
+            return True
+    return False
+
 
 class InvocationCache:
-    def __init__(self):
-        # function name -> stringified arg list -> returned value
-        self._calls: Dict[str, Dict[str, Any]] = {}
+    """
+    Cache of the results of the methods decorated by @uses_consul_cache.
+
+    By default the instance lives as long as the call stack that has
+    created it (see @supports_consul_cache). An instance with ttl and/or
+    max_size set can be shared between threads and calls (see
+    configure_shared_cache()): the entries expire after ttl seconds and the
+    least recently used ones are evicted when max_size is exceeded.
+
+    The KV keys read while computing an entry are recorded, so that a KV
+    write invalidates only the entries that depend on the written key. The
+    entries computed from the other Consul data (health checks, catalog)
+    have unknown dependencies: no KV write drops them, so they are not
+    stored in the shared cache.
+
+    Every invalidation bumps the epoch of the cache. A value is stored only
+    if none of its KV keys got invalidated since the epoch its computation
+    started at (see put()): otherwise the value may have been computed from
+    the data the invalidation was meant to drop.
+    """
+    # Number of the recent invalidations remembered to check the values
+    # being computed against them.
+    MAX_INVALIDATIONS = 256
+
+    def __init__(self,
+                 ttl: Optional[float] = None,
+                 max_size: Optional[int] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # (function name, args, kwargs) -> cached entry
+        self._calls: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self.epoch = 0
+        # (epoch, KV key, recurse) of the recent invalidations
+        self._invalidations: Deque[Tuple[int, str, bool]] = deque(
+            maxlen=self.MAX_INVALIDATIONS)
 
     def has(self, fn_name, *args, **kwargs) -> bool:
-        if fn_name not in self._calls:
-            return False
-        v = self._create_key_by_args(*args, **kwargs)
-        return v in self._calls[fn_name]
+        return self.lookup(fn_name, *args, **kwargs)[0]
 
     def get(self, fn_name: str, *args, **kwargs) -> Any:
-        param_key = self._create_key_by_args(*args, **kwargs)
-        return self._calls[fn_name][param_key]
+        found, value, _ = self.lookup(fn_name, *args, **kwargs)
+        if not found:
+            raise KeyError(fn_name)
+        return value
+
+    def lookup(self, fn_name: str, *args,
+               **kwargs) -> Tuple[bool, Any, KVDeps]:
+        """
+        Returns (found, value, KV dependencies) tuple for the given call.
+        """
+        param_key = self._create_key_by_args(fn_name, *args, **kwargs)
+        with self.lock:
+            entry = self._calls.get(param_key)
+            if entry is None:
+                return False, None, None
+            if entry.expires is not None and entry.expires < monotonic():
+                del self._calls[param_key]
+                return False, None, None
+            self._calls.move_to_end(param_key)
+            return True, entry.value, entry.deps
 
     def clear(self):
-        self._calls = {}
+        with self.lock:
+            self._calls = OrderedDict()
+            self._add_invalidation('', True)
 
-    def put(self, fn_name: str, ret_value: Any, *args, **kwargs):
-        fun_dict = self._calls.get(fn_name, {})
-        param_key = self._create_key_by_args(*args, **kwargs)
-        fun_dict[param_key] = ret_value
-        self._calls[fn_name] = fun_dict
+    def _add_invalidation(self, key: str, recurse: bool) -> None:
+        self.epoch += 1
+        self._invalidations.append((self.epoch, key, recurse))
 
-    def _create_key_by_args(self, *args, **kwargs) -> str:
-        return f'{args}{kwargs}'
+    def _invalidated_since(self, epoch: int, deps: KVDeps) -> bool:
+        if epoch == self.epoch:
+            return False
+        if self._invalidations[0][0] > epoch + 1:
+            # Some of the invalidations since the epoch are forgotten
+            return True
+        return any(
+            _depends_on(deps, key, recurse)
+            for inv_epoch, key, recurse in self._invalidations
+            if inv_epoch > epoch)
+
+    def put(self,
+            fn_name: str,
+            ret_value: Any,
+            *args,
+            kv_deps: KVDeps = None,
+            since_epoch: Optional[int] = None,
+            **kwargs):
+        """
+        Stores the value computed from the given KV keys. If since_epoch is
+        given (the epoch the computation has started at), the value is
+        dropped if any of the keys got invalidated since then.
+        """
+        param_key = self._create_key_by_args(fn_name, *args, **kwargs)
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self.lock:
+            if since_epoch is not None and self._invalidated_since(
+                    since_epoch, kv_deps):
+                LOG.log(TRACE, 'CACHE: %s invalidated while computed',
+                        fn_name)
+                return
+            self._calls[param_key] = _Entry(ret_value, expires, kv_deps)
+            self._calls.move_to_end(param_key)
+            if self.max_size is not None:
+                while len(self._calls) > self.max_size:
+                    self._calls.popitem(last=False)
+
+    def invalidate(self, key: str, recurse: bool = False) -> None:
+        """
+        Drops the entries that depend on the given KV key (or on any key
+        from the given subtree if recurse is True).
+        """
+        with self.lock:
+            self._add_invalidation(key, recurse)
+            stale = [
+                k for k, entry in self._calls.items()
+                if _depends_on(entry.deps, key, recurse)
+            ]
+            for k in stale:
+                del self._calls[k]
+        if stale:
+            LOG.log(TRACE, 'CACHE: %d entries invalidated by key=%s',
+                    len(stale), key)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    @staticmethod
+    def _create_key_by_args(fn_name: str, *args, **kwargs) -> Hashable:
+        kwargs.pop(kwd_cache, None)
+        if args and type(args[0]) in _keyed_by_class:
+            args = (type(args[0]), ) + args[1:]
+        key = (fn_name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Some arguments are not hashable (e.g. lists)
+            return (fn_name, repr(args), repr(sorted(kwargs.items())))
+        return key
 
     def __repr__(self):
         return 'InvocationCache'
 
 
+_shared_cache: Optional[InvocationCache] = None
+
+
+def configure_shared_cache(ttl: float, max_size: int) -> InvocationCache:
+    """
+    Enables the cache that is shared by all the threads. When enabled, it is
+    used instead of creating a new InvocationCache per call stack.
+    """
+    global _shared_cache
+    _shared_cache = InvocationCache(ttl=ttl, max_size=max_size)
+    return _shared_cache
+
+
+def get_shared_cache() -> Optional[InvocationCache]:
+    return _shared_cache
+
+
+class _DepsTracker(threading.local):
+    def __init__(self):
+        # Every frame collects the KV dependencies of a value being computed
+        # by a @uses_consul_cache method; None means 'unknown'.
+        self.frames: List[Optional[Set[Tuple[str, bool]]]] = []
+        # KV writes of the current thread that are not in Consul yet (see
+        # pending_kv_writes())
+        self.pending: List[Mapping[str, Any]] = []
+
+
+_tracker = _DepsTracker()
+
+
+def _add_deps(deps: KVDeps) -> None:
+    frames = _tracker.frames
+    if not frames:
+        return
+    for i, frame in enumerate(frames):
+        if frame is None:
+            continue
+        if deps is None:
+            frames[i] = None
+        else:
+            frame.update(deps)
+
+
+def record_kv_read(key: str, recurse: bool = False) -> None:
+    """
+    Records that the values being computed by the enclosing
+    @uses_consul_cache methods depend on the given KV key.
+    """
+    _add_deps(frozenset([(key, recurse)]))
+
+
+def record_non_kv_read() -> None:
+    """
+    Records that the values being computed by the enclosing
+    @uses_consul_cache methods depend on the Consul data other than KV
+    (e.g. health checks), so that they are not stored in the shared cache.
+    """
+    _add_deps(None)
+
+
+def keyed_by_class(cls: Type[C]) -> Type[C]:
+    """
+    Class decorator: the results of the @uses_consul_cache methods of the
+    class depend on the Consul data only, so the cache entries are keyed by
+    the class rather than by the instance. Otherwise the entries of the
+    short-lived instances would never be reused.
+    """
+    _keyed_by_class.add(cls)
+    return cls
+
+
+@contextmanager
+def pending_kv_writes(writes: Mapping[str, Any]) -> Iterator[None]:
+    """
+    Tells the cache that the current thread sees the given KV writes that
+    are not in Consul yet (see KVAdapter.batch()). The cached values that
+    depend on the written keys are neither taken from the cache nor stored
+    there while in the context: the ones computed by the other threads miss
+    the writes and the ones computed by this thread include them.
+    """
+    _tracker.pending.append(writes)
+    try:
+        yield
+    finally:
+        _tracker.pending.remove(writes)
+
+
+def _depends_on_pending_writes(deps: KVDeps) -> bool:
+    return any(
+        _depends_on(deps, key, False) for writes in _tracker.pending
+        for key in writes)
+
+
+def invalidate_kv_key(key: str,
+                      recurse: bool = False,
+                      kv_cache: Optional[InvocationCache] = None) -> None:
+    """
+    Invalidates the entries depending on the given KV key in both the given
+    cache instance and the shared cache.
+    """
+    if kv_cache is not None and kv_cache is not _shared_cache:
+        kv_cache.invalidate(key, recurse=recurse)
+    if _shared_cache is not None:
+        _shared_cache.invalidate(key, recurse=recurse)
+
+
 T = TypeVar('T', bound=Callable[..., Any])
 
 kwd_cache = 'kv_cache'
@@ -69,14 +332,17 @@ def supports_consul_cache(f: T) -> T:
     """
     Create the instance of cache that nested functions can pick up.
 
-    Decorates a method that either starts a new cache or silently reuses the
-    one provided as kv_cache parameter.
+    Decorates a method that either starts a new cache (or picks up the shared
+    one, if configured) or silently reuses the one provided as kv_cache
+    parameter.
     The function being decorated WILL NOT be cached. The only use case is to
     create the instance of cache that nested functions can pick up.
     """
     @wraps(f)
     def wrapper(*args, **kwds):
         cache: Optional[InvocationCache] = kwds.get(kwd_cache)
+        if cache is None:
+            cache = _shared_cache
         if cache is None:
             LOG.log(TRACE, 'CACHE: created. fn_name=%s', f.__qualname__)
             cache = InvocationCache()
@@ -105,6 +371,15 @@ def uses_consul_cache(f: T) -> T:
     5. When active, cache accumulates the mapping between the input
        arguments and the result values of the methods decorated by
        @uses_consul_cache decorator.
+    6. The KV keys read while computing the value (see record_kv_read())
+       are stored along with it, so that a KV write drops only the values
+       that depend on the written key. A value whose keys got written while
+       it was being computed is not stored at all, neither is a value read
+       from the other Consul data (see record_non_kv_read()) if the cache
+       is the shared one.
+    7. The cache instance is created by @supports_consul_cache methods; if
+       the shared cache is configured (see configure_shared_cache()), they
+       use it instead of creating a new one.
 
     Rules how to use this decorator:
     1. Decorated function MUST contain kv_cache keyword argument: kv_cache=None
@@ -122,11 +397,28 @@ def uses_consul_cache(f: T) -> T:
             cache = InvocationCache()
             kwds[kwd_cache] = cache
 
-        if cache.has(fn_name, *args, **kwds):
+        found, ret_value, deps = cache.lookup(fn_name, *args, **kwds)
+        if found and not _depends_on_pending_writes(deps):
             LOG.log(TRACE, 'CACHE hit: %s', fn_name)
-            return cache.get(fn_name, *args, **kwds)
-        ret_value = f(*args, **kwds)
-        cache.put(fn_name, ret_value, *args, **kwds)
+            _add_deps(deps)
+            return ret_value
+        epoch = cache.epoch
+        _tracker.frames.append(set())
+        try:
+            ret_value = f(*args, **kwds)
+        finally:
+            frame = _tracker.frames.pop()
+        kv_deps = None if frame is None else frozenset(frame)
+        if kv_deps is None and cache is _shared_cache:
+            LOG.log(TRACE, 'CACHE: %s depends on non-KV data, not stored',
+                    fn_name)
+        elif not _depends_on_pending_writes(kv_deps):
+            cache.put(fn_name,
+                      ret_value,
+                      *args,
+                      kv_deps=kv_deps,
+                      since_epoch=epoch,
+                      **kwds)
         return ret_value
 
     return cast(T, wrapper)
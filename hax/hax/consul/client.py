@@ -0,0 +1,200 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional
+
+import requests
+from consul import std
+from requests.adapters import HTTPAdapter
+
+from hax.consul.cache import record_non_kv_read
+from hax.consul.trace import TRACER
+from hax.metrics import REGISTRY
+from hax.retry import CONSUL_BREAKER
+
+__all__ = ['Consul', 'Transport', 'configure_transport', 'get_api_name',
+           'get_transport']
+
+CONSUL_CALLS = REGISTRY.counter('hax_consul_calls_total',
+                                'Number of Consul HTTP API calls',
+                                ['api', 'method'])
+CONSUL_ERRORS = REGISTRY.counter(
+    'hax_consul_call_errors_total',
+    'Number of Consul HTTP API calls failed without a response',
+    ['api', 'method'])
+CONSUL_LATENCY = REGISTRY.histogram('hax_consul_call_seconds',
+                                    'Latency of Consul HTTP API calls',
+                                    ['api', 'method'])
+CONSUL_RESPONSE_BYTES = REGISTRY.counter(
+    'hax_consul_response_bytes_total',
+    'Size of the bodies of Consul HTTP API responses', ['api', 'method'])
+
+
+def get_api_name(path: str) -> str:
+    """
+    Returns the Consul API the given request path belongs to, e.g.
+    '/v1/kv' for '/v1/kv/processes/0x7200000000000001:0x15' or
+    '/v1/health/node' for '/v1/health/node/srvnode-1'.
+    """
+    parts = path.split('/')
+    if path.startswith('/v1/kv/'):
+        return '/'.join(parts[:3])
+    return '/'.join(parts[:4])
+
+
+def _parse_wait(wait: str) -> float:
+    """
+    Converts the wait parameter of a Consul blocking query (e.g. '10s',
+    '500ms' or '5m') into seconds.
+    """
+    for suffix, scale in (('ms', 0.001), ('s', 1), ('m', 60), ('h', 3600)):
+        if wait.endswith(suffix):
+            return float(wait[:-len(suffix)]) * scale
+    return float(wait)
+
+
+class Transport:
+    """
+    HTTP transport shared by all the Consul clients of the process: a single
+    requests.Session whose connection pool keeps up to pool_size keep-alive
+    connections per Consul agent.
+
+    Every request gets a timeout. Consul holds blocking queries (the ones
+    with the 'wait' parameter) for up to the given time, so they get that
+    time on top of the usual timeout.
+    """
+    def __init__(self, pool_size: int = 16, timeout: float = 30.0):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_timeout(self, params: Any) -> float:
+        if not params:
+            return self.timeout
+        items = params.items() if isinstance(params, dict) else params
+        for name, value in items:
+            if name == 'wait' and value:
+                # Consul adds up to wait/16 of random jitter
+                return self.timeout + _parse_wait(str(value)) * 17 / 16
+        return self.timeout
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_transport_lock = Lock()
+_transport: Optional[Transport] = None
+
+
+def configure_transport(pool_size: int, timeout: float = 30.0) -> Transport:
+    """
+    Replaces the process-wide transport. Expected to be invoked at startup,
+    before the Consul clients are used.
+    """
+    global _transport
+    with _transport_lock:
+        old = _transport
+        _transport = Transport(pool_size=pool_size, timeout=timeout)
+    if old is not None:
+        old.close()
+    return _transport
+
+
+def get_transport() -> Transport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+class HTTPClient(std.HTTPClient):
+    """
+    HTTP client of python-consul that sends the requests via the shared
+    Transport and accounts every request in the hax_consul_* metrics, in
+    the Consul call tracer (see hax.consul.trace) and in the Consul circuit
+    breaker: the requests that got no response or a 5xx one are considered
+    failed.
+    """
+    def _call(self,
+              method: str,
+              callback: Any,
+              path: str,
+              params: Any = None,
+              data: Any = None) -> Any:
+        api = get_api_name(path)
+        if method == 'GET' and api != '/v1/kv':
+            # Catalog, health, sessions etc: the cached values computed from
+            # such data are not dropped by the KV writes.
+            record_non_kv_read()
+        CONSUL_CALLS.inc(api, method)
+        started = monotonic()
+        size = 0
+        status = 0
+        responded = False
+        failed = True
+        try:
+            transport = get_transport()
+            response = transport.session.request(
+                method,
+                self.uri(path, params),
+                data=data,
+                verify=self.verify,
+                cert=self.cert,
+                timeout=transport.get_timeout(params))
+            responded = True
+            status = response.status_code
+            size = len(response.content)
+            CONSUL_RESPONSE_BYTES.inc(api, method, amount=size)
+            result = callback(self.response(response))
+            failed = False
+            return result
+        except Exception:
+            if not responded:
+                CONSUL_ERRORS.inc(api, method)
+            raise
+        finally:
+            if responded and status < 500:
+                CONSUL_BREAKER.record_success()
+            else:
+                CONSUL_BREAKER.record_failure()
+            elapsed = monotonic() - started
+            CONSUL_LATENCY.observe(elapsed, api, method)
+            TRACER.record(api, method, path, params, size, elapsed, failed)
+
+    def get(self, callback, path, params=None):
+        return self._call('GET', callback, path, params)
+
+    def put(self, callback, path, params=None, data=''):
+        return self._call('PUT', callback, path, params, data)
+
+    def delete(self, callback, path, params=None):
+        return self._call('DELETE', callback, path, params)
+
+    def post(self, callback, path, params=None, data=''):
+        return self._call('POST', callback, path, params, data)
+
+
+class Consul(std.Consul):
+    def connect(self, host, port, scheme, verify=True, cert=None):
+        return HTTPClient(host, port, scheme, verify, cert)
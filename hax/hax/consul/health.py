@@ -0,0 +1,107 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import logging
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from consul import ConsulException
+from requests.exceptions import RequestException
+from urllib3.exceptions import HTTPError
+
+from hax.consul.cache import record_non_kv_read
+from hax.consul.client import Consul
+from hax.exception import HAConsistencyException
+
+__all__ = ['HealthSnapshot']
+
+LOG = logging.getLogger('hax')
+
+Check = Dict[str, Any]
+
+_Snapshot = NamedTuple('_Snapshot', [('fetched_at', float),
+                                     ('by_node', Dict[str, List[Check]]),
+                                     ('by_service', Dict[str, List[Check]])])
+
+
+class HealthSnapshot:
+    """
+    Health checks of the whole cluster fetched with a single
+    /v1/health/state/any request and indexed by Consul node and by
+    ServiceID.
+
+    The snapshot is re-fetched once it gets older than max_age seconds or
+    after invalidate() is called (e.g. when the Consul health watcher
+    reports a change). Concurrent readers of an outdated snapshot wait for
+    a single fetch.
+    """
+    def __init__(self, cns: Consul, max_age: float = 1.0):
+        self.cns = cns
+        self.max_age = max_age
+        self.lock = Lock()
+        self._snapshot: Optional[_Snapshot] = None
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self._snapshot = None
+
+    def get_node_checks(self, consul_node: str) -> List[Check]:
+        """
+        Returns the checks of the given node the same way as
+        /v1/health/node/<node> does: the node-level checks (e.g.
+        serfHealth) go first, the list is empty if the node is unknown.
+        """
+        record_non_kv_read()
+        return list(self._get().by_node.get(consul_node, []))
+
+    def get_service_checks(self, service_id: str) -> List[Check]:
+        record_non_kv_read()
+        return list(self._get().by_service.get(service_id, []))
+
+    def _get(self) -> _Snapshot:
+        with self.lock:
+            snapshot = self._snapshot
+            if snapshot is None or \
+                    monotonic() - snapshot.fetched_at > self.max_age:
+                snapshot = self._fetch()
+                self._snapshot = snapshot
+            return snapshot
+
+    def _fetch(self) -> _Snapshot:
+        try:
+            checks: List[Check] = self.cns.health.state('any')[1]
+        except (ConsulException, HTTPError, RequestException) as e:
+            raise HAConsistencyException(
+                f'Failed to get the health checks: {e}') from e
+        by_node: Dict[str, List[Check]] = {}
+        by_service: Dict[str, List[Check]] = {}
+        for check in checks:
+            by_node.setdefault(check['Node'], []).append(check)
+            svc_id = check.get('ServiceID')
+            if svc_id:
+                by_service.setdefault(svc_id, []).append(check)
+        for node_checks in by_node.values():
+            # Note: sort() is stable, so the order given by Consul is kept
+            # otherwise.
+            node_checks.sort(key=lambda c: bool(c.get('ServiceID')))
+        LOG.debug('Health snapshot: %d checks of %d nodes', len(checks),
+                  len(by_node))
+        return _Snapshot(fetched_at=monotonic(),
+                         by_node=by_node,
+                         by_service=by_service)
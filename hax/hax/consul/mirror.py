@@ -0,0 +1,255 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import logging
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+__all__ = ['KVMirror', 'configure_kv_mirror', 'get_kv_mirror']
+
+LOG = logging.getLogger('hax')
+
+# (watched prefix, keys that were added or removed, keys whose values changed)
+KVListener = Callable[[str, Set[str], Set[str]], None]
+
+
+class KVMirror:
+    """
+    Local copy of some Consul KV subtrees.
+
+    The mirror is fed by KVWatcher threads (one per watched prefix) that
+    issue Consul blocking queries, so the mirror gets updated as soon as
+    Consul reports a new X-Consul-Index for the prefix.
+
+    A prefix is considered fresh while its watcher keeps getting the
+    responses from Consul; after max_staleness seconds without a successful
+    response (or after an explicit mark_stale() call) the readers must fall
+    back to Consul.
+
+    The values written by hax itself are applied locally right away (see
+    put_local()), so that hax reads its own writes even before the watcher
+    brings the new snapshot. Such local values are kept until the watcher
+    reports the same value or until max_staleness seconds pass.
+
+    The mirrored keys are also kept sorted, so that reading a subtree costs
+    O(log N + k) where k is the size of the subtree.
+    """
+    def __init__(self, prefixes: List[str], max_staleness: float = 30.0):
+        self.prefixes = list(prefixes)
+        self.max_staleness = max_staleness
+        self.lock = Lock()
+        # key -> KV item as returned by Consul
+        self._items: Dict[str, Dict[str, Any]] = {}
+        # Sorted keys of self._items
+        self._keys: List[str] = []
+        # key -> (KV item or None if deleted, expiration time)
+        self._local: Dict[str, Tuple[Optional[Dict[str, Any]], float]] = {}
+        # prefix -> time of the last successful sync
+        self._synced: Dict[str, float] = {}
+        self._indexes: Dict[str, int] = {}
+        self._versions: Dict[str, int] = {p: 0 for p in self.prefixes}
+        self._listeners: List[KVListener] = []
+
+    def add_listener(self, listener: KVListener) -> None:
+        self._listeners.append(listener)
+
+    def _prefix_of(self, key: str) -> Optional[str]:
+        for prefix in self.prefixes:
+            if key.startswith(prefix):
+                return prefix
+        return None
+
+    def _key_range(self, prefix: str) -> Tuple[int, int]:
+        # Returns the range of self._keys that start with the prefix.
+        # Note: must be invoked under self.lock
+        keys = self._keys
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return start, end
+
+    def covers(self, key: str) -> bool:
+        """
+        Returns True if the key (or the subtree starting with the key) is
+        mirrored and the mirrored data is fresh enough to be read.
+        """
+        prefix = self._prefix_of(key)
+        if prefix is None:
+            return False
+        with self.lock:
+            synced = self._synced.get(prefix)
+        return synced is not None and \
+            monotonic() - synced <= self.max_staleness
+
+    def get_index(self, prefix: str) -> Optional[int]:
+        with self.lock:
+            return self._indexes.get(prefix)
+
+    def get_version(self, key: str) -> int:
+        """
+        Returns the number of changes applied so far to the watched prefix
+        that covers the given key.
+        """
+        prefix = self._prefix_of(key)
+        with self.lock:
+            return self._versions.get(prefix or '', 0)
+
+    def get(self, key: str, recurse: bool = False) -> Any:
+        """
+        Mimics consul.Consul.kv.get(): returns a KV item, a list of KV items
+        sorted by key (if recurse is True) or None if nothing is found.
+        """
+        with self.lock:
+            self._expire_local()
+            if not recurse:
+                if key in self._local:
+                    return self._local[key][0]
+                return self._items.get(key)
+            start, end = self._key_range(key)
+            result = [self._items[k] for k in self._keys[start:end]]
+            # Note: there are few local values, they live until the watcher
+            # brings them.
+            local = {
+                k: item
+                for k, (item, _) in self._local.items() if k.startswith(key)
+            }
+        if local:
+            found = {item['Key']: item for item in result}
+            for k, item in local.items():
+                if item is None:
+                    found.pop(k, None)
+                else:
+                    found[k] = item
+            result = [found[k] for k in sorted(found)]
+        return result or None
+
+    def apply(self, prefix: str, index: int,
+              items: Optional[List[Dict[str, Any]]]) -> None:
+        """
+        Replaces the mirrored subtree with the snapshot brought by the
+        watcher. Listeners are notified about the keys that have changed.
+        """
+        new_items = {item['Key']: item for item in items or []}
+        with self.lock:
+            self._synced[prefix] = monotonic()
+            if self._indexes.get(prefix) == index:
+                return
+            self._indexes[prefix] = index
+            start, end = self._key_range(prefix)
+            old_keys = set(self._keys[start:end])
+            structural = old_keys ^ set(new_items)
+            modified: Set[str] = set()
+            for k in old_keys & set(new_items):
+                old_index = self._items[k].get('ModifyIndex')
+                if old_index != new_items[k].get('ModifyIndex'):
+                    modified.add(k)
+            for k in old_keys - set(new_items):
+                del self._items[k]
+            self._items.update(new_items)
+            self._keys[start:end] = sorted(new_items)
+            for k in list(self._local):
+                item, _ = self._local[k]
+                if not k.startswith(prefix):
+                    continue
+                actual = new_items.get(k)
+                if item is None:
+                    seen = actual is None
+                else:
+                    seen = actual is not None and \
+                        item['Value'] == actual['Value']
+                if seen:
+                    del self._local[k]
+            self._versions[prefix] += 1
+        if structural or modified:
+            LOG.debug('KV mirror: %s updated (index=%s, %d keys changed)',
+                      prefix, index, len(structural) + len(modified))
+            self._notify(prefix, structural, modified)
+
+    def mark_stale(self, prefix: str) -> None:
+        with self.lock:
+            self._synced.pop(prefix, None)
+            self._indexes.pop(prefix, None)
+
+    def put_local(self, key: str, value: str) -> None:
+        """
+        Applies the value that hax has just written to Consul KV.
+        """
+        prefix = self._prefix_of(key)
+        if prefix is None:
+            return
+        item = {'Key': key, 'Value': value.encode()}
+        with self.lock:
+            structural = {key} if key not in self._items else set()
+            self._local[key] = (item, monotonic() + self.max_staleness)
+            self._versions[prefix] += 1
+        self._notify(prefix, structural, set() if structural else {key})
+
+    def delete_local(self, key: str, recurse: bool = False) -> None:
+        """
+        Applies the deletion that hax has just made in Consul KV.
+        """
+        prefix = self._prefix_of(key)
+        if prefix is None:
+            return
+        with self.lock:
+            if recurse:
+                start, end = self._key_range(key)
+                keys = set(self._keys[start:end])
+            else:
+                keys = {key} & set(self._items)
+            expiration = monotonic() + self.max_staleness
+            for k in keys:
+                self._local[k] = (None, expiration)
+            self._versions[prefix] += 1
+        if keys:
+            self._notify(prefix, keys, set())
+
+    def _expire_local(self) -> None:
+        # Note: must be invoked under self.lock
+        now = monotonic()
+        for k in [k for k, (_, exp) in self._local.items() if exp < now]:
+            del self._local[k]
+
+    def _notify(self, prefix: str, structural: Set[str],
+                modified: Set[str]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(prefix, structural, modified)
+            except Exception:
+                LOG.exception('KV mirror listener failed')
+
+
+_mirror: Optional[KVMirror] = None
+
+
+def configure_kv_mirror(prefixes: List[str],
+                        max_staleness: float = 30.0) -> KVMirror:
+    """
+    Creates the mirror shared by all the KV adapters of the process (see
+    KVAdapter.mirror). The caller is responsible for starting the watchers
+    that feed it.
+    """
+    global _mirror
+    _mirror = KVMirror(prefixes, max_staleness=max_staleness)
+    return _mirror
+
+
+def get_kv_mirror() -> Optional[KVMirror]:
+    return _mirror
@@ -0,0 +1,240 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from hax.types import Fid, ObjT
+
+__all__ = ['ConfObj', 'Topology']
+
+LOG = logging.getLogger('hax')
+
+
+@dataclass
+class ConfObj:
+    """
+    Conf object as it is described by a single m0conf/ KV entry.
+
+    Example: the key
+        m0conf/nodes/0x6e00000000000001:0x3/processes/0x7200000000000001:0x15
+    gives the process object 0x7200000000000001:0x15 with the path
+    [0x6e00000000000001:0x3, 0x7200000000000001:0x15] and the JSON value
+    decoded into `value`.
+    """
+    fid: Fid
+    key: str
+    # Fids of the enclosing objects from the top down to this one
+    path: List[Fid]
+    value: Dict[str, Any]
+    children: List[Fid] = field(default_factory=list)
+
+    @property
+    def parent(self) -> Optional[Fid]:
+        return self.path[-2] if len(self.path) > 1 else None
+
+
+def _parse_fid(val: str) -> Optional[Fid]:
+    if ':' not in val:
+        return None
+    try:
+        return Fid.parse(val)
+    except ValueError:
+        return None
+
+
+def _decode(value: Any) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    try:
+        data = json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class Topology:
+    """
+    Parsed and indexed view of the m0conf/ KV tree.
+
+    The topology is built once from the items returned by a recursive
+    'm0conf/nodes' and/or 'm0conf/sites' fetch. All the lookups are
+    dictionary lookups, so that the callers don't need to scan (and match
+    regexps against) the whole KV dump per every request.
+
+    Two layouts are understood:
+
+    1. Fid based (one conf object per key, JSON value):
+       m0conf/nodes/<node>/processes/<process>/services/<svc>/sdevs/<sdev>
+       m0conf/sites/<site>/racks/<rack>/encls/<encl>/ctrls/<ctrl>/drives/<d>
+    2. Legacy name based (one attribute per key):
+       m0conf/nodes/<hostname>/processes/<process_fidk>/services/<type>
+       m0conf/nodes/<hostname>/processes/<process_fidk>/endpoint
+       m0conf/nodes/<hostname>/processes/<process_fidk>/meta_data
+
+    Besides the hierarchy, the references stored in the values of the
+    m0conf/sites objects are indexed in both directions: drive <-> sdev
+    (the "sdev" attribute of a drive) and enclosure <-> node (the "node"
+    attribute of an enclosure).
+
+    Note that the object states stored in the values are just a snapshot
+    taken at the moment of the KV fetch.
+    """
+    def __init__(self, items: Optional[Iterable[Dict[str, Any]]] = None):
+        self._objects: Dict[Fid, ConfObj] = {}
+        self._node_by_name: Dict[str, Fid] = {}
+        # process fidk -> [(service type, service fidk)]
+        self._proc_services: Dict[int, List[Tuple[str, int]]] = {}
+        # process fidk -> endpoint
+        self._proc_endpoints: Dict[int, str] = {}
+        # process fidk -> metadata device
+        self._proc_meta_data: Dict[int, str] = {}
+        # Reverse indexes of the references between the conf objects
+        self._drive_by_sdev: Dict[Fid, Fid] = {}
+        self._sdev_by_drive: Dict[Fid, Fid] = {}
+        self._encl_by_node: Dict[Fid, Fid] = {}
+        for item in items or []:
+            self._add_item(item)
+        for obj in self._objects.values():
+            if obj.parent is not None and obj.parent in self._objects:
+                self._objects[obj.parent].children.append(obj.fid)
+
+    def _add_item(self, item: Dict[str, Any]) -> None:
+        key: str = item['Key']
+        parts = key.split('/')
+        if len(parts) < 3 or parts[0] != 'm0conf':
+            return
+        fids = [_parse_fid(p) for p in parts[2::2]]
+        if len(parts) % 2 == 1 and all(fids):
+            path: List[Fid] = fids  # type: ignore
+            fid = path[-1]
+            obj = ConfObj(fid=fid,
+                          key=key,
+                          path=path,
+                          value=_decode(item.get('Value')))
+            self._objects[fid] = obj
+            self._index_refs(obj)
+            return
+        self._add_legacy_item(parts, item.get('Value'))
+
+    def _index_refs(self, obj: ConfObj) -> None:
+        fid = obj.fid
+        if fid.container == ObjT.NODE.value and 'name' in obj.value:
+            self._node_by_name.setdefault(obj.value['name'], fid)
+        elif fid.container == ObjT.DRIVE.value:
+            sdev = _parse_fid(str(obj.value.get('sdev', '')))
+            if sdev is not None:
+                self._drive_by_sdev[sdev] = fid
+                self._sdev_by_drive[fid] = sdev
+        elif fid.container == ObjT.ENCLOSURE.value:
+            node = _parse_fid(str(obj.value.get('node', '')))
+            if node is not None:
+                self._encl_by_node.setdefault(node, fid)
+
+    def _add_legacy_item(self, parts: List[str], value: Any) -> None:
+        # m0conf/nodes/<hostname>/processes/<process_fidk>/...
+        if parts[1] != 'nodes' or len(parts) < 6 or parts[3] != 'processes':
+            return
+        try:
+            proc_fidk = int(parts[4])
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            if len(parts) == 7 and parts[5] == 'services':
+                self._proc_services.setdefault(proc_fidk, []).append(
+                    (parts[6], int(value)))
+            elif len(parts) == 6 and parts[5] == 'endpoint':
+                self._proc_endpoints[proc_fidk] = str(value)
+            elif len(parts) == 6 and parts[5] == 'meta_data':
+                self._proc_meta_data[proc_fidk] = str(value)
+        except (TypeError, ValueError):
+            LOG.debug('Skipping unexpected m0conf key: %s', '/'.join(parts))
+
+    def is_empty(self) -> bool:
+        return not (self._objects or self._proc_services)
+
+    def get(self, fid: Fid) -> Optional[ConfObj]:
+        return self._objects.get(fid)
+
+    def get_parent_fid(self, fid: Fid, obj_t: ObjT) -> Optional[Fid]:
+        """
+        Returns the fid of the closest enclosing object of the given type
+        (e.g. the node of a service).
+        """
+        obj = self._objects.get(fid)
+        if obj is None:
+            return None
+        for parent in reversed(obj.path[:-1]):
+            if parent.container == obj_t.value:
+                return parent
+        return None
+
+    def get_objects(self, obj_t: ObjT) -> List[ConfObj]:
+        """
+        Returns all the objects of the given type in the order of their KV
+        keys.
+        """
+        objs = [o for o in self._objects.values()
+                if o.fid.container == obj_t.value]
+        return sorted(objs, key=lambda o: o.key)
+
+    def get_children(self, fid: Fid) -> List[ConfObj]:
+        obj = self._objects.get(fid)
+        if obj is None:
+            return []
+        return [self._objects[f] for f in obj.children]
+
+    def get_descendants(self, fid: Fid, obj_t: ObjT) -> List[ConfObj]:
+        """
+        Returns all the objects of the given type that are enclosed into
+        the given object (e.g. all sdevs of a process).
+        """
+        result: List[ConfObj] = []
+        stack = list(reversed(self.get_children(fid)))
+        while stack:
+            obj = stack.pop()
+            if obj.fid.container == obj_t.value:
+                result.append(obj)
+            stack.extend(reversed(self.get_children(obj.fid)))
+        return result
+
+    def get_node_fid(self, name: str) -> Optional[Fid]:
+        return self._node_by_name.get(name)
+
+    def get_drive_by_sdev(self, sdev_fid: Fid) -> Optional[Fid]:
+        return self._drive_by_sdev.get(sdev_fid)
+
+    def get_sdev_by_drive(self, drive_fid: Fid) -> Optional[Fid]:
+        return self._sdev_by_drive.get(drive_fid)
+
+    def get_encl_by_node(self, node_fid: Fid) -> Optional[Fid]:
+        return self._encl_by_node.get(node_fid)
+
+    def get_process_services(self, proc_fidk: int) -> List[Tuple[str, int]]:
+        """
+        Returns (service type, service fidk) pairs of the given process as
+        they are described by the legacy name based keys.
+        """
+        return list(self._proc_services.get(proc_fidk, []))
+
+    def get_process_endpoint(self, proc_fidk: int) -> Optional[str]:
+        return self._proc_endpoints.get(proc_fidk)
+
+    def get_process_meta_data(self, proc_fidk: int) -> Optional[str]:
+        return self._proc_meta_data.get(proc_fidk)
@@ -0,0 +1,235 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+"""
+Accounting of the Consul HTTP API calls by their origin: which hax method
+made the call and which WorkPlanner message was being processed at that
+moment. Exposed at the /v1/hax/consul-calls endpoint of hax.
+"""
+
+import logging
+import os.path as P
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from types import CodeType, FrameType
+from typing import (Any, Deque, Dict, Iterable, List, Optional, Set,
+                    Tuple)
+
+__all__ = ['ConsulTracer', 'TRACER', 'get_key_prefix', 'skip_frames_of']
+
+LOG = logging.getLogger('hax')
+
+_HAX_DIR = P.dirname(P.dirname(P.abspath(__file__)))
+# The frames of these files are never reported as callers: they only pass
+# the calls through.
+_SKIPPED_FILES = {
+    P.join(_HAX_DIR, 'consul', name)
+    for name in ('cache.py', 'client.py', 'trace.py')
+}
+# Code objects of the adapter methods (see skip_frames_of())
+_skipped_code: Set[CodeType] = set()
+
+UNKNOWN = '<unknown>'
+OTHER = '<other>'
+
+# (caller, message, api, method, key prefix, recurse, blocking)
+CallKey = Tuple[str, str, str, str, str, bool, bool]
+
+
+def skip_frames_of(*classes: type) -> None:
+    """
+    Makes the methods of the given classes transparent for the caller
+    attribution: a call made by KVAdapter.kv_get() is reported as made by
+    the method that invoked kv_get().
+    """
+    for cls in classes:
+        for fn in vars(cls).values():
+            fn = getattr(fn, '__func__', fn)
+            while fn is not None:
+                code = getattr(fn, '__code__', None)
+                if code is not None:
+                    _skipped_code.add(code)
+                fn = getattr(fn, '__wrapped__', None)
+
+
+def _is_skipped(frame: FrameType) -> bool:
+    code = frame.f_code
+    if code in _skipped_code:
+        return True
+    filename = code.co_filename
+    return not filename.startswith(_HAX_DIR) or filename in _SKIPPED_FILES
+
+
+def _get_caller(frame: Optional[FrameType]) -> str:
+    while frame is not None and _is_skipped(frame):
+        frame = frame.f_back
+    if frame is None:
+        return UNKNOWN
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{frame.f_globals.get("__name__", "?")}:{name}'
+
+
+def get_key_prefix(key: str) -> str:
+    """
+    Returns the part of the KV key that identifies the kind of the data
+    rather than a particular object: up to two leading path components
+    without the fids, e.g. 'm0conf/nodes' for
+    'm0conf/nodes/0x6e00000000000001:0x3/processes/0x7200000000000001:0x15'
+    and 'processes' for 'processes/0x7200000000000001:0x15'.
+    """
+    parts: List[str] = []
+    for part in key.split('/')[:2]:
+        if not part or part.startswith('0x') or ':' in part:
+            break
+        parts.append(part)
+    return '/'.join(parts)
+
+
+def _get_param(params: Any, name: str) -> Any:
+    if not params:
+        return None
+    items: Iterable[Tuple[str, Any]] = params.items() if isinstance(
+        params, dict) else params
+    for k, v in items:
+        if k == name:
+            return v
+    return None
+
+
+@dataclass
+class CallStats:
+    count: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    bytes: int = 0
+
+
+class ConsulTracer:
+    """
+    Aggregates the Consul calls by (caller, message, api, method, key
+    prefix, recurse, blocking) and logs the calls that take longer than
+    slow_threshold seconds. Blocking queries (the ones with the 'index'
+    parameter) are held by Consul on purpose, so they are accounted
+    separately and never considered slow.
+
+    The caller is the innermost hax method on the stack that is not a part
+    of the Consul client plumbing (see skip_frames_of()). The message is
+    the type of the WorkPlanner command being processed by the current
+    thread (see set_message()); the calls made outside of the consumer
+    threads are attributed to the thread name instead.
+
+    At most max_entries distinct keys are kept, the rest of the calls are
+    accounted per API and HTTP method under the '<other>' caller.
+    """
+    def __init__(self,
+                 slow_threshold: float = 1.0,
+                 max_entries: int = 1024,
+                 max_slow_calls: int = 64):
+        self.slow_threshold = slow_threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._stats: Dict[CallKey, CallStats] = {}
+        self._slow_calls: Deque[Dict[str, Any]] = deque(maxlen=max_slow_calls)
+        self._local = threading.local()
+
+    def set_message(self, message: Optional[str]) -> None:
+        """
+        Sets the name of the message being processed by the current thread.
+        """
+        self._local.message = message
+
+    def _get_message(self) -> str:
+        message: Optional[str] = getattr(self._local, 'message', None)
+        if message:
+            return message
+        # Thread names like 'qconsumer-3' or 'ThreadPoolExecutor-0_1' would
+        # make a key per thread.
+        return threading.current_thread().name.rstrip('0123456789_-')
+
+    def record(self, api: str, method: str, path: str, params: Any,
+               size: int, seconds: float, failed: bool) -> None:
+        key_prefix = ''
+        if api == '/v1/kv':
+            key_prefix = get_key_prefix(path[len('/v1/kv/'):])
+        recurse = _get_param(params, 'recurse') is not None
+        blocking = _get_param(params, 'index') is not None
+        caller = _get_caller(sys._getframe(1))
+        message = self._get_message()
+        key: CallKey = (caller, message, api, method, key_prefix, recurse,
+                        blocking)
+        with self.lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_entries:
+                    key = (OTHER, '', api, method, '', False, blocking)
+                stats = self._stats.setdefault(key, CallStats())
+            stats.count += 1
+            stats.errors += int(failed)
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += size
+            is_slow = seconds >= self.slow_threshold and not blocking
+            if is_slow:
+                self._slow_calls.append({
+                    'time': time.time(),
+                    'caller': caller,
+                    'message': message,
+                    'method': method,
+                    'path': path,
+                    'recurse': recurse,
+                    'bytes': size,
+                    'seconds': seconds
+                })
+        if is_slow:
+            LOG.warning(
+                'Slow Consul call: %s %s%s took %.3f s (%d bytes), '
+                'caller=%s, message=%s', method, path,
+                ' (recurse)' if recurse else '', seconds, size, caller,
+                message)
+
+    def dump(self) -> Dict[str, Any]:
+        """
+        Returns the accounted calls (the most time consuming first) and the
+        recent slow calls.
+        """
+        with self.lock:
+            items = [(k, CallStats(**vars(v))) for k, v in self._stats.items()]
+            slow_calls = list(self._slow_calls)
+        items.sort(key=lambda x: x[1].seconds, reverse=True)
+        fields = ('caller', 'message', 'api', 'method', 'key_prefix',
+                  'recurse', 'blocking')
+        calls = [{**dict(zip(fields, key)), **vars(stats)}
+                 for key, stats in items]
+        return {
+            'slow_threshold': self.slow_threshold,
+            'calls': calls,
+            'slow_calls': slow_calls
+        }
+
+    def reset(self) -> None:
+        with self.lock:
+            self._stats.clear()
+            self._slow_calls.clear()
+
+
+# Accounts the calls of all the Consul clients of the process
+TRACER = ConsulTracer()
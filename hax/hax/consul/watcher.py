@@ -0,0 +1,101 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import logging
+from threading import Event
+from typing import Optional
+
+from hax.consul.mirror import KVMirror
+from hax.exception import HAConsistencyException, InterruptedException
+from hax.types import StoppableThread
+from hax.util import KVAdapter, wait_for_event
+
+__all__ = ['KVWatcher']
+
+LOG = logging.getLogger('hax')
+
+
+class KVWatcher(StoppableThread):
+    """
+    Keeps the given prefix of the KV mirror up to date.
+
+    The thread issues Consul blocking queries: every request carries the
+    X-Consul-Index of the previous response, so Consul replies only when
+    something has changed under the prefix (or when wait_sec expires).
+    """
+    def __init__(self,
+                 kv: KVAdapter,
+                 mirror: KVMirror,
+                 prefix: str,
+                 wait_sec: int = 10,
+                 retry_interval_sec: float = 5):
+        super().__init__(target=self._execute,
+                         name=f'kv-watcher-{prefix.strip("/")}')
+        self.stopped = False
+        self.kv = kv
+        self.mirror = mirror
+        self.prefix = prefix
+        self.wait_sec = wait_sec
+        self.retry_interval_sec = retry_interval_sec
+        self.event = Event()
+
+    def stop(self) -> None:
+        LOG.debug('Stop signal received')
+        self.stopped = True
+        self.event.set()
+
+    def _execute(self):
+        index: Optional[int] = None
+        try:
+            LOG.info('KV watcher thread has started for %s', self.prefix)
+            while not self.stopped:
+                try:
+                    new_index, items = self.kv.kv_get_raw(
+                        self.prefix,
+                        recurse=True,
+                        index=index,
+                        wait=f'{self.wait_sec}s')
+                except HAConsistencyException:
+                    LOG.warning('Failed to watch %s in Consul KV, the local '
+                                'copy is not used until the next successful '
+                                'response', self.prefix)
+                    self.mirror.mark_stale(self.prefix)
+                    index = None
+                    wait_for_event(self.event, self.retry_interval_sec)
+                    continue
+                if self.stopped:
+                    break
+                new_index = int(new_index)
+                if index is not None and new_index < index:
+                    # Consul index went backwards (e.g. Consul server data
+                    # got restored); the index must be reset then.
+                    LOG.debug('X-Consul-Index reset for %s', self.prefix)
+                    self.mirror.mark_stale(self.prefix)
+                    index = None
+                    continue
+                self.mirror.apply(self.prefix, new_index, items)
+                index = new_index
+        except InterruptedException:
+            # No op. _sleep() has interrupted before the timeout exceeded:
+            # the application is shutting down.
+            pass
+        except Exception:
+            LOG.exception('Aborting due to an error')
+        finally:
+            self.mirror.mark_stale(self.prefix)
+            LOG.debug('KV watcher thread exited for %s', self.prefix)
@@ -19,8 +19,10 @@
 import datetime
 import logging
 from threading import Event
+from time import monotonic
 
 from hax.exception import HAConsistencyException, InterruptedException
+from hax.metrics import UPDATER_ITERATION
 from hax.motr import Motr, log_exception
 from hax.types import FsStatsWithTime, StoppableThread
 from hax.util import ConsulUtil, wait_for_event
@@ -55,6 +57,7 @@ class FsStatsUpdater(StoppableThread):
                         not all(self.consul.ensure_ioservices_running()))):
                     wait_for_event(self.event, self.interval_sec)
                     continue
+                started = monotonic()
                 stats = motr.get_filesystem_stats()
                 if not stats:
                     continue
@@ -70,6 +73,7 @@ class FsStatsUpdater(StoppableThread):
                              'due to an intermittent error. The '
                              'error is swallowed since new attempts '
                              'will be made timely')
+                UPDATER_ITERATION.observe(monotonic() - started, 'filestats')
                 wait_for_event(self.event, self.interval_sec)
         except InterruptedException:
             # No op. _sleep() has interrupted before the timeout exceeded:
@@ -18,6 +18,7 @@
 
 import datetime
 import logging
+from time import monotonic
 from typing import List, Any
 from hax.message import (BroadcastHAStates, Die, EntrypointRequest,
                          FirstEntrypointRequest, HaNvecGetEvent,
@@ -27,7 +28,9 @@ from hax.message import (BroadcastHAStates, Die, EntrypointRequest,
                          SnsRebalanceStop, SnsRepairPause, SnsRepairResume,
                          SnsRepairStart, SnsRepairStatus, SnsRepairStop,
                          StobIoqError)
+from hax.consul.trace import TRACER
 from hax.exception import HAConsistencyException, NotDelivered
+from hax.metrics import REGISTRY
 from hax.motr import Motr
 from hax.motr.delivery import DeliveryHerald
 from hax.motr.planner import WorkPlanner
@@ -42,6 +45,13 @@ from hax.ha import get_producer
 
 LOG = logging.getLogger('hax')
 
+BUSY_CONSUMERS = REGISTRY.gauge(
+    'hax_consumer_threads_busy',
+    'Number of ConsumerThread threads executing a command')
+EXECUTION_TIME = REGISTRY.histogram(
+    'hax_command_execution_seconds',
+    'Time ConsumerThread spends executing a command', ['command'])
+
 
 class ConsumerThread(StoppableThread):
     """
@@ -345,6 +355,9 @@ class ConsumerThread(StoppableThread):
                     LOG.debug('Waiting for the next message')
 
                     item = planner.get_next_command()
+                    started = monotonic()
+                    BUSY_CONSUMERS.inc()
+                    TRACER.set_message(type(item).__name__)
 
                     LOG.debug('Got %s message from planner', item)
                     if isinstance(item, FirstEntrypointRequest):
@@ -417,8 +430,8 @@ class ConsumerThread(StoppableThread):
                         else:
                             LOG.warning('Could not sent an event as producer'
                                         ' is not available')
-                        if item.reply_to:
-                            item.reply_to.put(result)
+                        for reply_to in item.reply_queues():
+                            reply_to.put(result)
                     elif isinstance(item, StobIoqError):
                         LOG.info('Stob IOQ: %s', item.fid)
                         payload = dump_json(item)
@@ -471,6 +484,10 @@ class ConsumerThread(StoppableThread):
                     # no op, swallow the exception
                     LOG.exception('**ERROR**')
                 finally:
+                    TRACER.set_message(None)
+                    BUSY_CONSUMERS.dec()
+                    EXECUTION_TIME.observe(monotonic() - started,
+                                           type(item).__name__)
                     planner.notify_finished(item)
         except StopIteration:
             LOG.info('Consumer Stopped')
@@ -0,0 +1,148 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import asyncio
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+from hax.metrics import REGISTRY
+
+__all__ = ['HandlerPool', 'HandlerPoolStats', 'get_pools_stats']
+
+LOG = logging.getLogger('hax')
+
+HANDLERS = REGISTRY.gauge('hax_http_handlers',
+                          'Number of queued and running HTTP handlers',
+                          ['pool', 'state'])
+REJECTED_REQUESTS = REGISTRY.counter('hax_http_rejected_requests_total',
+                                     'Number of rejected HTTP requests',
+                                     ['pool', 'reason'])
+
+
+@dataclass
+class HandlerPoolStats:
+    # Number of the handlers waiting for a free thread
+    queued: int = 0
+    # Number of the handlers being executed
+    running: int = 0
+    # Number of the handlers executed since the start
+    completed: int = 0
+    # Number of the requests rejected because the queue was full
+    rejected: int = 0
+
+
+class HandlerPool:
+    """
+    Bounded thread pool that executes the blocking parts of the HTTP
+    handlers of some route class.
+
+    Unlike the default executor of the event loop, the pool limits the
+    number of the handlers waiting for a thread: when max_queued handlers
+    are waiting already, the request is rejected with 429 Too Many Requests
+    (the client is supposed to retry after retry_after seconds).
+
+    max_queued=None makes the queue unbounded; such a pool is meant for the
+    requests that are never retried by the client (e.g. the Consul watch
+    handlers), so they are never rejected.
+    """
+    def __init__(self,
+                 name: str,
+                 max_workers: int,
+                 max_queued: Optional[int],
+                 retry_after: int = 1):
+        self.name = name
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix=f'http-{name}')
+        self.lock = Lock()
+        self.stats = HandlerPoolStats()
+        HANDLERS.set_function(lambda: self.get_stats().queued, name, 'queued')
+        HANDLERS.set_function(lambda: self.get_stats().running, name,
+                              'running')
+
+    def get_stats(self) -> HandlerPoolStats:
+        with self.lock:
+            return HandlerPoolStats(**vars(self.stats))
+
+    def _reject(self) -> web.HTTPException:
+        with self.lock:
+            self.stats.rejected += 1
+        REJECTED_REQUESTS.inc(self.name, 'queue_full')
+        LOG.warning('Too many %s requests are queued (limit is %d), '
+                    'rejecting the request', self.name, self.max_queued)
+        return web.HTTPTooManyRequests(
+            headers={'Retry-After': str(self.retry_after)})
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Executes fn(*args) in the pool and returns its result.
+
+        Raises HTTPTooManyRequests if the queue of the pool is full.
+        """
+        stats = self.stats
+        with self.lock:
+            full = self.max_queued is not None and \
+                stats.queued >= self.max_queued
+            if not full:
+                stats.queued += 1
+        if full:
+            raise self._reject()
+        started = False
+
+        def wrapper() -> Any:
+            nonlocal started
+            with self.lock:
+                started = True
+                stats.queued -= 1
+                stats.running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    stats.running -= 1
+                    stats.completed += 1
+
+        def on_done(future: Future) -> None:
+            # The handler can be cancelled (e.g. the client has disconnected)
+            # before it gets a thread.
+            with self.lock:
+                if not started:
+                    stats.queued -= 1
+
+        try:
+            future = self.executor.submit(wrapper)
+        except RuntimeError:
+            # The pool is shut down already
+            with self.lock:
+                stats.queued -= 1
+            raise
+        future.add_done_callback(on_done)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def get_pools_stats(pools: Dict[str, HandlerPool]) -> Dict[str, Any]:
+    return {name: vars(pool.get_stats()) for name, pool in pools.items()}
@@ -30,6 +30,10 @@ import codecs
 import os
 
 from hax.common import HaxGlobalState, di_configuration
+from hax.consul.cache import configure_shared_cache
+from hax.consul.client import configure_transport
+from hax.consul.mirror import configure_kv_mirror
+from hax.consul.watcher import KVWatcher
 from hax.exception import HAConsistencyException
 from hax.filestats import FsStatsUpdater
 from hax.ha import create_ha_thread
@@ -43,7 +47,7 @@ from hax.motr.planner import WorkPlanner
 from hax.motr.rconfc import RconfcStarter
 from hax.server import ServerRunner
 from hax.types import Fid, Profile, StoppableThread
-from hax.util import ConsulUtil, ProcessGroup, repeat_if_fails
+from hax.util import ConsulUtil, KVAdapter, ProcessGroup, repeat_if_fails
 
 
 __all__ = ['main']
@@ -53,6 +57,9 @@ HL_Fids = NamedTuple('HL_Fids', [('hax_ep', str), ('hax_fid', Fid),
 
 LOG = logging.getLogger('hax')
 
+# TODO make the number of threads configurable
+NR_CONSUMERS = 32
+
 
 def log_exception(fn):
     def wrapper(*args, **kwargs):
@@ -91,6 +98,22 @@ def _run_bc_updater_thread(motr: Motr,
     return _run_thread(ByteCountUpdater(motr, consul_util, interval_sec=600))
 
 
+def _run_kv_watcher_threads(
+        consul_util: ConsulUtil) -> List[StoppableThread]:
+    # The keys that are read on (almost) every event are mirrored locally,
+    # see KVMirror. The mirror is shared by all the KV adapters, including
+    # the ones created ad hoc.
+    mirror = configure_kv_mirror(
+        ['m0conf/', 'processes/', 'failvec', 'leader'])
+    consul_util.attach_kv_mirror(mirror)
+    # Note: blocking queries hold a pooled HTTP connection for up to
+    # wait_sec seconds (see configure_transport() in main()).
+    return [
+        _run_thread(KVWatcher(KVAdapter(), mirror, prefix))
+        for prefix in mirror.prefixes
+    ]
+
+
 @repeat_if_fails()
 def _remove_stale_session(util: ConsulUtil) -> None:
     """
@@ -185,6 +208,15 @@ def main():
     # process needs to shutdown).
     signal.signal(signal.SIGINT, handle_signal)
 
+    # The results of Consul lookups are shared by the consumer threads for a
+    # short time: during an event storm they tend to resolve the same
+    # objects over and over again.
+    configure_shared_cache(ttl=2, max_size=4096)
+    # All the Consul clients share the connection pool. Besides the consumer
+    # threads, Consul is used by the KV watchers, the HTTP handler pools
+    # and the updater threads.
+    configure_transport(pool_size=NR_CONSUMERS + 16)
+
     util: ConsulUtil = ConsulUtil()
     # Avoid removing session on hax start as this will happen
     # on every node, thus leader election will keep re-triggering
@@ -194,6 +226,8 @@ def main():
     cfg: HL_Fids = _get_motr_fids(util)
     hax_http_port = util.get_hax_http_port()
     util.init_motr_processes_status()
+    kv_watchers = _run_kv_watcher_threads(util)
+    util.precompute_process_closures()
     # By default health_message will be subscribed to 'node' events
     ha_util = HaUtils(util)
     ha_util.event_subscribe({'node': 'health_message'})
@@ -212,10 +246,10 @@ def main():
     # to reply it.
 
     process_groups = ProcessGroup(32)
-    # TODO make the number of threads configurable
     consumer_threads = [
         _run_qconsumer_thread(planner, motr, herald,
-                              util, process_groups, i) for i in range(32)
+                              util, process_groups, i)
+        for i in range(NR_CONSUMERS)
     ]
 
     try:
@@ -239,6 +273,7 @@ def main():
                               consul_util=util,
                               hax_state=state)
         server.run(threads_to_wait=[*consumer_threads,
+                                    *kv_watchers,
                                     stats_updater,
                                     bc_updater,
                                     rconfc_starter,
@@ -29,6 +29,11 @@ from hax.types import (ConfHaProcess, Fid, HaNote, HAState, StobId, Uint128,
 class BaseMessage:
     # The group id used internally by WorkPlanner
     group: Optional[int] = field(default=None, init=False)
+    # When the command was added to WorkPlanner (time.monotonic() value)
+    enqueued_at: Optional[float] = field(default=None,
+                                         init=False,
+                                         compare=False,
+                                         repr=False)
 
 
 @dataclass(unsafe_hash=True)
@@ -40,6 +45,8 @@ class AnyEntrypointRequest(BaseMessage):
     git_rev: str
     pid: int
     is_first_request: bool
+    # True if the request has been postponed already (see DeferredReplies)
+    deferred: bool = False
 
 
 @dataclass(unsafe_hash=True)
@@ -68,6 +75,12 @@ class ProcessHaEvent(BaseMessage):
 class BroadcastHAStates(BaseMessage):
     states: List[HAState]
     reply_to: Optional[Queue]
+    # Reply queues of the commands merged into this one by WorkPlanner
+    merged_reply_to: List[Queue] = field(default_factory=list)
+
+    def reply_queues(self) -> List[Queue]:
+        queues = [self.reply_to] if self.reply_to else []
+        return queues + self.merged_reply_to
 
 
 @dataclass
@@ -173,9 +186,9 @@ class StobIoqError(BaseMessage):
         for fld in fields(self):
             f_type = fld.type
             f_name = fld.name
-            if f_name == 'group':
-                # group is a thing used by WorkPlanner for task scheduling
-                # logic. We don't need to expose it
+            if f_name in ('group', 'enqueued_at'):
+                # group and enqueued_at are the things used by WorkPlanner
+                # for task scheduling logic. We don't need to expose them
                 continue
             val = getattr(self, f_name)
             to_str = as_str
@@ -0,0 +1,263 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+"""
+Minimal implementation of the metrics exposed in Prometheus text format
+(version 0.0.4) at the /metrics endpoint of hax.
+
+The module has no dependencies: hax needs just a few counters, gauges and
+histograms, so prometheus_client is not worth a new runtime dependency.
+"""
+
+import logging
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+__all__ = [
+    'CONTENT_TYPE', 'Counter', 'Gauge', 'Histogram', 'REGISTRY', 'Registry'
+]
+
+LOG = logging.getLogger('hax')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default histogram buckets (seconds)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, doc: str,
+                 label_names: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(label_names)
+        self.lock = Lock()
+
+    def _check_labels(self, labels: Labels) -> None:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f'{self.name}: {self.label_names} labels '
+                             f'expected, {labels} given')
+
+    def _format_labels(self,
+                       labels: Labels,
+                       extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, labels))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        text = ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return '{' + text + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}'
+        ] + self.samples()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, doc: str,
+                 label_names: Sequence[str] = ()):
+        super().__init__(name, doc, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._check_labels(labels)
+        with self.lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        with self.lock:
+            return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self._values.items())
+        return [
+            f'{self.name}{self._format_labels(k)} {_format_value(v)}'
+            for k, v in values
+        ]
+
+
+class Gauge(Metric):
+    """
+    Gauge whose values are either set explicitly or computed by the given
+    functions when the metrics are collected (see set_function()).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, doc: str,
+                 label_names: Sequence[str] = ()):
+        super().__init__(name, doc, label_names)
+        self._values: Dict[Labels, float] = {}
+        self._functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._check_labels(labels)
+        with self.lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._check_labels(labels)
+        with self.lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, fn: Callable[[], float], *labels: str) -> None:
+        self._check_labels(labels)
+        with self.lock:
+            self._functions[labels] = fn
+
+    def get(self, *labels: str) -> float:
+        with self.lock:
+            fn = self._functions.get(labels)
+            value = self._values.get(labels, 0)
+        return fn() if fn else value
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for labels, fn in functions.items():
+            try:
+                values[labels] = fn()
+            except Exception:
+                LOG.exception('Failed to collect %s%s', self.name, labels)
+        return [
+            f'{self.name}{self._format_labels(k)} {_format_value(v)}'
+            for k, v in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 doc: str,
+                 label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, label_names)
+        self.buckets = tuple(sorted(map(float, buckets))) + (float('inf'), )
+        # labels -> (per-bucket counts, sum of the observed values)
+        self._values: Dict[Labels, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        self._check_labels(labels)
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self._values.get(labels,
+                                             ([0] * len(self.buckets), 0.0))
+            counts[idx] += 1
+            self._values[labels] = (counts, total + value)
+
+    def get_count(self, *labels: str) -> int:
+        with self.lock:
+            counts, _ = self._values.get(labels, ([], 0.0))
+            return sum(counts)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted((k, (list(c), s))
+                            for k, (c, s) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = self._format_labels(labels, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            suffix = self._format_labels(labels)
+            lines.append(f'{self.name}_sum{suffix} {_format_value(total)}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is registered already')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, doc: str,
+                label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, doc, label_names)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, doc: str,
+              label_names: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, doc, label_names)
+        self.register(metric)
+        return metric
+
+    def histogram(self,
+                  name: str,
+                  doc: str,
+                  label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, doc, label_names, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = [self._metrics[k] for k in sorted(self._metrics)]
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# The registry of all hax metrics
+REGISTRY = Registry()
+
+# Shared by the background updater threads (see ByteCountUpdater and
+# FsStatsUpdater)
+UPDATER_ITERATION = REGISTRY.histogram(
+    'hax_updater_iteration_seconds',
+    'Duration of the iterations of the background updater threads',
+    ['updater'])
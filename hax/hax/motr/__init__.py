@@ -17,31 +17,42 @@
 #
 
 import ctypes as c
+from dataclasses import replace
 from errno import EAGAIN
 import logging
 from typing import Any, List, Optional, Tuple
-from time import sleep
+from time import monotonic
 
-from hax.consul.cache import supports_consul_cache, uses_consul_cache
+from hax.consul.cache import (InvocationCache, supports_consul_cache,
+                              uses_consul_cache)
 from hax.exception import (BytecountException, ConfdQuorumException,
                            RepairRebalanceException)
-from hax.message import (EntrypointRequest, FirstEntrypointRequest,
+from hax.message import (AnyEntrypointRequest, EntrypointRequest,
+                         FirstEntrypointRequest,
                          HaNvecGetEvent, HaNvecSetEvent, ProcessEvent,
                          StobIoqError)
+from hax.metrics import REGISTRY
 from hax.motr.delivery import DeliveryHerald
+from hax.motr.entrypoint import (EAGAIN_REPLIES, DeferredReplies,
+                                 EntrypointCache)
 from hax.motr.ffi import HaxFFI, make_array, make_c_str
 from hax.motr.planner import WorkPlanner
+from hax.motr.util import NoteSet
 from hax.types import (ByteCountStats, ConfHaProcess, Fid, FidStruct, FsStats,
                        HaLinkMessagePromise, HaNote, HaNoteStruct, HAState,
-                       MessageId, ObjT, FidTypeToObjT, Profile, PverInfo,
+                       MessageId, ObjT, Profile, PverInfo,
                        ReprebStatus, ObjHealth,
                        m0HaProcessEvent, m0HaProcessType)
-from hax.util import ConsulUtil, repeat_if_fails, FidWithType, PutKV
+from hax.util import ConsulUtil, repeat_if_fails, PutKV
 
 LOG = logging.getLogger('hax')
 
 MAX_MOTR_NVEC_UPDATE_SZ = 1024
 
+DUPLICATE_NOTES = REGISTRY.counter(
+    'hax_broadcast_duplicate_notes_total',
+    'Number of duplicate HA notes dropped before the broadcast')
+
 
 def log_exception(fn):
     def wrapper(*args, **kwargs):
@@ -67,6 +78,10 @@ class Motr:
         self.planner = planner
         self.herald = herald
         self.consul_util = consul_util
+        self.entrypoint_cache = EntrypointCache(consul_util)
+        # The entrypoint requests that can't be served right away are
+        # resubmitted to the planner later on (see DeferredReplies).
+        self.deferred_replies = DeferredReplies(self._resubmit_entrypoint)
         self.spiel_ready = False
         self.is_stopping = False
 
@@ -109,6 +124,8 @@ class Motr:
     def stop(self):
         LOG.info('Stopping motr')
         self.is_stopping = True
+        for request in self.deferred_replies.stop():
+            self._reply_entrypoint_error(request, EAGAIN)
         self.notify_hax_stop()
         if self.is_spiel_ready():
             self.stop_rconfc()
@@ -194,7 +211,7 @@ class Motr:
         LOG.info('Processing entrypoint request from remote endpoint'
                  " '{}', process fid {}".format(remote_rpc_endpoint,
                                                 str(process_fid)))
-        sess = principal_rm = confds = None
+        confds = None
         try:
             util = self.consul_util
             # Disabling dynamic fids allocation until dtm is ready to consume.
@@ -208,12 +225,17 @@ class Motr:
             # stopped.
             rc_quorum = 0
             rm_fid = Fid(0, 0)
+            rm_eps = None
             if self.is_stopping:
                 confds = []
             else:
-                sess = util.get_leader_session()
-                principal_rm = util.get_session_node(sess)
-                confds = util.get_confd_list()
+                # The data is shared by all the requests that arrive while
+                # the RC leader stays the same (see EntrypointCache).
+                info = self.entrypoint_cache.get()
+                confds = info.confds
+                rm_fid = info.rm_fid
+                rc_quorum = info.quorum
+                rm_eps = info.rm_eps
 
             # Hax may receive entrypoint requests multiple times during its
             # lifetime. Hax starts motr rconfc to invoke spiel commands. Motr
@@ -246,22 +268,11 @@ class Motr:
             #             active_confds.append(confd)
             #     confds = active_confds
 
-            if confds:
-                rm_fid = util.get_rm_fid()
-                rc_quorum = int(len(confds) / 2 + 1)
-            rm_eps = None
-            for svc in confds:
-                if svc.node == principal_rm:
-                    rm_eps = svc.address
-                    break
             if confds and (not self.is_stopping) and (not rm_eps):
                 if util.m0ds_stopping():
                     e_rc = 0
                 raise RuntimeError('No RM node found in Consul')
         except Exception:
-            LOG.exception('Failed to get the data from Consul.'
-                          ' Replying with EAGAIN error code, with a 1'
-                          ' second delay.')
             # If replied EAGAIN, motr immediately sends a subsequent entrypoint
             # request and it is observed that several entrypoint requests are
             # received by hare in a second. This floods Hare, as an
@@ -271,12 +282,19 @@ class Motr:
             # discussion, it is agreed upon to have a temporary fix in Hare.
             # https://jts.seagate.com/browse/EOS-27068 motr ticket is created
             # to track the same.
-            sleep(1)
-            self._ffi.entrypoint_reply(reply_context, req_id.to_c(), e_rc, 0,
-                                       make_array(FidStruct, []),
-                                       make_array(c.c_char_p, []), 0,
-                                       Fid(0, 0).to_c(), None)
-            LOG.info('Reply sent')
+            #
+            # The request is postponed (without occupying the consumer
+            # thread) and processed once again; EAGAIN is replied if the
+            # data is still unavailable.
+            if not message.deferred and not self.is_stopping:
+                delay = self.deferred_replies.defer(message)
+                LOG.exception('Failed to get the data from Consul. The'
+                              ' request is postponed for %.1f seconds',
+                              delay)
+                return
+            LOG.exception('Failed to get the data from Consul.'
+                          ' Replying with EAGAIN error code.')
+            self._reply_entrypoint_error(message, e_rc)
             return
 
         confd_fids = [x.fid.to_c() for x in confds]
@@ -290,6 +308,20 @@ class Motr:
                                               confd_eps), rc_quorum,
                                    rm_fid.to_c(), make_c_str(rm_eps))
         LOG.info('Entrypoint request has been replied to')
+        self.deferred_replies.reset(process_fid)
+
+    def _resubmit_entrypoint(self, message: AnyEntrypointRequest) -> None:
+        self.planner.add_command(replace(message, deferred=True))
+
+    def _reply_entrypoint_error(self, message: AnyEntrypointRequest,
+                                rc: int) -> None:
+        EAGAIN_REPLIES.inc()
+        self._ffi.entrypoint_reply(message.reply_context,
+                                   message.req_id.to_c(), rc, 0,
+                                   make_array(FidStruct, []),
+                                   make_array(c.c_char_p, []), 0,
+                                   Fid(0, 0).to_c(), None)
+        LOG.info('Reply sent')
 
     @supports_consul_cache
     def broadcast_ha_states(self,
@@ -315,72 +347,84 @@ class Motr:
             return proc_eps
 
         hax_fid = self.consul_util.get_hax_fid()
-        notes = []
+        # The same node, enclosure, controller and drive notes are generated
+        # for every process of a node, so the notes are deduplicated.
+        notes = NoteSet()
         proc_eps_skip: Any = []
         if proc_skip_list is not None:
             proc_eps_skip = _proc_fids_to_eps(proc_skip_list)
 
-        for st in ha_states:
-            if st.status == ObjHealth.UNKNOWN:
-                continue
-            # If its a client process then update the base fid to its full
-            # fid.
-            # if (st.fid.container == ObjT.PROCESS.value and
-            #         self.consul_util.is_proc_client(st.fid)):
-            #      proc_full_fid = self.consul_util.get_obj_full_fid(st.fid)
-            #     st.fid = proc_full_fid
-            note = HaNoteStruct(st.fid.to_c(), st.status.to_ha_note_status())
-            notes.append(note)
-
-            # For process failure, we report failure for the corresponding
-            # node (enclosure) and CVGs if all Io services are failed.
-            # We avoid broadcasting for the configuration tree corresponding
-            # to motr client processes, S3servers and hax, as the
-            # failure of them does not affect the motr storage devices.
-            # In some cases the broadcast need not be to Motr processes and
-            # s3servers, e.g. for motr-mkfs processes, but the motr-mkfs
-            # event still needs to be delivered to hax's motr land in-order
-            # to update the hax-motr halink state. hax-motr halink is
-            # established when hax responds to Motr/S3server entrypoint
-            # request and terminated when Motr/S3server process notifies
-            # M0_CONF_HA_PROCESS_STOPPED.
-            if (st.fid.container == ObjT.PROCESS.value
-                    and _update_process_tree(st.fid, st.status)):
-
-                if st.fid.container == ObjT.PROCESS.value and update_kv:
-                    LOG.info('ha_broadcast:set_process_state')
-                    self.consul_util.set_process_state(st.fid, st.status)
-
-                notes += self._generate_sub_services(note,
-                                                     self.consul_util,
-                                                     update_kv,
-                                                     notify_devices,
-                                                     kv_cache=kv_cache)
-                # Check if we need to mark node as failed,
-                # otherwise just mark controller as failed/OK
-                # If we receive process failure then we will check if all IO
-                # services are failed, if True then we will mark node as failed
-                # If we receive process 'OK' then we will check if node is
-                # not in failed state then we will mark node as OK
-                # If both the above conditions are not true then we will just
-                # mark controller status
-                notes += self.notify_node_status_by_process(
-                            note, update_kv, kv_cache=kv_cache)
-            if st.fid.container == ObjT.DRIVE.value and update_kv:
-                self.consul_util.update_drive_state([st.fid],
-                                                    st.status,
-                                                    kv_cache=kv_cache)
-            elif st.fid.container == ObjT.NODE.value:
-                if update_kv:
-                    self.consul_util.set_node_state(st.fid,
-                                                    st.status,
-                                                    kv_cache=kv_cache)
-                notes += self.add_enclosing_devices_by_node(
-                             st.fid, st.status, update_kv,
-                             kv_cache=kv_cache)
+        # All the KV updates are accumulated and written with a few KV
+        # transactions before the notes are broadcast.
+        with self.consul_util.kv.batch():
+            for st in ha_states:
+                if st.status == ObjHealth.UNKNOWN:
+                    continue
+                # If its a client process then update the base fid to its
+                # full fid.
+                # if (st.fid.container == ObjT.PROCESS.value and
+                #         self.consul_util.is_proc_client(st.fid)):
+                #     proc_full_fid = self.consul_util.get_obj_full_fid(
+                #         st.fid)
+                #     st.fid = proc_full_fid
+                note = HaNoteStruct(st.fid.to_c(),
+                                    st.status.to_ha_note_status())
+                notes.add(note)
+
+                # For process failure, we report failure for the
+                # corresponding node (enclosure) and CVGs if all Io services
+                # are failed. We avoid broadcasting for the configuration tree
+                # corresponding to motr client processes, S3servers and hax,
+                # as the failure of them does not affect the motr storage
+                # devices. In some cases the broadcast need not be to Motr
+                # processes and s3servers, e.g. for motr-mkfs processes, but
+                # the motr-mkfs event still needs to be delivered to hax's
+                # motr land in-order to update the hax-motr halink state.
+                # hax-motr halink is established when hax responds to
+                # Motr/S3server entrypoint request and terminated when
+                # Motr/S3server process notifies M0_CONF_HA_PROCESS_STOPPED.
+                if (st.fid.container == ObjT.PROCESS.value
+                        and _update_process_tree(st.fid, st.status)):
+
+                    if st.fid.container == ObjT.PROCESS.value and update_kv:
+                        LOG.info('ha_broadcast:set_process_state')
+                        self.consul_util.set_process_state(st.fid, st.status)
+
+                    notes.extend(
+                        self._generate_sub_services(note,
+                                                    self.consul_util,
+                                                    update_kv,
+                                                    notify_devices,
+                                                    kv_cache=kv_cache))
+                    # Check if we need to mark node as failed,
+                    # otherwise just mark controller as failed/OK
+                    # If we receive process failure then we will check if all
+                    # IO services are failed, if True then we will mark node
+                    # as failed
+                    # If we receive process 'OK' then we will check if node is
+                    # not in failed state then we will mark node as OK
+                    # If both the above conditions are not true then we will
+                    # just mark controller status
+                    notes.extend(self.notify_node_status_by_process(
+                        note, update_kv, kv_cache=kv_cache))
+                if st.fid.container == ObjT.DRIVE.value and update_kv:
+                    self.consul_util.update_drive_state([st.fid],
+                                                        st.status,
+                                                        kv_cache=kv_cache)
+                elif st.fid.container == ObjT.NODE.value:
+                    if update_kv:
+                        self.consul_util.set_node_state(st.fid,
+                                                        st.status,
+                                                        kv_cache=kv_cache)
+                    notes.extend(self.add_enclosing_devices_by_node(
+                        st.fid, st.status, update_kv, kv_cache=kv_cache))
         if not notes:
             return []
-        message_ids = self._ha_broadcast(notes, broadcast_hax_only,
+        if notes.nr_duplicates:
+            LOG.info('%d duplicate notes dropped, %d of %d notes left',
+                     notes.nr_duplicates, len(notes), notes.nr_added)
+            DUPLICATE_NOTES.inc(amount=notes.nr_duplicates)
+        message_ids = self._ha_broadcast(notes.to_list(), broadcast_hax_only,
                                          proc_eps_skip)
 
         return message_ids
@@ -470,15 +514,17 @@ class Motr:
     def ha_nvec_get_reply(self, event: HaNvecGetEvent, kv_cache=None) -> None:
         LOG.info('Preparing the reply for HaNvecGetEvent (nvec size = %s)',
                  len(event.nvec))
-        self.consul_util.get_all_nodes()
+        started = monotonic()
+        fids = [Fid.from_struct(n.note.no_id) for n in event.nvec]
+        states = self.consul_util.get_conf_obj_statuses(fids,
+                                                        kv_cache=kv_cache)
         notes: List[HaNoteStruct] = []
-        for n in event.nvec:
-            fid = Fid.from_struct(n.note.no_id)
-            n.note.no_state = self.consul_util.get_conf_obj_status(
-                FidTypeToObjT[fid.container], fid.key, kv_cache=kv_cache)
+        for n, state in zip(event.nvec, states):
+            n.note.no_state = state
             notes.append(n.note)
 
-        LOG.info('Replying ha nvec of length ' + str(len(event.nvec)))
+        LOG.info('Replying ha nvec of length %d (resolved in %.3f s)',
+                 len(notes), monotonic() - started)
         self._ffi.ha_nvec_reply(event.hax_msg, make_array(HaNoteStruct, notes),
                                 len(notes))
 
@@ -522,28 +568,24 @@ class Motr:
                                kv_cache=None) -> List[HaNoteStruct]:
         new_state = note.no_state
         fid = Fid.from_struct(note.no_id)
-        service_list = cns.get_services_by_parent_process(fid,
-                                                          kv_cache=kv_cache)
+        closure = cns.get_process_closure(fid, kv_cache=kv_cache)
         LOG.debug('Process fid=%s encloses %s services as follows: %s', fid,
-                  len(service_list), service_list)
+                  len(closure.services), closure.services)
         service_notes = [
-            HaNoteStruct(no_id=cns.get_obj_full_fid(x.fid).to_c(),
-                         no_state=new_state)
-            for x in service_list
+            HaNoteStruct(no_id=x.to_c(), no_state=new_state)
+            for x in closure.service_fids
         ]
         if notify_devices:
-            service_notes += self._generate_sub_disks(note, service_list,
-                                                      cns, update_kv)
+            service_notes += self._generate_sub_disks(note, cns, update_kv)
         return service_notes
 
     @supports_consul_cache
     def _generate_sub_disks(self,
                             note: HaNoteStruct,
-                            services: List[FidWithType],
                             cns: ConsulUtil,
                             update_kv: bool,
                             kv_cache=None) -> List[HaNoteStruct]:
-        disk_list = []
+        disk_list: List[Fid] = []
         new_state = note.no_state
         proc_fid = Fid.from_struct(note.no_id)
 
@@ -560,8 +602,8 @@ class Motr:
         mkfs_down = is_mkfs and state != ObjHealth.OK
 
         if not mkfs_down:
-            for svc in services:
-                disk_list += cns.get_disks_by_parent_process(proc_fid, svc.fid)
+            disk_list = cns.get_process_closure(proc_fid,
+                                                kv_cache=kv_cache).drives
         if disk_list:
             # XXX: Need to check the current state of the device, transition
             # to ONLINE only in case of an explicit request or iff the prior
@@ -573,9 +615,14 @@ class Motr:
         LOG.debug('proc fid=%s encloses %d disks as follows: %s',
                   proc_fid, len(disk_list), disk_list)
         drive_ha_notes: List[HaNoteStruct] = []
+        # The states are read after the update above, so the lookups share
+        # their own cache instance (one m0conf/ fetch for all the drives).
+        sdev_cache = InvocationCache()
         for drive_id in disk_list:
             # Get the drive state from Consul KV.
-            dstate = cns.get_sdev_state(ObjT.DRIVE, drive_id.key)
+            dstate = cns.get_sdev_state(ObjT.DRIVE,
+                                        drive_id.key,
+                                        kv_cache=sdev_cache)
             drive_ha_notes.append(HaNoteStruct(no_id=drive_id.to_c(),
                                                no_state=dstate))
         return drive_ha_notes
@@ -604,11 +651,14 @@ class Motr:
     def get_update_encl_state(self, node_fid: Fid, new_state: ObjHealth,
                               update_kv: bool,
                               node: Optional[str] = None,
+                              encl_fid: Optional[Fid] = None,
                               kv_cache=None) -> List[HaNoteStruct]:
 
-        node = node or self.consul_util.get_node_name_by_fid(node_fid,
-                                                             kv_cache=kv_cache)
-        encl_fid = self.consul_util.get_node_encl_fid(node, kv_cache=kv_cache)
+        if encl_fid is None:
+            node = node or self.consul_util.get_node_name_by_fid(
+                node_fid, kv_cache=kv_cache)
+            encl_fid = self.consul_util.get_node_encl_fid(node,
+                                                          kv_cache=kv_cache)
         if update_kv:
             self.consul_util.set_encl_state(encl_fid, new_state,
                                             kv_cache=kv_cache)
@@ -682,7 +732,8 @@ class Motr:
         LOG.debug('Notifying node status for process_fid=%s state=%s',
                   proc_fid, new_state)
 
-        node = self.consul_util.get_process_node(proc_fid, kv_cache=kv_cache)
+        closure = self.consul_util.get_process_closure(proc_fid,
+                                                       kv_cache=kv_cache)
 
         notes = []
         updates: List[PutKV] = []
@@ -691,29 +742,28 @@ class Motr:
         # If we receive process 'OK', only the process state is
         # updated. So, we need to update the corresponding
         # controller state.
-        ctrl_fid = self.consul_util.get_ioservice_ctrl_fid(
-                    proc_fid, kv_cache=kv_cache)
+        ctrl_fid = closure.ctrl_fid
         if ctrl_fid:
             updates = self.consul_util.get_ctrl_state_updates(
                         ctrl_fid, new_state, kv_cache=kv_cache)
             notes.append(HaNoteStruct(no_id=ctrl_fid.to_c(),
                          no_state=proc_note.no_state))
 
-        node_fid = self.consul_util.get_node_fid(node, kv_cache=kv_cache)
+        node_fid = closure.node_fid
         # FIXME make these two functions to return List[PutKV] so that the
         # write operations can be delayed to reuse the cache as long as
         # possible
         if new_state in [ObjHealth.OFFLINE, ObjHealth.FAILED]:
             if self.is_node_failed(proc_note, kv_cache=kv_cache):
                 notes.extend(self.add_node_state_by_fid(node_fid, new_state))
-                notes.extend(self.get_update_encl_state(node_fid, new_state,
-                                                        update_kv,
-                                                        kv_cache=kv_cache))
+                notes.extend(self.get_update_encl_state(
+                    node_fid, new_state, update_kv, node=closure.node,
+                    encl_fid=closure.encl_fid, kv_cache=kv_cache))
         else:
             notes.extend(self.add_node_state_by_fid(node_fid, new_state))
-            notes.extend(self.get_update_encl_state(node_fid, new_state,
-                                                    update_kv,
-                                                    kv_cache=kv_cache))
+            notes.extend(self.get_update_encl_state(
+                node_fid, new_state, update_kv, node=closure.node,
+                encl_fid=closure.encl_fid, kv_cache=kv_cache))
         if update_kv:
             self._write_updates(updates, kv_cache)
         return notes
@@ -748,7 +798,8 @@ class Motr:
         proc_fid = Fid.from_struct(proc_note.no_id)
         assert ObjT.PROCESS.value == proc_fid.container
 
-        node = self.consul_util.get_process_node(proc_fid, kv_cache=kv_cache)
+        node = self.consul_util.get_process_closure(proc_fid,
+                                                    kv_cache=kv_cache).node
 
         return self.consul_util.all_io_services_failed(node, kv_cache=kv_cache)
 
@@ -16,13 +16,17 @@
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 #
 
+import heapq
 import logging
 import time
-from threading import Condition, Lock
-from typing import Dict, List
+from concurrent.futures import Future
+from itertools import count
+from threading import Condition, Lock, Thread
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from hax.exception import NotDelivered
 from hax.log import TRACE
+from hax.metrics import REGISTRY
 from hax.types import HaLinkMessagePromise, MessageId
 
 LOG = logging.getLogger('hax')
@@ -30,6 +34,40 @@ LOG = logging.getLogger('hax')
 # 10 seconds is the max time for the messages that nobody has started awaiting.
 MAX_UNSORTED_TTL = 10000
 
+PENDING_PROMISES = REGISTRY.gauge(
+    'hax_delivery_pending_promises',
+    'Number of promises awaiting the delivery confirmation from Motr')
+UNSORTED_DELIVERIES = REGISTRY.gauge(
+    'hax_delivery_unsorted',
+    'Number of delivery confirmations nobody has started awaiting yet')
+DELIVERY_WAIT = REGISTRY.histogram(
+    'hax_delivery_wait_seconds',
+    'Time spent awaiting the delivery confirmation from Motr', ['mode'])
+
+
+class _Waiter:
+    """
+    The state of a thread awaiting the given promise.
+    """
+    def __init__(self,
+                 promise: HaLinkMessagePromise,
+                 lock: Lock,
+                 future: Optional[Future] = None,
+                 wait_all: bool = False):
+        self.promise = promise
+        # Note that the condition shares DeliveryHerald.lock, so the
+        # deliveries can't be missed between the checks and the waits.
+        self.condition = Condition(lock)
+        # Confirmed messages that the awaiting thread hasn't seen yet
+        self.delivered: List[MessageId] = []
+        # Set if nobody is blocked on the promise: the future gets resolved
+        # by the thread that confirms the delivery (see watch_any()).
+        self.future = future
+        self.wait_all = wait_all
+        # All the confirmed messages of the promise (for future only)
+        self.confirmed: List[MessageId] = []
+        self.done = False
+
 
 class DeliveryHerald:
     """
@@ -53,6 +91,11 @@ class DeliveryHerald:
                                     len(notes))
         delivery_herald.wait_for_any(HaLinkMessagePromise(tag_list))
         # if we are here then the delivery was confirmed
+
+    notify_delivered() is invoked from Motr callback thread, so it must never
+    block for long: the awaited messages are indexed by MessageId (so the
+    awaiting client is found in O(1)) and the unsorted deliveries are expired
+    with help of a min-heap ordered by the delivery time.
     """
     def __init__(self, unsorted_ttl_msec: int = MAX_UNSORTED_TTL):
         """Inits DeliveryHerald.
@@ -61,34 +104,217 @@ class DeliveryHerald:
             unsorted_ttl_msec (int): time-to-live threshold for
                 unsorted_deliveries.
         """
-        self.recently_delivered: Dict[HaLinkMessagePromise,
-                                      List[MessageId]] = {}
-        self.waiting_clients: Dict[HaLinkMessagePromise, Condition] = {}
+        self.waiting_clients: Dict[HaLinkMessagePromise, _Waiter] = {}
+        # MessageId -> the clients awaiting the message (several promises
+        # may share the same MessageId, all of them get notified)
+        self.awaited: Dict[MessageId, List[_Waiter]] = {}
         self.unsorted_deliveries: Dict[MessageId, int] = {}
+        # (delivery timestamp, MessageId) pairs of unsorted_deliveries
+        self.unsorted_heap: List[Tuple[int, MessageId]] = []
         self.unsorted_ttl = unsorted_ttl_msec
         self.lock = Lock()
+        # (deadline, sequence number, waiter) for the futures given by
+        # watch_any() and watch_all(); the expired futures are failed by
+        # the timer thread.
+        self.deadlines: List[Tuple[float, int, _Waiter]] = []
+        self._seq = count()
+        self._timer_cond = Condition(self.lock)
+        self._timer: Optional[Thread] = None
 
-    def _verify_delivered(self, promise: HaLinkMessagePromise,
-                          timeout_sec: float):
+    def get_now_ts(self) -> int:
         """
-        Verify if any message in promise._ids are reported by Motr
-        as delivered. Calling function should hold the self.lock.
+        Returns the current timestamp in milliseconds.
+        """
+        return round(time.time() * 1000)
+
+    def _register(self,
+                  promise: HaLinkMessagePromise,
+                  future: Optional[Future] = None,
+                  wait_all: bool = False) -> _Waiter:
+        """
+        Starts awaiting the given promise. The messages that were confirmed
+        before are taken from unsorted_deliveries.
+
+        Calling function should hold the self.lock.
+        """
+        self.groom_unsorted()
+        waiter = _Waiter(promise, self.lock, future=future, wait_all=wait_all)
+        self.waiting_clients[promise] = waiter
+        for message_id in promise:
+            if message_id in self.unsorted_deliveries:
+                del self.unsorted_deliveries[message_id]
+                waiter.delivered.append(message_id)
+            else:
+                self.awaited.setdefault(message_id, []).append(waiter)
+        if waiter.delivered:
+            LOG.log(TRACE, 'The following messages found matching promise: '
+                    '%s', waiter.delivered)
+        return waiter
+
+    def _unregister(self, waiter: _Waiter) -> None:
+        # Note: must be invoked under self.lock
+        self.waiting_clients.pop(waiter.promise, None)
+        for message_id in waiter.promise:
+            waiters = self.awaited.get(message_id)
+            if waiters is None:
+                continue
+            waiters[:] = [w for w in waiters if w is not waiter]
+            if not waiters:
+                del self.awaited[message_id]
+
+    def _wait_delivered(self, waiter: _Waiter,
+                        timeout_sec: float) -> List[MessageId]:
         """
+        Blocks until at least one message of the promise is confirmed.
+        Returns the newly confirmed messages and excludes them from the
+        promise.
 
-        del self.waiting_clients[promise]
-        if promise not in self.recently_delivered:
-            raise NotDelivered('None of message tags =' + str(promise) +
-                               '  were delivered to Motr within ' +
-                               str(timeout_sec) + ' seconds timeout')
-        confirmed_msgs = self.recently_delivered.pop(promise)
+        Calling function should hold the self.lock.
+        """
+        promise = waiter.promise
+        deadline = time.monotonic() + timeout_sec
+        if waiter.delivered:
+            LOG.log(TRACE,
+                    'Promise %s has been confirmed before, no need to block',
+                    promise)
+        while not waiter.delivered:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise NotDelivered('None of message tags =' + str(promise) +
+                                   '  were delivered to Motr within ' +
+                                   str(timeout_sec) + ' seconds timeout')
+            LOG.log(TRACE, 'Blocking until %s is confirmed', promise)
+            waiter.condition.wait(timeout=remaining)
+        confirmed_msgs = waiter.delivered
+        waiter.delivered = []
         LOG.log(TRACE, 'Thread unblocked - %s just received', confirmed_msgs)
         promise.exclude_ids(confirmed_msgs)
+        return confirmed_msgs
 
-    def get_now_ts(self) -> int:
+    def _confirm(self, waiter: _Waiter) -> bool:
         """
-        Returns the current timestamp in milliseconds.
+        Accounts the messages confirmed for the future of the given waiter.
+        Returns True if the future must be resolved now.
+
+        Calling function should hold the self.lock.
         """
-        return round(time.time() * 1000)
+        if waiter.done or not waiter.delivered:
+            return False
+        waiter.promise.exclude_ids(waiter.delivered)
+        waiter.confirmed.extend(waiter.delivered)
+        waiter.delivered = []
+        if waiter.wait_all and not waiter.promise.is_empty():
+            return False
+        waiter.done = True
+        self._unregister(waiter)
+        return True
+
+    def _watch(self, promise: HaLinkMessagePromise, timeout_sec: float,
+               wait_all: bool) -> Future:
+        future: Future = Future()
+        # The future can't be cancelled then: it is always resolved either
+        # by a delivery or by the timeout.
+        future.set_running_or_notify_cancel()
+        started = time.monotonic()
+        mode = 'all' if wait_all else 'any'
+
+        def observe(_: Future) -> None:
+            DELIVERY_WAIT.observe(time.monotonic() - started, mode)
+
+        future.add_done_callback(observe)
+        with self.lock:
+            waiter = self._register(promise, future=future, wait_all=wait_all)
+            resolved = self._confirm(waiter)
+            if not resolved:
+                heapq.heappush(self.deadlines,
+                               (started + timeout_sec, next(self._seq),
+                                waiter))
+                self._ensure_timer()
+                self._timer_cond.notify()
+        if resolved:
+            future.set_result(waiter.confirmed)
+        return future
+
+    def watch_any(self,
+                  promise: HaLinkMessagePromise,
+                  timeout_sec: float = 30.0) -> Future:
+        """
+        Non-blocking version of wait_for_any(): returns a future that gets
+        resolved with the list of the confirmed messages as soon as any
+        message of the promise is reported by Motr as delivered. The future
+        fails with NotDelivered when timeout_sec exceeds.
+
+        The future can be awaited from asyncio code with help of
+        asyncio.wrap_future(). Note that the future callbacks can be invoked
+        from Motr callback thread, so they must not block.
+        """
+        return self._watch(promise, timeout_sec, wait_all=False)
+
+    def watch_all(self,
+                  promise: HaLinkMessagePromise,
+                  timeout_sec: float = 30.0) -> Future:
+        """
+        Non-blocking version of wait_for_all(), see watch_any().
+        """
+        return self._watch(promise, timeout_sec, wait_all=True)
+
+    def wait_many(self,
+                  promises: Iterable[HaLinkMessagePromise],
+                  timeout_sec: float = 30.0,
+                  wait_all: bool = False) -> None:
+        """
+        Blocks the current thread until every given promise is confirmed
+        (any of its messages or, if wait_all is True, all of them). The
+        promises are awaited together, so the whole call takes up to
+        timeout_sec.
+
+        Raises NotDelivered exception if some promise is not confirmed
+        within timeout_sec.
+        """
+        futures = [self._watch(p, timeout_sec, wait_all) for p in promises]
+        failed: List[str] = []
+        for future in futures:
+            exc = future.exception()
+            if exc is not None:
+                failed.append(str(exc))
+        if failed:
+            raise NotDelivered('; '.join(failed))
+
+    def _ensure_timer(self) -> None:
+        # Note: must be invoked under self.lock
+        if self._timer is not None:
+            return
+        self._timer = Thread(target=self._expire_watchers,
+                             name='delivery-timer',
+                             daemon=True)
+        self._timer.start()
+
+    def _expire_watchers(self) -> None:
+        stopping = False
+        while not stopping:
+            expired: List[_Waiter] = []
+            with self.lock:
+                deadlines = self.deadlines
+                now = time.monotonic()
+                while deadlines and deadlines[0][0] <= now:
+                    _, _, waiter = heapq.heappop(deadlines)
+                    if not waiter.done:
+                        waiter.done = True
+                        self._unregister(waiter)
+                        expired.append(waiter)
+                if not deadlines:
+                    # Nothing to watch, the thread will be started again
+                    # by the next watch_any() or watch_all() call.
+                    self._timer = None
+                    stopping = True
+                elif not expired:
+                    self._timer_cond.wait(timeout=deadlines[0][0] - now)
+                    continue
+            for waiter in expired:
+                assert waiter.future
+                waiter.future.set_exception(
+                    NotDelivered(f'None of message tags ={waiter.promise} '
+                                 f'were delivered to Motr in time'))
 
     def wait_for_any(self,
                      promise: HaLinkMessagePromise,
@@ -99,23 +325,14 @@ class DeliveryHerald:
 
         Raises NotDelivered exception when timeout_sec exceeds.
         """
-        condition = Condition()
-        skip_await = False
+        started = time.monotonic()
         with self.lock:
-            self.groom_unsorted(promise)
-            self.waiting_clients[promise] = condition
-            skip_await = promise in self.recently_delivered
-
-        if skip_await:
-            LOG.log(TRACE,
-                    'Promise %s has been confirmed before, no need to block',
-                    promise)
-        else:
-            with condition:
-                LOG.log(TRACE, 'Blocking until %s is confirmed', promise)
-                condition.wait(timeout=timeout_sec)
-        with self.lock:
-            self._verify_delivered(promise, timeout_sec)
+            waiter = self._register(promise)
+            try:
+                self._wait_delivered(waiter, timeout_sec)
+            finally:
+                self._unregister(waiter)
+        DELIVERY_WAIT.observe(time.monotonic() - started, 'any')
 
     def wait_for_all(self,
                      promise: HaLinkMessagePromise,
@@ -126,85 +343,88 @@ class DeliveryHerald:
 
         Raises NotDelivered exception when timeout_sec exceeds.
         """
+        started = time.monotonic()
+        with self.lock:
+            waiter = self._register(promise)
+            try:
+                while not promise.is_empty():
+                    self._wait_delivered(waiter, timeout_sec)
+            finally:
+                self._unregister(waiter)
+        DELIVERY_WAIT.observe(time.monotonic() - started, 'all')
 
-        condition = Condition()
-        skip_await = False
+    def export_metrics(self) -> None:
+        """
+        Makes hax_delivery_* gauges report the state of this DeliveryHerald.
+        """
+        PENDING_PROMISES.set_function(lambda: len(self.waiting_clients))
+        UNSORTED_DELIVERIES.set_function(
+            lambda: len(self.unsorted_deliveries))
 
-        with self.lock:
-            self.groom_unsorted(promise)
-            self.waiting_clients[promise] = condition
-            skip_await = promise in self.recently_delivered
-
-        while not promise.is_empty():
-            if skip_await:
-                LOG.log(
-                    TRACE, 'Promise %s has been confirmed before, '
-                    'no need to block', promise)
-                skip_await = False
-            else:
-                with condition:
-                    LOG.log(TRACE, 'Blocking until %s is confirmed', promise)
-                    condition.wait(timeout=timeout_sec)
-            with self.lock:
-                self._verify_delivered(promise, timeout_sec)
-                if not promise.is_empty():
-                    self.waiting_clients[promise] = condition
-
-    def groom_unsorted(self, promise: HaLinkMessagePromise) -> None:
-        LOG.log(TRACE, 'Grooming by promise %s', promise)
-        delivered: List[MessageId] = []
-        to_remove: List[MessageId] = []
-
-        def too_old(ts: int) -> bool:
-            return self.get_now_ts() - ts > self.unsorted_ttl
-
-        for msg, ts in self.unsorted_deliveries.items():
-            if msg in promise:
-                delivered.append(msg)
-                to_remove.append(msg)
-            elif too_old(ts):
-                to_remove.append(msg)
-        if delivered:
-            LOG.log(TRACE, 'The following messages found matching promise: %s',
-                    delivered)
-            self.recently_delivered[promise] = delivered
-
-        for m in to_remove:
-            del self.unsorted_deliveries[m]
+    def groom_unsorted(self) -> None:
+        """
+        Removes the unsorted deliveries that are older than unsorted_ttl.
+
+        Calling function should hold the self.lock.
+        """
+        heap = self.unsorted_heap
+        expired_ts = self.get_now_ts() - self.unsorted_ttl
+        while heap and heap[0][0] < expired_ts:
+            ts, message_id = heapq.heappop(heap)
+            # The message might have been taken by a waiter or delivered
+            # again since then.
+            if self.unsorted_deliveries.get(message_id) == ts:
+                del self.unsorted_deliveries[message_id]
+        if len(heap) > 2 * len(self.unsorted_deliveries) + 64:
+            # Too many stale entries, let's rebuild the heap
+            self.unsorted_heap = [(ts, m) for m, ts in
+                                  self.unsorted_deliveries.items()]
+            heapq.heapify(self.unsorted_heap)
         LOG.log(TRACE, 'unsorted size after grooming: %s',
                 len(self.unsorted_deliveries))
 
     def notify_delivered(self, message_id: MessageId):
         # [KN] This function is expected to be called from Motr.
+        resolved: List[_Waiter] = []
         with self.lock:
-            LOG.info('received msg id %s, notify waiting clients %s',
-                     message_id, self.waiting_clients.items())
-            for promise, client in self.waiting_clients.items():
-                LOG.debug('waiting promise %s', promise)
-                if message_id in promise:
-                    LOG.log(TRACE, 'Found a waiting client for %s: %s',
-                            message_id, promise)
-                    old_list = self.recently_delivered.get(promise, [])
-                    old_list.append(message_id)
-                    self.recently_delivered[promise] = old_list
-                    with client:
-                        client.notify()
-                    return
-            # If notify_delivered() was invoked before wait_for_all(), i.e.
-            # if the ha message is already delivered before the sender starts
-            # waiting on the same, append the delivered message to the list of
-            # unsorted_delivered, so that the delivery is found before
-            # wait_for_{all, any}() starts the conditional wait.
-            self.unsorted_deliveries[message_id] = self.get_now_ts()
+            waiters = self.awaited.pop(message_id, None)
+            if waiters:
+                for waiter in waiters:
+                    LOG.debug('received msg id %s, notify waiting client %s',
+                              message_id, waiter.promise)
+                    waiter.delivered.append(message_id)
+                    if waiter.future is None:
+                        waiter.condition.notify()
+                    elif self._confirm(waiter):
+                        resolved.append(waiter)
+            else:
+                self._add_unsorted(message_id)
+        for waiter in resolved:
+            assert waiter.future
+            waiter.future.set_result(waiter.confirmed)
+
+    def _add_unsorted(self, message_id: MessageId) -> None:
+        # Note: must be invoked under self.lock
+        LOG.debug('received msg id %s, nobody is awaiting it yet',
+                  message_id)
+        # If notify_delivered() was invoked before wait_for_all(), i.e.
+        # if the ha message is already delivered before the sender starts
+        # waiting on the same, append the delivered message to the list of
+        # unsorted_delivered, so that the delivery is found before
+        # wait_for_{all, any}() starts the conditional wait.
+        ts = self.get_now_ts()
+        self.unsorted_deliveries[message_id] = ts
+        heapq.heappush(self.unsorted_heap, (ts, message_id))
 
     # This function must be invoked with the self.lock held.
     def check_if_delivered_locked(
             self, promise: HaLinkMessagePromise) -> HaLinkMessagePromise:
         if not self.lock.locked():
             raise RuntimeError('DeliveryHerald.lock not acquired')
-        if promise in self.recently_delivered:
-            confirmed_msgs = self.recently_delivered.pop(promise)
+        waiter = self.waiting_clients.get(promise)
+        if waiter is not None and waiter.delivered:
+            confirmed_msgs = waiter.delivered
             LOG.debug('Thread unblocked - %s just received', confirmed_msgs)
-            del self.waiting_clients[promise]
+            self._unregister(waiter)
             promise.exclude_ids(confirmed_msgs)
         return promise
@@ -0,0 +1,236 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import heapq
+import logging
+from dataclasses import dataclass
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+from hax.message import AnyEntrypointRequest
+from hax.metrics import REGISTRY
+from hax.types import Fid
+from hax.util import ConsulUtil, ServiceData
+
+__all__ = ['DeferredReplies', 'EntrypointCache', 'EntrypointInfo']
+
+LOG = logging.getLogger('hax')
+
+ENTRYPOINT_LOOKUPS = REGISTRY.counter(
+    'hax_entrypoint_lookups_total',
+    'Entrypoint data lookups by their result (hit or miss of the cache)',
+    ['result'])
+DEFERRED_REQUESTS = REGISTRY.counter(
+    'hax_entrypoint_deferred_total',
+    'Entrypoint requests postponed because the entrypoint data was '
+    'unavailable')
+EAGAIN_REPLIES = REGISTRY.counter('hax_entrypoint_eagain_replies_total',
+                                  'Entrypoint requests replied with EAGAIN')
+PENDING_REQUESTS = REGISTRY.gauge(
+    'hax_entrypoint_deferred_pending',
+    'Postponed entrypoint requests that are not resubmitted yet')
+
+
+@dataclass
+class EntrypointInfo:
+    """
+    The data an entrypoint reply is made of.
+    """
+    session: str
+    principal_rm: str
+    confds: List[ServiceData]
+    rm_fid: Fid
+    rm_eps: Optional[str]
+    quorum: int
+
+
+class EntrypointCache:
+    """
+    Keeps the last entrypoint data computed from Consul.
+
+    The data depends on the RC leader only (the principal RM is the node of
+    the leader session), so it is reused for as long as the 'leader' key
+    refers to the same session. Once the KV mirror watches the 'leader' key,
+    checking the session doesn't involve Consul requests at all. The data
+    is also recomputed when it gets older than ttl seconds, so that the
+    changes of the confd services (which are not watched) are picked up
+    eventually.
+
+    Concurrent lookups wait for a single computation instead of starting
+    their own ones: during the bootstrap hundreds of Motr processes request
+    the entrypoint at once.
+    """
+    def __init__(self, consul_util: ConsulUtil, ttl: float = 30.0):
+        self.consul_util = consul_util
+        self.ttl = ttl
+        self.lock = Lock()
+        self._info: Optional[EntrypointInfo] = None
+        self._expires = 0.0
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self._info = None
+
+    def get(self) -> EntrypointInfo:
+        """
+        Returns the entrypoint data. Exceptions raised by ConsulUtil are
+        propagated as is; incomplete data (no confds or no RM endpoint) is
+        returned but not cached.
+        """
+        util = self.consul_util
+        with self.lock:
+            sess = util.get_leader_session()
+            info = self._info
+            if info is not None and info.session == sess \
+                    and monotonic() < self._expires:
+                ENTRYPOINT_LOOKUPS.inc('hit')
+                return info
+            ENTRYPOINT_LOOKUPS.inc('miss')
+            info = self._fetch(sess)
+            if info.confds and info.rm_eps:
+                self._info = info
+                self._expires = monotonic() + self.ttl
+            else:
+                self._info = None
+            return info
+
+    def _fetch(self, sess: str) -> EntrypointInfo:
+        util = self.consul_util
+        principal_rm = util.get_session_node(sess)
+        confds = util.get_confd_list()
+        rm_fid = Fid(0, 0)
+        quorum = 0
+        if confds:
+            rm_fid = util.get_rm_fid(rm_node=principal_rm)
+            quorum = int(len(confds) / 2 + 1)
+        rm_eps = None
+        for svc in confds:
+            if svc.node == principal_rm:
+                rm_eps = svc.address
+                break
+        LOG.debug('Entrypoint data fetched: session=%s principal RM=%s',
+                  sess, principal_rm)
+        return EntrypointInfo(session=sess,
+                              principal_rm=principal_rm,
+                              confds=confds,
+                              rm_fid=rm_fid,
+                              rm_eps=rm_eps,
+                              quorum=quorum)
+
+
+class DeferredReplies:
+    """
+    Postpones the entrypoint requests that could not be served.
+
+    Replying EAGAIN right away makes Motr re-send the request immediately,
+    so the requests would flood hax until the entrypoint data appears
+    (e.g. until the RC leader is elected). Instead of sleeping in the
+    consumer thread, the request is handed over to a timer thread which
+    resubmits it (see submit) once the delay passes. The delay grows by
+    the backoff factor with every consecutive failure of the same process
+    up to max_delay seconds, and is reset once the process gets the
+    entrypoint data (see reset()).
+    """
+    def __init__(self,
+                 submit: Callable[[AnyEntrypointRequest], None],
+                 delay: float = 1.0,
+                 backoff: float = 2.0,
+                 max_delay: float = 8.0):
+        self.submit = submit
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.lock = Lock()
+        # process fid -> number of consecutive deferrals
+        self.failures: Dict[Fid, int] = {}
+        # (due time, sequence number, request)
+        self.pending: List[Tuple[float, int, AnyEntrypointRequest]] = []
+        self._seq = count()
+        self._cond = Condition(self.lock)
+        self._timer: Optional[Thread] = None
+        self._stopped = False
+        PENDING_REQUESTS.set_function(lambda: len(self.pending))
+
+    def defer(self, request: AnyEntrypointRequest) -> float:
+        """
+        Schedules the resubmission of the given request. Returns the delay
+        in seconds.
+        """
+        with self.lock:
+            nr_failures = self.failures.get(request.process_fid, 0)
+            self.failures[request.process_fid] = nr_failures + 1
+            # Note: the exponent is bounded to avoid float overflow
+            delay = min(self.delay * self.backoff**min(nr_failures, 32),
+                        self.max_delay)
+            heapq.heappush(self.pending,
+                           (monotonic() + delay, next(self._seq), request))
+            self._ensure_timer()
+            self._cond.notify()
+        DEFERRED_REQUESTS.inc()
+        return delay
+
+    def reset(self, process_fid: Fid) -> None:
+        with self.lock:
+            self.failures.pop(process_fid, None)
+
+    def stop(self) -> List[AnyEntrypointRequest]:
+        """
+        Stops the timer thread and returns the requests that are not
+        resubmitted yet (the caller is responsible for replying them).
+        """
+        with self.lock:
+            self._stopped = True
+            requests = [req for _, _, req in sorted(self.pending)]
+            self.pending = []
+            self._cond.notify()
+        return requests
+
+    def _ensure_timer(self) -> None:
+        # Note: must be invoked under self.lock
+        if self._timer is not None or self._stopped:
+            return
+        self._timer = Thread(target=self._resubmit,
+                             name='entrypoint-timer',
+                             daemon=True)
+        self._timer.start()
+
+    def _resubmit(self) -> None:
+        stopping = False
+        while not stopping:
+            due: List[AnyEntrypointRequest] = []
+            with self.lock:
+                pending = self.pending
+                now = monotonic()
+                while pending and pending[0][0] <= now:
+                    due.append(heapq.heappop(pending)[2])
+                if not pending or self._stopped:
+                    # The thread will be started again by the next defer()
+                    self._timer = None
+                    stopping = True
+                elif not due:
+                    self._cond.wait(timeout=pending[0][0] - now)
+                    continue
+            for request in due:
+                LOG.debug('Resubmitting the postponed entrypoint request '
+                          'from %s', request.process_fid)
+                try:
+                    self.submit(request)
+                except Exception:
+                    LOG.exception('Failed to resubmit the entrypoint request')
@@ -16,23 +16,92 @@
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 #
 
+import json
 import logging
+import os
 from collections import deque
-from dataclasses import dataclass
-from threading import Condition
-from typing import Callable, Deque, Dict, Optional, Set, Tuple, Type
+from dataclasses import dataclass, field
+from threading import Condition, Lock
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple, Type
 
 from hax.log import TRACE
 from hax.message import (AnyEntrypointRequest, BaseMessage, BroadcastHAStates,
                          Die, HaNvecGetEvent, HaNvecSetEvent, ProcessEvent,
                          ProcessHaEvent, SnsOperation)
+from hax.metrics import REGISTRY
 from hax.motr.util import LinkedList
 from hax.types import Fid
 
 LOG = logging.getLogger('hax')
 MAX_GROUP_ID = 100000
+# Max number of HA states a BroadcastHAStates command can get by merging
+# the subsequent BroadcastHAStates commands into it
+MAX_MERGED_HA_STATES = 1024
 
-__all__ = ['WorkPlanner']
+# When set, the commands added to WorkPlanner are recorded to the file at
+# this path (see CommandRecorder).
+TRACE_ENV = 'HARE_HAX_PLANNER_TRACE'
+
+__all__ = ['CommandRecorder', 'WorkPlanner']
+
+QUEUED_COMMANDS = REGISTRY.gauge('hax_planner_queued_commands',
+                                 'Number of commands waiting in WorkPlanner',
+                                 ['queue'])
+QUEUE_WAIT = REGISTRY.histogram(
+    'hax_planner_queue_wait_seconds',
+    'Time the commands spend in WorkPlanner before execution', ['command'])
+
+
+class CommandRecorder:
+    '''
+    Appends the commands added to WorkPlanner to a JSON Lines file, one
+    command per line:
+
+        {"t": 0.125, "type": "BroadcastHAStates", "states": 2}
+
+    where "t" is the time (seconds) since the first recorded command, "fid"
+    is the fid the command relates to (if any) and "states" is the number of
+    HA states of a BroadcastHAStates command. The trace can be replayed by
+    the WorkPlanner benchmark (see test/planner_bench.py).
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        # Line buffered, so that the trace survives the hax crash
+        self.file = open(path, 'a', buffering=1)
+        self.start: Optional[float] = None
+
+    @staticmethod
+    def _get_fid(command: BaseMessage) -> Optional[Fid]:
+        fid: Optional[Fid]
+        if isinstance(command, ProcessEvent):
+            fid = command.evt.fid
+        elif isinstance(command, AnyEntrypointRequest):
+            fid = command.process_fid
+        else:
+            fid = getattr(command, 'fid', None)
+        return fid
+
+    def record(self, command: BaseMessage) -> None:
+        data: Dict[str, Any] = {'type': type(command).__name__}
+        fid = self._get_fid(command)
+        if fid is not None:
+            data['fid'] = str(fid)
+        if isinstance(command, BroadcastHAStates):
+            data['states'] = len(command.states)
+        now = monotonic()
+        with self.lock:
+            if self.file.closed:
+                return
+            if self.start is None:
+                self.start = now
+            data['t'] = round(now - self.start, 6)
+            self.file.write(json.dumps(data) + '\n')
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
 
 
 @dataclass
@@ -77,6 +146,16 @@ class State:
     #
     # The flag is set to true by invoking WorkPlanner.shutdown() method.
     is_shutdown: bool
+    #
+    # Mapping of group_id -> number of commands of that group waiting in the
+    # backlog. Lets WorkPlanner check whether a group is completed without
+    # scanning the backlog.
+    group_sizes: Dict[int, int] = field(default_factory=dict)
+    #
+    # Mapping of fid -> number of active commands whose CommandMeta refers
+    # to that fid (see active_meta). Used for conflict checks of the asap
+    # commands.
+    active_fids: Dict[Fid, int] = field(default_factory=dict)
 
 
 class WorkPlanner:
@@ -99,26 +178,92 @@ class WorkPlanner:
         self.backlog: Deque[BaseMessage] = deque()
         self.asap_list: Deque[BaseMessage] = deque()
         self.b_lock = Condition()
+        self.recorder: Optional[CommandRecorder] = None
+        trace_path = os.environ.get(TRACE_ENV)
+        if trace_path:
+            LOG.info('Recording WorkPlanner commands to %s', trace_path)
+            self.recorder = CommandRecorder(trace_path)
 
     def is_empty(self) -> bool:
         """Checks whether the backlog is empty. Blocking call."""
         with self.b_lock:
             return not self.backlog
 
+    def get_backlog_size(self) -> int:
+        """
+        Returns the number of commands waiting for execution.
+
+        The lock is not taken, so the value is approximate, but the method
+        doesn't block and can be invoked from the event loop.
+        """
+        return len(self.backlog) + len(self.asap_list)
+
     def add_command(self, command: BaseMessage) -> None:
         """Adds the given command to the execution plan. Blocking call."""
         LOG.log(TRACE, '[WP]Before add_command: %s', command)
+        if self.recorder is not None:
+            self.recorder.record(command)
+        command.enqueued_at = monotonic()
         with self.b_lock:
+            if self._merge_broadcast(command):
+                return
             cmd, is_asap = self._assign_group(command)
             LOG.log(TRACE, '[WP]Cmd %s is added. Current state: %s', cmd,
                     self.state)
-            backlog = self.backlog
             if is_asap:
-                backlog = self.asap_list
-            backlog.append(cmd)
-            # Some threads may be waiting because of an empty backlog - let's
-            # notify them
-            self.b_lock.notifyAll()
+                self.asap_list.append(cmd)
+            else:
+                self.backlog.append(cmd)
+                self._inc_group_size(cmd.group)
+            # Some thread may be waiting because of an empty backlog - let's
+            # wake up one if the command can be executed right away.
+            if is_asap or cmd.group == self.state.current_group_id:
+                self.b_lock.notify()
+
+    def _merge_broadcast(self, command: BaseMessage) -> bool:
+        '''Merges the given BroadcastHAStates into the previous one.
+
+        Every BroadcastHAStates forms its own group, so a storm of
+        broadcasts would be executed strictly one by one. If the tail of the
+        backlog is a BroadcastHAStates command (that is, it is not started
+        yet and no other command is queued after it), the states of the new
+        command are appended to it instead. The latest state of a fid wins:
+        the earlier states of the same fid are dropped.
+
+        Returns True if the command has been merged. Must be invoked with
+        b_lock acquired.
+        '''
+        if not isinstance(command, BroadcastHAStates) or not self.backlog:
+            return False
+        tail = self.backlog[-1]
+        if not isinstance(tail, BroadcastHAStates):
+            return False
+        if tail.group != self.state.next_group_id:
+            return False
+        if len(tail.states) + len(command.states) > MAX_MERGED_HA_STATES:
+            return False
+        fids = {st.fid for st in command.states}
+        tail.states = [st for st in tail.states
+                       if st.fid not in fids] + command.states
+        tail.merged_reply_to.extend(command.reply_queues())
+        LOG.log(TRACE, '[WP]Cmd %s is merged into %s', command, tail)
+        return True
+
+    def _inc_group_size(self, group: Optional[int]) -> None:
+        if group is None:
+            return
+        sizes = self.state.group_sizes
+        sizes[group] = sizes.get(group, 0) + 1
+
+    def _dec_group_size(self, group: Optional[int]) -> None:
+        if group is None:
+            return
+        sizes = self.state.group_sizes
+        count = sizes.get(group, 0) - 1
+        if count > 0:
+            sizes[group] = count
+        else:
+            sizes.pop(group, None)
 
     def _create_initial_state(self) -> State:
         """Default factory method that returns initial state.
@@ -162,31 +307,38 @@ class WorkPlanner:
             if self.state.is_shutdown:
                 return self._create_poison()
 
-            for backlog, is_allowed in [(self.asap_list,
-                                         self._is_allowed_asap),
-                                        (self.backlog, self._is_allowed)]:
-                if backlog:
-                    cmd = backlog.popleft()
-                    if is_allowed(cmd):
-                        self._add_active_cmd(cmd)
-                        LOG.log(TRACE, '[WP]Cmd %s taken!', cmd)
-                        return cmd
-                    else:
-                        # Given the command is not eligble, put it back
-                        # to the same place it has been taken from.
-                        backlog.appendleft(cmd)
-            return None
+            cmd = self._take_asap_cmd()
+            if cmd is None and self.backlog and \
+                    self._is_allowed(self.backlog[0]):
+                cmd = self.backlog.popleft()
+                self._dec_group_size(cmd.group)
+            if cmd is not None:
+                self._add_active_cmd(cmd)
+                LOG.log(TRACE, '[WP]Cmd %s taken!', cmd)
+            return cmd
 
         while True:
             LOG.log(TRACE, '[WP]Trying to get new command')
             with self.b_lock:
                 cmd = next_cmd()
-                if cmd:
-                    return cmd
-                LOG.log(
-                    TRACE,
-                    '[WP]Blocking thread: no eligible commands in backlog')
-                self.b_lock.wait()
+                if not cmd:
+                    LOG.log(
+                        TRACE,
+                        '[WP]Blocking thread: no eligible commands in backlog')
+                    self.b_lock.wait()
+                    continue
+            if cmd.enqueued_at is not None:
+                QUEUE_WAIT.observe(monotonic() - cmd.enqueued_at,
+                                   type(cmd).__name__)
+            return cmd
+
+    def export_metrics(self) -> None:
+        """
+        Makes hax_planner_queued_commands metric report the queues of this
+        WorkPlanner.
+        """
+        QUEUED_COMMANDS.set_function(lambda: len(self.backlog), 'backlog')
+        QUEUED_COMMANDS.set_function(lambda: len(self.asap_list), 'asap')
 
     def shutdown(self):
         '''Put the WorkPlanner to 'shutting down' mode. After this function is
@@ -195,12 +347,42 @@ class WorkPlanner:
             LOG.debug('WorkPlanner is shutting down')
             self.state.is_shutdown = True
             self.b_lock.notifyAll()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _take_asap_cmd(self) -> Optional[BaseMessage]:
+        '''Removes the first eligible command from asap_list and returns it.
+
+        A command that conflicts with an active one doesn't block the
+        commands behind it, except for the commands related to the same fid:
+        their relative order is preserved.
+
+        Assumes that b_lock is acquired already.
+        '''
+        blocked: Set[Fid] = set()
+        for i, cmd in enumerate(self.asap_list):
+            meta = self._extract_meta(cmd)
+            if meta is None:
+                del self.asap_list[i]
+                return cmd
+            if meta.fid in blocked or not self._is_allowed_asap(cmd):
+                blocked.add(meta.fid)
+                continue
+            del self.asap_list[i]
+            return cmd
+        return None
 
     def _remove_active_cmd(self, command: BaseMessage) -> None:
         self.state.active_commands.remove(command)
         key = id(command)
-        if key in self.state.active_meta:
-            del self.state.active_meta[key]
+        meta = self.state.active_meta.pop(key, None)
+        if meta:
+            fids = self.state.active_fids
+            count = fids.get(meta.fid, 0) - 1
+            if count > 0:
+                fids[meta.fid] = count
+            else:
+                fids.pop(meta.fid, None)
 
     def _add_active_cmd(self, command: BaseMessage) -> None:
         self.state.active_commands.add(command)
@@ -208,6 +390,8 @@ class WorkPlanner:
         if meta:
             key = id(command)
             self.state.active_meta[key] = meta
+            fids = self.state.active_fids
+            fids[meta.fid] = fids.get(meta.fid, 0) + 1
 
     def _extract_meta(self, command: BaseMessage) -> Optional[CommandMeta]:
         if isinstance(command, ProcessEvent):
@@ -218,18 +402,9 @@ class WorkPlanner:
         meta = self._extract_meta(command)
         if not meta:
             return True
-
-        for v in self.state.active_meta.values():
-            # TODO in the future `==` will have to be replaced with something
-            # more command-specific.
-            # E.g. two ProcessEvents conflict if their metas contain the same
-            # fid.
-            #
-            # At this moment we support CommandMeta for ProcessEvent, so for
-            # now this 'is_conflict' logic is written like this:
-            if v.fid == meta.fid:
-                return False
-        return True
+        # At this moment we support CommandMeta for ProcessEvent only: two
+        # ProcessEvents conflict if their metas contain the same fid.
+        return meta.fid not in self.state.active_fids
 
     def _is_allowed(self, command: BaseMessage) -> bool:
         '''
@@ -294,18 +469,23 @@ class WorkPlanner:
             LOG.log(TRACE, '[WP]Cmd %s removed. Current state: %s', command,
                     state)
 
+            if self.asap_list:
+                # The finished command might have been the one that blocked
+                # the head of asap_list.
+                self.b_lock.notify()
             if state.active_commands:
                 return
-            for c in self.backlog:
-                if c.group == state.current_group_id:
-                    return
+            if state.group_sizes.get(state.current_group_id):
+                return
             # if we're here, command was the only one belonging to group
             self._inc_group()
             LOG.log(TRACE, '[WP]Active group changed to %s',
                     state.current_group_id)
-            # The group changed, let's unblock those who are waiting for
-            # this group
-            self.b_lock.notifyAll()
+            # The group changed, let's unblock as many threads as there are
+            # commands in this group.
+            ready = state.group_sizes.get(state.current_group_id, 0)
+            if ready:
+                self.b_lock.notify(ready)
 
     def _should_increase_group(self, cmd: BaseMessage) -> bool:
         """Predicate function.
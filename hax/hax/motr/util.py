@@ -16,7 +16,9 @@
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 #
 from dataclasses import dataclass
-from typing import Generic, Iterable, Optional, TypeVar
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from hax.types import HaNoteStruct
 
 A = TypeVar('A')
 
@@ -95,3 +97,36 @@ class LinkedList(Iterable[A]):
         if not self.head:
             return '<empty>'
         return '(' + ', '.join(str(s) for s in self) + ')'
+
+
+class NoteSet:
+    """
+    Ordered collection of HA notes where every fid appears only once.
+
+    If a note is added for a fid that is in the collection already, the
+    earlier note gets the new state (the last state wins) but keeps its
+    position.
+    """
+    def __init__(self):
+        self._notes: Dict[Tuple[int, int], HaNoteStruct] = {}
+        # Number of the notes added so far including the duplicates
+        self.nr_added = 0
+
+    def add(self, note: HaNoteStruct) -> None:
+        self.nr_added += 1
+        # Note that the replaced dict item keeps its position
+        self._notes[(note.no_id.f_container, note.no_id.f_key)] = note
+
+    def extend(self, notes: Iterable[HaNoteStruct]) -> None:
+        for note in notes:
+            self.add(note)
+
+    @property
+    def nr_duplicates(self) -> int:
+        return self.nr_added - len(self._notes)
+
+    def to_list(self) -> List[HaNoteStruct]:
+        return list(self._notes.values())
+
+    def __len__(self) -> int:
+        return len(self._notes)
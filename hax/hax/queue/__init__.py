@@ -1,6 +1,7 @@
 """Broadcast Queue Consumer implementation."""
 import json
 import logging
+from concurrent.futures import Future
 from queue import Queue
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
@@ -42,30 +43,52 @@ class BQProcessor:
         self.herald = delivery_herald
         self.motr = motr
 
-    def process(self, message: Tuple[int, Any]) -> None:
+    def process(self, message: Tuple[int, Any]) -> Optional[Future]:
+        """
+        Processes the message. If the processing results in an HA broadcast,
+        the returned future gets resolved when Motr confirms the delivery
+        (see DeliveryHerald.watch_any()), so the caller can process the next
+        messages meanwhile.
+        """
         (i, msg) = message
         LOG.info('Message #%d received: %s (type: %s)', i, msg,
                  type(msg).__name__)
+        delivery: Optional[Future] = None
         try:
-            self.payload_process(msg)
+            delivery = self.payload_process(msg)
         except Exception:
             LOG.exception(
                 'Failed to process a message #%d.'
                 ' The message is skipped.', i)
         LOG.info('Message #%d processed', i)
+        return delivery
+
+    def wait_delivered(self, i: int, delivery: Optional[Future]) -> None:
+        """
+        Blocks until the delivery of the broadcast made by message #i is
+        confirmed (if any).
+        """
+        if delivery is None:
+            return
+        try:
+            delivery.result()
+        except Exception:
+            LOG.exception(
+                'Broadcast of message #%d is not delivered.'
+                ' The message is skipped.', i)
 
-    def payload_process(self, msg: str) -> None:
+    def payload_process(self, msg: str) -> Optional[Future]:
         data = None
         try:
             data = json.loads(msg)
         except json.JSONDecodeError:
             LOG.error('Cannot parse payload, invalid json')
-            return
+            return None
 
         payload = data['payload']
         msg_type = data['message_type']
 
-        handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {
+        handlers: Dict[str, Callable[[Dict[str, Any]], Optional[Future]]] = {
             'M0_HA_MSG_NVEC': self.handle_device_state_set,
             'SNS_OP': self.handle_sns_op,
             'STOB_IOQ_ERROR': self.handle_ioq_stob_error,
@@ -74,8 +97,8 @@ class BQProcessor:
         if msg_type not in handlers:
             LOG.warn('Unsupported message type given: %s. Message skipped.',
                      msg_type)
-            return
-        handlers[msg_type](payload)
+            return None
+        return handlers[msg_type](payload)
 
     def handle_process_state_update(self, payload: Dict[str, Any]) -> None:
         def _get_ha_state() -> Optional[HAState]:
@@ -97,13 +120,14 @@ class BQProcessor:
                                              payload['type']),
                            states=[hastate]))
 
-    def handle_device_state_set(self, payload: Dict[str, Any]) -> None:
+    def handle_device_state_set(self,
+                                payload: Dict[str, Any]) -> Optional[Future]:
         # To add check for multiple object entries in a payload.
         # for objinfo in payload:
         hastate: Optional[HAState] = self.to_ha_state(payload)
         if not hastate:
             LOG.info('No ha states to broadcast.')
-            return
+            return None
 
         q: Queue = Queue(1)
         LOG.info('HA broadcast, node: %s device: %s state: %s',
@@ -111,7 +135,7 @@ class BQProcessor:
         self.planner.add_command(
             BroadcastHAStates(states=[hastate], reply_to=q))
         ids: List[MessageId] = q.get()
-        self.herald.wait_for_any(HaLinkMessagePromise(ids))
+        return self.herald.watch_any(HaLinkMessagePromise(ids))
 
     def handle_sns_op(self, payload: Dict[str, Any]) -> None:
         op_name = payload['op_name']
@@ -143,11 +167,12 @@ class BQProcessor:
         message = msg_factory[op_name](payload)
         self.planner.add_command(message)
 
-    def handle_ioq_stob_error(self, payload: Dict[str, Any]) -> None:
+    def handle_ioq_stob_error(self,
+                              payload: Dict[str, Any]) -> Optional[Future]:
         fid = Fid.parse(payload['conf_sdev'])
         if fid.is_null():
             LOG.debug('Fid is 0:0. Skipping the message.')
-            return
+            return None
 
         q: Queue = Queue(1)
         self.planner.add_command(
@@ -155,7 +180,7 @@ class BQProcessor:
                 states=[HAState(fid,
                                 status=ObjHealth.FAILED)], reply_to=q))
         ids: List[MessageId] = q.get()
-        self.herald.wait_for_any(HaLinkMessagePromise(ids))
+        return self.herald.watch_any(HaLinkMessagePromise(ids))
 
     def to_ha_state(self, objinfo: Dict[str, str]) -> Optional[HAState]:
         hastate_to_objstate = {
@@ -0,0 +1,184 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+"""
+Building blocks of the retry policy of the Consul-dependent code (see
+repeat_if_fails() in hax.util): exponential backoff with jitter, the circuit
+breaker that tracks Consul availability and the process-wide retry budget.
+"""
+
+import logging
+import random
+from threading import Lock
+from time import monotonic
+
+from hax.metrics import REGISTRY
+
+__all__ = [
+    'CONSUL_BREAKER', 'RETRY_BUDGET', 'CircuitBreaker', 'RetryBudget',
+    'backoff_delay'
+]
+
+LOG = logging.getLogger('hax')
+
+BREAKER_TRIPS = REGISTRY.counter(
+    'hax_circuit_breaker_trips_total',
+    'Number of times the circuit breaker got open', ['breaker'])
+BREAKER_STATE = REGISTRY.gauge(
+    'hax_circuit_breaker_state',
+    'State of the circuit breaker: 0 - closed, 1 - open, 2 - half-open',
+    ['breaker'])
+BUDGET_DELAYS = REGISTRY.counter(
+    'hax_retry_budget_delays_total',
+    'Number of retries postponed because the retry budget was exhausted')
+
+
+def backoff_delay(attempt: int, initial: float, max_delay: float) -> float:
+    """
+    Returns the delay (in seconds) before the given retry attempt (1-based):
+    the delay doubles with every attempt up to max_delay and is randomized
+    within [delay/2, delay] so that the callers that failed at the same
+    moment don't retry in lockstep.
+    """
+    # Note: the exponent is bounded to avoid float overflow
+    delay = min(initial * 2**min(attempt - 1, 32), max_delay)
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    Tracks the availability of a remote service by the outcome of the
+    requests sent to it (see record_success() and record_failure()).
+
+    After failure_threshold failures in a row the breaker gets open: callers
+    asking check() are told to wait instead of sending the requests that
+    are known to fail. Once open_seconds pass, the breaker lets a single
+    caller through (half-open state) to probe the service; the other
+    callers keep waiting. A successful request closes the breaker, a failed
+    probe opens it again for twice as long (up to max_open_seconds).
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = 5,
+                 open_seconds: float = 1.0,
+                 max_open_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.lock = Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._open_time = open_seconds
+        # While OPEN: when the first probe is allowed.
+        # While HALF_OPEN: when the next probe is allowed if the current one
+        # doesn't report back.
+        self._until = 0.0
+
+    def check(self) -> float:
+        """
+        Returns 0 if the caller may send the request or the number of
+        seconds to wait before asking again otherwise.
+        """
+        if self.state == self.CLOSED:
+            return 0.0
+        with self.lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            now = monotonic()
+            if now < self._until:
+                return self._until - now
+            # This caller becomes the probe
+            self.state = self.HALF_OPEN
+            self._until = now + self._open_time
+            return 0.0
+
+    def record_success(self) -> None:
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                LOG.info('%s is available again, closing the circuit breaker',
+                         self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._open_time = self.open_seconds
+
+    def record_failure(self) -> None:
+        with self.lock:
+            if self.state == self.OPEN:
+                # The requests sent before the breaker got open
+                return
+            if self.state == self.HALF_OPEN:
+                self._open_time = min(self._open_time * 2,
+                                      self.max_open_seconds)
+            else:
+                self.failures += 1
+                if self.failures < self.failure_threshold:
+                    return
+                LOG.warning(
+                    '%s seems to be unavailable (%d failures in a row), '
+                    'opening the circuit breaker', self.name, self.failures)
+                BREAKER_TRIPS.inc(self.name)
+            self.state = self.OPEN
+            self._until = monotonic() + self._open_time
+
+
+class RetryBudget:
+    """
+    Token bucket that limits the rate of the retries of the whole process
+    to rate per second with bursts of up to burst retries.
+
+    The retries are never rejected: a retry that finds the bucket empty is
+    postponed until its token is due, so that the retries of many threads
+    get spread over time.
+    """
+    def __init__(self, rate: float = 10.0, burst: float = 20.0):
+        self.rate = rate
+        self.burst = burst
+        self.lock = Lock()
+        self._tokens = burst
+        self._updated = monotonic()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns the number of seconds to wait until it is
+        available (0 if the bucket is not empty).
+        """
+        with self.lock:
+            now = monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+            if self._tokens >= 0:
+                return 0.0
+            delay = -self._tokens / self.rate
+        BUDGET_DELAYS.inc()
+        return delay
+
+
+# Fed by every Consul HTTP API call (see hax.consul.client)
+CONSUL_BREAKER = CircuitBreaker('Consul')
+BREAKER_STATE.set_function(lambda: CONSUL_BREAKER.state, CONSUL_BREAKER.name)
+
+# Shared by all the repeat_if_fails() retries
+RETRY_BUDGET = RetryBudget()
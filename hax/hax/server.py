@@ -16,16 +16,14 @@
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 #
 
-import asyncio
 import base64
 import logging
 import os
 import ssl
-import sys
 import json
 from json.decoder import JSONDecodeError
 from queue import Queue
-from typing import Any, Callable, Dict, List, Type, Union, Optional
+from typing import Any, Callable, Dict, List, Type, Tuple, Union, Optional
 
 from aiohttp import web
 from aiohttp.web import HTTPError, HTTPNotFound
@@ -37,90 +35,110 @@ from hax.message import (BaseMessage, BroadcastHAStates, SnsDiskAttach,
                          SnsRebalanceStop, SnsRepairPause, SnsRepairResume,
                          SnsRepairStart, SnsRepairStatus, SnsRepairStop)
 from hax.common import HaxGlobalState
+from hax.consul.trace import TRACER
 from hax.motr.delivery import DeliveryHerald
 from hax.exception import HAConsistencyException
+from hax.handler_pool import (REJECTED_REQUESTS, HandlerPool,
+                              get_pools_stats)
+from hax.metrics import CONTENT_TYPE, REGISTRY
 from hax.motr import Motr
 from hax.motr.planner import WorkPlanner
 from hax.queue import BQProcessor
 from hax.queue.confobjutil import ConfObjUtil
 from hax.queue.offset import InboxFilter, OffsetStorage
+from hax.status import ClusterStatus, DocumentCache
 from hax.types import Fid, HAState, ObjHealth, StoppableThread
 from hax.util import ConsulUtil, create_process_fid, dump_json
-from helper.exec import Executor, Program
 from hax.util import repeat_if_fails
 from hax.ha.utils import HaUtils
 LOG = logging.getLogger('hax')
 
+# How long (in seconds) the documents served by /v1/cluster/* endpoints can
+# be reused. The documents are recomputed earlier if the mirrored KV data
+# changes.
+CLUSTER_STATUS_TTL = 1.0
+FETCH_FIDS_TTL = 30.0
+
+# The requests that add commands to WorkPlanner are rejected with
+# 503 Service Unavailable while the planner backlog has at least this number
+# of commands; the clients are asked to retry in PLANNER_RETRY_AFTER seconds.
+# Only the requests that get replayed or retried by their clients (bq
+# updates, SNS operations) are subject to this.
+MAX_PLANNER_BACKLOG = 10000
+PLANNER_RETRY_AFTER = 5
+
+# Route class -> (max number of threads, max number of queued handlers)
+HANDLER_POOLS: Dict[str, Tuple[int, Optional[int]]] = {
+    # Consul watch handlers of service health and processes updates: the
+    # http watch handlers are not retried by Consul, so the requests are
+    # never rejected (the queue is unbounded).
+    'watch': (2, None),
+    # Consul watch handler of bq updates: the rejected messages are not
+    # marked as read, so they come again with the next update.
+    'bq': (2, 256),
+    'sns': (2, 32),
+    'status': (2, 32),
+    'events': (2, 32),
+}
+
 
 async def hello_reply(request):
     return json_response(text="I'm alive! Sincerely, HaX")
 
 
-def get_python_env():
-    path = os.environ['PATH']
-    py_path = ':'.join(sys.path)
-    if 'PYTHONPATH' in os.environ:
-        env_var = os.environ['PYTHONPATH']
-        py_path = f'{env_var}:{py_path}'
-    env = {
-        'PATH':
-        ':'.join([
-            '/opt/seagate/cortx/hare/bin',
-            '/opt/seagate/cortx/hare/libexec', path
-        ]),
-        'PYTHONPATH':
-        py_path
-    }
-    return env
-
-
-def bytecount_stat(request):
+def check_planner_backlog(planner: WorkPlanner, pool: HandlerPool) -> None:
     """
-    Calls hare-status to provide CSM with --bytecount data in json format.
-
-    This function calls for hare-status script from hax-server in order to
-    provide CSM with an endpoint to get --byecount data in json format.
+    Raises HTTPServiceUnavailable if WorkPlanner has too many commands
+    waiting for execution.
     """
-    exec = Executor()
-    env = get_python_env()
-    result = exec.run(Program(["/opt/seagate/cortx/hare/libexec/hare-status",
-                      "--bytecount"]), env=env)
-    return json_response(text=result)
+    size = planner.get_backlog_size()
+    if size >= MAX_PLANNER_BACKLOG:
+        LOG.warning('WorkPlanner backlog is too long (%d commands), '
+                    'rejecting the request', size)
+        REJECTED_REQUESTS.inc(pool.name, 'planner_backlog')
+        raise web.HTTPServiceUnavailable(
+            headers={'Retry-After': str(PLANNER_RETRY_AFTER)})
 
 
-def hctl_stat(request):
-    """
-    Calls hare-status to provide CSM with hctl status --json data.
+async def get_metrics(request):
+    return web.Response(body=REGISTRY.render().encode(),
+                        headers={'Content-Type': CONTENT_TYPE})
 
-    This function calls the hare-status script from the hax-server in order
-    to provide CSM with an endpoint to get the hctl status --json data.
-    """
-    exec = Executor()
-    env = get_python_env()
-    result = exec.run(Program(["/opt/seagate/cortx/hare/libexec/hare-status",
-                      "--json"]), env=env)
-    return json_response(text=result)
 
+def get_handler_stats(pools: Dict[str, HandlerPool]):
+    async def _process(request):
+        return json_response(data=get_pools_stats(pools))
+
+    return _process
+
+
+async def get_consul_calls(request):
+    return json_response(data=TRACER.dump())
+
+
+async def reset_consul_calls(request):
+    TRACER.reset()
+    return web.Response()
 
-# This function implements the http fetch-fids request and thus, takes
-# request a parameter. The respective result is obtained by executing
-# corresponding `hctl-fetch-fids` script.
-def hctl_fetch_fids(request):
-    """
-    calls the hare-fetch-fids to provide info about services configured.
 
-    This function calls the hare-fetch-fids script from the hax-server in
-    order to provide details about services configured by Hare e.g. Hax,
-    ios, confd, rgw etc.
+def serve_document(cache: DocumentCache, pool: HandlerPool):
     """
-    exec = Executor()
-    env = get_python_env()
-    result = exec.run(Program(["/opt/seagate/cortx/hare/libexec/"
-                               "hare-fetch-fids",
-                               "--all",
-                               "--use-kv-store"]),
-                      env=env)
-    return json_response(text=result)
+    Serves the cached JSON document. Supports conditional requests: if the
+    document is not changed since the version the client has (i.e. its
+    ETag is given in If-None-Match), 304 Not Modified is returned.
+    """
+    async def _process(request):
+        doc = await pool.run(cache.get)
+        headers = {'ETag': doc.etag, 'Cache-Control': 'no-cache'}
+        if_none_match = request.headers.get('If-None-Match', '')
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        if doc.etag in tags or '*' in tags:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=doc.body,
+                            content_type='application/json',
+                            headers=headers)
+
+    return _process
 
 
 def to_ha_states(data: Any, consul_util: ConsulUtil) -> List[HAState]:
@@ -151,28 +169,29 @@ def to_ha_states(data: Any, consul_util: ConsulUtil) -> List[HAState]:
     return ha_states
 
 
-def process_ha_states(planner: WorkPlanner, consul_util: ConsulUtil):
+def process_ha_states(planner: WorkPlanner, consul_util: ConsulUtil,
+                      pool: HandlerPool):
     async def _process(request):
         data = await request.json()
 
-        loop = asyncio.get_event_loop()
-
         def fn():
             # import pudb.remote
             # pudb.remote.set_trace(term_size=(80, 40), port=9998)
             LOG.info('Service health from Consul: %s', data)
+            # The health checks have changed, the snapshot is outdated.
+            consul_util.health.invalidate()
             planner.add_command(
                 BroadcastHAStates(states=to_ha_states(data, consul_util),
                                   reply_to=None))
 
         # Note that planner.add_command is potentially a blocking call
-        await loop.run_in_executor(None, fn)
+        await pool.run(fn)
         return web.Response()
 
     return _process
 
 
-def process_sns_operation(planner: WorkPlanner):
+def process_sns_operation(planner: WorkPlanner, pool: HandlerPool):
     async def _process(request):
         op_name = request.match_info.get('operation')
 
@@ -201,11 +220,11 @@ def process_sns_operation(planner: WorkPlanner):
         LOG.info(f'process_sns_operation: {op_name}')
         if op_name not in msg_factory:
             raise HTTPNotFound()
+        check_planner_backlog(planner, pool)
         data = await request.json()
         message = msg_factory[op_name](data)
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, lambda: planner.add_command(message))
+        await pool.run(planner.add_command, message)
         return web.Response()
 
     return _process
@@ -213,7 +232,8 @@ def process_sns_operation(planner: WorkPlanner):
 
 def get_sns_status(planner: WorkPlanner,
                    status_type: Union[Type[SnsRepairStatus],
-                                      Type[SnsRebalanceStatus]]):
+                                      Type[SnsRebalanceStatus]],
+                   pool: HandlerPool):
     def fn(request):
         queue: Queue = Queue(1)
         planner.add_command(
@@ -223,41 +243,44 @@ def get_sns_status(planner: WorkPlanner,
 
     async def _process(request):
         LOG.debug('%s with params: %s', request, request.query)
-        loop = asyncio.get_event_loop()
-        payload = await loop.run_in_executor(None, fn, request)
+        payload = await pool.run(fn, request)
         return json_response(data=payload, dumps=dump_json)
 
     return _process
 
 
-def process_bq_update(inbox_filter: InboxFilter, processor: BQProcessor):
+def process_bq_update(inbox_filter: InboxFilter, processor: BQProcessor,
+                      planner: WorkPlanner, pool: HandlerPool):
     async def _process(request):
+        # Note that the rejected messages are not marked as read, so they
+        # will be processed when the next bq update comes.
+        check_planner_backlog(planner, pool)
         data = await request.json()
 
         def fn():
             messages = inbox_filter.prepare(data)
             if not messages:
                 return
-            for i, msg in messages:
-                processor.process((i, msg))
+            # The broadcasts of all the messages are awaited together
+            deliveries = [(i, processor.process((i, msg)))
+                          for i, msg in messages]
+            for i, delivery in deliveries:
+                processor.wait_delivered(i, delivery)
                 # Mark the message as read ASAP since the process can
                 # potentially die any time
                 inbox_filter.offset_mgr.mark_last_read(i)
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, fn)
+        await pool.run(fn)
 
         return web.Response()
 
     return _process
 
 
-def process_state_update(planner: WorkPlanner):
+def process_state_update(planner: WorkPlanner, pool: HandlerPool):
     async def _process(request):
         data = await request.json()
 
-        loop = asyncio.get_event_loop()
-
         def fn():
             proc_state_to_objhealth = {
                 'M0_CONF_HA_PROCESS_STARTING': ObjHealth.OFFLINE,
@@ -289,7 +312,9 @@ def process_state_update(planner: WorkPlanner):
                     BroadcastHAStates(states=ha_states, reply_to=None))
         # Note that planner.add_command is potentially a blocking call
         try:
-            await loop.run_in_executor(None, fn)
+            await pool.run(fn)
+        except web.HTTPException:
+            raise
         except Exception:
             LOG.exception("process state update error")
         return web.Response()
@@ -297,15 +322,15 @@ def process_state_update(planner: WorkPlanner):
     return _process
 
 
-def event_subscription_handle(consul_util: ConsulUtil):
+def event_subscription_handle(consul_util: ConsulUtil, pool: HandlerPool):
     async def _process(request):
         data = await request.json()
 
-        loop = asyncio.get_event_loop()
-
         try:
             ha_util = HaUtils(consul_util)
-            await loop.run_in_executor(None, ha_util.event_subscribe, data)
+            await pool.run(ha_util.event_subscribe, data)
+        except web.HTTPException:
+            raise
         except Exception as e:
             LOG.exception(f'Event subscribe error: {e}')
             return web.Response(text=f'Event subscribe error: {e}')
@@ -314,15 +339,15 @@ def event_subscription_handle(consul_util: ConsulUtil):
     return _process
 
 
-def event_unsubscription_handle(consul_util: ConsulUtil):
+def event_unsubscription_handle(consul_util: ConsulUtil, pool: HandlerPool):
     async def _process(request):
         data = await request.json()
 
-        loop = asyncio.get_event_loop()
-
         try:
             ha_util = HaUtils(consul_util)
-            await loop.run_in_executor(None, ha_util.event_unsubscribe, data)
+            await pool.run(ha_util.event_unsubscribe, data)
+        except web.HTTPException:
+            raise
         except Exception as e:
             LOG.exception(f'Event unsubscribe error: {e}')
             return web.Response(text=f'Event unsubscribe error: {e}')
@@ -369,10 +394,33 @@ class ServerRunner:
         self.motr = motr
         self.planner = planner
         self.hax_state = hax_state
+        self.pools: Dict[str, HandlerPool] = {}
 
     def _create_server(self) -> web.Application:
         return web.Application(middlewares=[encode_exception])
 
+    def _create_status_caches(self) -> Dict[str, DocumentCache]:
+        consul_util = self.consul_util
+        status = ClusterStatus(consul_util)
+
+        def kv_version() -> Any:
+            mirror = consul_util.kv.mirror
+            if mirror is None:
+                return None
+            return (mirror.get_version('m0conf/'),
+                    mirror.get_version('processes/'))
+
+        return {
+            'status': DocumentCache(status.get_status,
+                                    ttl=CLUSTER_STATUS_TTL,
+                                    version_fn=kv_version),
+            'bytecount': DocumentCache(status.get_bytecount,
+                                       ttl=CLUSTER_STATUS_TTL),
+            'fetch-fids': DocumentCache(status.get_fids,
+                                        ttl=FETCH_FIDS_TTL,
+                                        version_fn=kv_version),
+        }
+
     def _get_my_hostname(self) -> str:
         hax_hostname: str = self.consul_util.get_hax_hostname()
         return hax_hostname
@@ -399,37 +447,64 @@ class ServerRunner:
             herald = self.herald
             motr = self.motr
             consul_util = self.consul_util
+            docs = self._create_status_caches()
+            self._shutdown_pools()
+            planner.export_metrics()
+            herald.export_metrics()
+            self.pools = pools = {
+                name: HandlerPool(name, max_workers, max_queued)
+                for name, (max_workers, max_queued) in HANDLER_POOLS.items()
+            }
 
             app = self._create_server()
             app.add_routes([
                 web.get('/', hello_reply),
-                web.get('/v1/cluster/status', hctl_stat),
-                web.get('/v1/cluster/status/bytecount', bytecount_stat),
-                web.get('/v1/cluster/fetch-fids', hctl_fetch_fids),
-                web.post('/', process_ha_states(planner, consul_util)),
+                web.get('/v1/cluster/status',
+                        serve_document(docs['status'], pools['status'])),
+                web.get('/v1/cluster/status/bytecount',
+                        serve_document(docs['bytecount'], pools['status'])),
+                web.get('/v1/cluster/fetch-fids',
+                        serve_document(docs['fetch-fids'], pools['status'])),
+                web.get('/v1/hax/handlers', get_handler_stats(pools)),
+                web.get('/metrics', get_metrics),
+                web.get('/v1/hax/consul-calls', get_consul_calls),
+                web.delete('/v1/hax/consul-calls', reset_consul_calls),
+                web.post('/',
+                         process_ha_states(planner, consul_util,
+                                           pools['watch'])),
                 web.post(
                     '/watcher/bq',
                     process_bq_update(inbox_filter,
                                       BQProcessor(planner, herald, motr,
-                                                  conf_obj))),
+                                                  conf_obj),
+                                      planner, pools['bq'])),
                 web.post(
                     '/watcher/processes',
-                    process_state_update(planner)),
+                    process_state_update(planner, pools['watch'])),
                 web.post('/api/v1/sns/{operation}',
-                         process_sns_operation(planner)),
+                         process_sns_operation(planner, pools['sns'])),
                 web.get('/api/v1/sns/repair-status',
-                        get_sns_status(planner, SnsRepairStatus)),
+                        get_sns_status(planner, SnsRepairStatus,
+                                       pools['sns'])),
                 web.get('/api/v1/sns/rebalance-status',
-                        get_sns_status(planner, SnsRebalanceStatus)),
+                        get_sns_status(planner, SnsRebalanceStatus,
+                                       pools['sns'])),
                 web.post('/v1/events/subscribe',
-                         event_subscription_handle(consul_util)),
+                         event_subscription_handle(consul_util,
+                                                   pools['events'])),
                 web.post('/v1/events/unsubscribe',
-                         event_unsubscription_handle(consul_util)),
+                         event_unsubscription_handle(consul_util,
+                                                     pools['events'])),
             ])
             self.app = app
         except Exception as e:
             raise HAConsistencyException('Failed to configure hax') from e
 
+    def _shutdown_pools(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown()
+        self.pools = {}
+
     def _get_ssl_context(self) -> Optional[ssl.SSLContext]:
         ssl_config = self.consul_util.get_hax_ssl_config()
         if not ssl_config or ssl_config.get('http_protocol') != "https":
@@ -477,6 +552,7 @@ class ServerRunner:
             self.hax_state.set_stopping()
             LOG.debug('Stopping the threads')
             self.planner.shutdown()
+            self._shutdown_pools()
             for thread in threads_to_wait:
                 thread.stop()
             for thread in threads_to_wait:
@@ -0,0 +1,284 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+import hashlib
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional
+
+import simplejson
+
+from hax.types import Fid, ObjT
+from hax.util import STATIC_READ, ConsulUtil, repeat_if_fails
+
+__all__ = ['ClusterStatus', 'Document', 'DocumentCache']
+
+LOG = logging.getLogger('hax')
+
+# Human readable names of the processes by their service types
+# (see hare-status)
+PROCESS_NAMES = {
+    'confd': 'confd',
+    'ha': 'hax',
+    'ios': 'ioservice',
+    'm0_client_s3': 's3server'
+}
+
+# Names of the services reported by hare-fetch-fids by their service types;
+# the Motr client types are reported under their own names.
+FETCH_FIDS_NAMES = {'confd': 'confd', 'ios': 'ioservice', 'ha': 'hax'}
+CONFD_XC = '/etc/motr/confd.xc'
+
+
+@dataclass
+class Document:
+    """
+    Serialized JSON document along with its entity tag.
+    """
+    body: bytes
+    etag: str
+
+    @staticmethod
+    def from_data(data: Any) -> 'Document':
+        text = simplejson.dumps(data, indent=2, for_json=True)
+        return Document.from_text(text)
+
+    @staticmethod
+    def from_text(text: str) -> 'Document':
+        body = text.encode()
+        digest = hashlib.sha1(body).hexdigest()
+        return Document(body=body, etag=f'"{digest}"')
+
+
+class DocumentCache:
+    """
+    Keeps the last computed document and recomputes it when it gets older
+    than ttl seconds or when the value returned by version_fn changes (e.g.
+    the version of the KV mirror).
+
+    Concurrent requests of an outdated document wait for a single
+    computation instead of starting their own ones.
+    """
+    def __init__(self,
+                 compute: Callable[[], Document],
+                 ttl: float,
+                 version_fn: Optional[Callable[[], Any]] = None):
+        self.compute = compute
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.lock = Lock()
+        self._doc: Optional[Document] = None
+        self._expires = 0.0
+        self._version: Any = None
+
+    def _get_version(self) -> Any:
+        return self.version_fn() if self.version_fn else None
+
+    def get(self) -> Document:
+        with self.lock:
+            version = self._get_version()
+            doc = self._doc
+            if doc is not None and monotonic() < self._expires \
+                    and version == self._version:
+                return doc
+            doc = self.compute()
+            self._doc = doc
+            self._version = version
+            self._expires = monotonic() + self.ttl
+            return doc
+
+
+class ClusterStatus:
+    """
+    Computes the cluster status the same way as `hare-status --json`,
+    `hare-status --bytecount` and `hare-fetch-fids --all` do, but
+    in-process and with a few bulk KV reads instead of per-node and
+    per-process ones.
+    """
+    def __init__(self, consul_util: ConsulUtil):
+        self.consul_util = consul_util
+
+    def _get_items(self,
+                   prefix: str,
+                   consistency: Optional[str] = None) -> List[Dict[str, Any]]:
+        kwargs = {'consistency': consistency} if consistency else {}
+        return self.consul_util.kv.kv_get(prefix,
+                                          recurse=True,
+                                          allow_null=True,
+                                          **kwargs) or []
+
+    def _get_value(self, key: str) -> Optional[str]:
+        item = self.consul_util.kv.kv_get(key, allow_null=True)
+        if not item or item['Value'] is None:
+            return None
+        return str(item['Value'].decode())
+
+    def _get_bytecount(self) -> Dict[str, Any]:
+        return {
+            x['Key'].split('/')[-1]: json.loads(x['Value'])
+            for x in self._get_items('bytecount/')
+        }
+
+    def _get_process_states(self) -> Dict[str, str]:
+        states: Dict[str, str] = {}
+        for proc in self._get_items('processes/'):
+            key_split = proc['Key'].split('/')
+            if len(key_split) != 2:
+                continue
+            val = json.loads(proc['Value'])
+            if val['state'] in ('M0_CONF_HA_PROCESS_STARTED',
+                                'M0_CONF_HA_PROCESS_DTM_RECOVERED'):
+                state = 'started'
+            elif val['state'] in ('Unknown', 'UNKNOWN'):
+                state = 'unknown'
+            else:
+                state = 'offline'
+            states[key_split[-1]] = state
+        return states
+
+    def _get_nodes(self) -> List[Dict[str, Any]]:
+        topology = self.consul_util.get_nodes_topology()
+        proc_states = self._get_process_states()
+        names = dict(PROCESS_NAMES)
+        client_types = self._get_value('m0_client_types')
+        for client_type in json.loads(client_types or '[]'):
+            names[client_type] = client_type
+
+        def proc_name(fidk: int) -> str:
+            for svc_type, _ in topology.get_process_services(fidk):
+                if svc_type in names:
+                    return names[svc_type]
+            return 'm0_client'
+
+        def proc_status(health: str, fid: Fid) -> str:
+            if health != 'passing':
+                return 'offline'
+            return proc_states.get(str(fid), 'unknown')
+
+        nodes = []
+        for node in topology.get_objects(ObjT.NODE):
+            name = node.value.get('name')
+            if name is None:
+                continue
+            health = self.consul_util.get_node_health_status(name)
+            fidks = sorted(p.fid.key for p in topology.get_children(node.fid)
+                           if p.fid.container == ObjT.PROCESS.value)
+            svcs = []
+            for fidk in fidks:
+                fid = Fid(ObjT.PROCESS.value, fidk)
+                ep = topology.get_process_endpoint(fidk)
+                svcs.append({
+                    'name': proc_name(fidk),
+                    'fid': fid,
+                    'ep': ep or '**ERROR**',
+                    'status': proc_status(health, fid)
+                })
+            nodes.append({'name': name, 'svcs': svcs})
+        return nodes
+
+    def _get_fids(self) -> List[Dict[str, Any]]:
+        topology = self.consul_util.get_nodes_topology()
+        client_types = json.loads(
+            self._get_value('m0_client_types') or '[]')
+        names = dict(FETCH_FIDS_NAMES)
+        for client_type in client_types:
+            names[client_type] = client_type
+        profiles = self._get_items('m0conf/profiles/', STATIC_READ)
+        profile_fid = profiles[0]['Key'].split('/')[-1] if profiles else None
+
+        nodes = []
+        for node in topology.get_objects(ObjT.NODE):
+            name = node.value.get('name')
+            if name is None:
+                continue
+            # Note: hare-fetch-fids follows the order of the legacy KV keys,
+            # where the process fidks are strings.
+            fidks = sorted((p.fid.key for p in topology.get_children(node.fid)
+                            if p.fid.container == ObjT.PROCESS.value),
+                           key=str)
+            procs = [(fidk, svc_type) for fidk in fidks
+                     for svc_type, _ in topology.get_process_services(fidk)
+                     if svc_type in names]
+            ha_ep = next((topology.get_process_endpoint(fidk)
+                          for fidk, svc_type in procs if svc_type == 'ha'),
+                         None)
+            # Same as `uuidgen --time`
+            node_uuid = str(uuid.uuid1())
+            svcs = []
+            for fidk, svc_type in procs:
+                svc: Dict[str, Any] = {
+                    'name': names[svc_type],
+                    'fid': Fid(ObjT.PROCESS.value, fidk),
+                    'ep': topology.get_process_endpoint(fidk)
+                }
+                if svc_type == 'confd':
+                    svc.update({'ha_ep': ha_ep,
+                                'conf_xc': CONFD_XC,
+                                'uuid': node_uuid})
+                elif svc_type == 'ios':
+                    svc.update({'ha_ep': ha_ep, 'uuid': node_uuid})
+                    meta_data = topology.get_process_meta_data(fidk)
+                    if meta_data:
+                        svc['be_seg_path'] = meta_data
+                elif svc_type in client_types:
+                    svc.update({'ha_ep': ha_ep, 'profile_fid': profile_fid})
+                svcs.append(svc)
+            nodes.append({
+                'name': name,
+                'svcs': svcs,
+                'ha_ep': ha_ep,
+                'uuid': node_uuid
+            })
+        return nodes
+
+    # The delay does not grow, so these give up within 2 minutes
+    @repeat_if_fails(max_retries=24, max_wait_seconds=5)
+    def get_bytecount(self) -> Document:
+        return Document.from_data({'bytecount': self._get_bytecount()})
+
+    @repeat_if_fails(max_retries=24, max_wait_seconds=5)
+    def get_status(self) -> Document:
+        pools = [{
+            'fid': x['Key'].split('/')[-1],
+            'name': x['Value'].decode()
+        } for x in self._get_items('m0conf/pools/', STATIC_READ)]
+        profiles = []
+        for x in self._get_items('m0conf/profiles/', STATIC_READ):
+            payload = json.loads(x['Value'])
+            profiles.append({
+                'fid': x['Key'].split('/')[-1],
+                'name': payload['name'],
+                'pools': payload['pools']
+            })
+        stats = self._get_value('stats/filesystem')
+        status = {
+            'bytecount': self._get_bytecount(),
+            'pools': pools,
+            'profiles': profiles,
+            'filesystem': json.loads(stats) if stats else {'stats': {}},
+            'nodes': self._get_nodes()
+        }
+        return Document.from_data(status)
+
+    @repeat_if_fails(max_retries=24, max_wait_seconds=5)
+    def get_fids(self) -> Document:
+        return Document.from_data(self._get_fids())
@@ -19,7 +19,7 @@
 import ctypes as c
 from enum import Enum, IntEnum
 from threading import Thread
-from typing import List, NamedTuple, Set
+from typing import Iterator, List, NamedTuple, Set
 from recordclass import recordclass
 
 
@@ -196,6 +196,9 @@ class Fid:
         return isinstance(other, Fid) and \
             other.container == self.container and other.key == self.key
 
+    def __hash__(self):
+        return hash((self.container, self.key))
+
     def for_json(self):
         return self.__repr__()
 
@@ -313,6 +316,9 @@ class HaLinkMessagePromise:
     def __contains__(self, message_id: MessageId) -> bool:
         return message_id in self._ids
 
+    def __iter__(self) -> Iterator[MessageId]:
+        return iter(list(self._ids))
+
     def __repr__(self):
         return 'HaLinkMessagePromise' + str(self._ids)
 
@@ -22,33 +22,74 @@ import logging
 import os
 import re
 from base64 import b64encode
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
-from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from typing import (Any, Callable, Dict, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple)
 from hax.log import TRACE
-from threading import Event, Lock
-from time import sleep
+from threading import Event, Lock, local
+from time import monotonic, sleep
 
 import simplejson
-from consul import Consul, ConsulException
+from consul import ConsulException
 from consul.base import ClientError
 from requests.exceptions import RequestException
 from urllib3.exceptions import HTTPError
 
 from hax.common import HaxGlobalState
 from hax.exception import HAConsistencyException, InterruptedException
+from hax.metrics import REGISTRY
+from hax.retry import CONSUL_BREAKER, RETRY_BUDGET, backoff_delay
 from hax.types import (ByteCountStats, ConfHaProcess, Fid, FsStatsWithTime,
                        FidTypeToObjT, ObjT, ObjHealth, ObjTMaskMap,
                        Profile, PverInfo, PverState, m0HaProcessEvent,
                        m0HaProcessType, KeyDelete, HaNoteStruct, m0HaObjState)
 
-from hax.consul.cache import (uses_consul_cache, invalidates_consul_cache,
-                              supports_consul_cache)
+from hax.consul.cache import (invalidate_kv_key, keyed_by_class,
+                              pending_kv_writes, record_kv_read,
+                              supports_consul_cache, uses_consul_cache)
+from hax.consul.client import Consul
+from hax.consul.health import HealthSnapshot
+from hax.consul.mirror import KVMirror, get_kv_mirror
+from hax.consul.topology import Topology
+from hax.consul.trace import skip_frames_of
 
 __all__ = ['ConsulUtil', 'create_process_fid', 'create_service_fid',
            'create_sdev_fid', 'create_drive_fid']
 
 LOG = logging.getLogger('hax')
 
+# Max number of operations Consul accepts in a single transaction
+MAX_TXN_OPS = 64
+
+# Read consistency mode of the data that doesn't change after the bootstrap:
+# the names and the structure of the configuration objects under m0conf/
+# (but not their 'state' fields), the Consul service registrations,
+# m0_client_types, ssl/hax etc. Such reads can be served by any Consul
+# server instead of the Raft leader only.
+#
+# The other reads use the default mode (see 'consistency' of Consul()).
+STATIC_READ = 'stale'
+
+RETRIES = REGISTRY.counter(
+    'hax_retries_total',
+    'Number of retries made by repeat_if_fails() per wrapped function',
+    ['function'])
+RETRY_GIVEUPS = REGISTRY.counter(
+    'hax_retry_giveups_total',
+    'Number of times repeat_if_fails() ran out of max_retries',
+    ['function'])
+RETRY_DELAY = REGISTRY.histogram(
+    'hax_retry_delay_seconds', 'Delays between the repeat_if_fails() attempts')
+SHORT_CIRCUITED_CALLS = REGISTRY.counter(
+    'hax_short_circuited_calls_total',
+    'Number of repeat_if_fails() attempts skipped because Consul was known '
+    'to be unavailable')
+
+# Nesting depth of the repeat_if_fails() calls of the current thread
+_retry_depth = local()
+
 motr_processes_status: dict = {}
 
 # XXX What is the difference between `ip_addr` and `address`?
@@ -58,6 +99,16 @@ ServiceData = NamedTuple('ServiceData', [('node', str), ('fid', Fid),
 
 FidWithType = NamedTuple('FidWithType', [('fid', Fid), ('service_type', str)])
 
+# The conf objects whose states follow the state of a process
+# (see Motr.broadcast_ha_states()).
+ProcessClosure = NamedTuple('ProcessClosure',
+                            [('node', str), ('node_fid', Fid),
+                             ('encl_fid', Optional[Fid]),
+                             ('ctrl_fid', Optional[Fid]),
+                             ('services', List[FidWithType]),
+                             ('service_fids', List[Fid]),
+                             ('drives', List[Fid])])
+
 
 MotrConsulProcInfo = NamedTuple('MotrConsulProcInfo', [('proc_status', str),
                                                        ('proc_type', str)])
@@ -142,7 +193,7 @@ ha_conf_obj_states = ('M0_NC_UNKNOWN',
                       'M0_NC_DTM_RECOVERING')
 
 
-def repeat_if_fails(wait_seconds=5, max_retries=-1):
+def repeat_if_fails(wait_seconds=5, max_retries=-1, max_wait_seconds=30):
     """
     Ensures that the wrapped function gets re-invoked if
     HAConsistencyException gets raised. In other words, this wrapper
@@ -150,20 +201,49 @@ def repeat_if_fails(wait_seconds=5, max_retries=-1):
 
     Parameters:
 
-    wait_seconds - delay (in seconds) between the attempts. The delay
-         applies after HAConsistencyException is raised.
+    wait_seconds - delay (in seconds) before the first retry. The delay
+         applies after HAConsistencyException is raised and doubles with
+         every next attempt up to max_wait_seconds; the actual delay is
+         randomized within [delay/2, delay] (see backoff_delay()).
     max_retries - how many attempts the wrapper will perform until finally
          re-raising the exception. -1 means 'repeat forever'.
+    max_wait_seconds - upper bound of the delay between the attempts
+         (whatever the reason of the delay is). The bounded callers that
+         must give up in a predictable time pass max_wait_seconds equal to
+         wait_seconds: then the delay doesn't grow.
+
+    While Consul is known to be unavailable (see CONSUL_BREAKER), the
+    function is not invoked at all: the attempt fails right away and the
+    wrapper waits for the breaker to let a probe through. The breaker is
+    checked by the outermost repeat_if_fails() of the thread only: the
+    nested ones are a part of the same attempt (and of the same probe). The
+    retries of the whole process are also rate-limited by RETRY_BUDGET, so
+    that the threads that failed at the same time don't hammer Consul once
+    it is back.
     """
+    max_wait = max(wait_seconds, max_wait_seconds)
+
     def callable(f):
         @wraps(f)
         def wrapper(*args, **kwds):
-            attempt_count = 0
-            state: HaxGlobalState = inject.instance(HaxGlobalState)
-            while (True):
-                try:
-                    return f(*args, **kwds)
-                except HAConsistencyException as e:
+            depth: int = getattr(_retry_depth, 'value', 0)
+            outermost = depth == 0
+            _retry_depth.value = depth + 1
+            try:
+                attempt_count = 0
+                state: HaxGlobalState = inject.instance(HaxGlobalState)
+                while (True):
+                    breaker_wait = CONSUL_BREAKER.check() if outermost \
+                        else 0.0
+                    if breaker_wait:
+                        SHORT_CIRCUITED_CALLS.inc()
+                        e = HAConsistencyException(
+                            'Consul is unavailable (circuit breaker is open)')
+                    else:
+                        try:
+                            return f(*args, **kwds)
+                        except HAConsistencyException as exc:
+                            e = exc
                     if state.is_stopping():
                         LOG.warning(
                             'HAConsistencyException will not cause '
@@ -174,19 +254,39 @@ def repeat_if_fails(wait_seconds=5, max_retries=-1):
                         LOG.warning(
                             'Function %s: Too many errors happened in a row '
                             '(max_retries = %d)', f.__name__, max_retries)
+                        RETRY_GIVEUPS.inc(f.__qualname__)
                         raise e
+                    delay = min(
+                        max(backoff_delay(attempt_count, wait_seconds,
+                                          max_wait), breaker_wait,
+                            RETRY_BUDGET.reserve()), max_wait)
+                    RETRIES.inc(f.__qualname__)
+                    RETRY_DELAY.observe(delay)
                     LOG.debug(
                         f'Got HAConsistencyException: {e.message} while '
                         f'invoking function {f.__name__} '
                         f'(attempt {attempt_count}). The attempt will be '
-                        f'repeated in {wait_seconds} seconds')
-                    sleep(wait_seconds)
+                        f'repeated in {delay:.2f} seconds')
+                    _sleep_unless_stopping(state, delay)
+            finally:
+                _retry_depth.value = depth
 
         return wrapper
 
     return callable
 
 
+def _sleep_unless_stopping(state: HaxGlobalState, seconds: float) -> None:
+    # The delays can be long, so the application shutdown is checked every
+    # second.
+    deadline = monotonic() + seconds
+    while not state.is_stopping():
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return
+        sleep(min(remaining, 1.0))
+
+
 TxPutKV = NamedTuple('TxPutKV', [('key', str), ('value', str),
                                  ('cas', Optional[Any])])
 
@@ -206,9 +306,108 @@ def wait_for_event(event: Event, interval_sec) -> None:
         raise InterruptedException()
 
 
+@keyed_by_class
 class KVAdapter:
     def __init__(self, cns: Optional[Consul] = None):
         self.cns = cns or Consul()
+        self._mirror: Optional[KVMirror] = None
+        # Per-thread write set, see batch()
+        self._batch = local()
+
+    @property
+    def mirror(self) -> Optional[KVMirror]:
+        """
+        The mirror that serves the reads of the mirrored keys from memory
+        (see KVMirror): the one set explicitly or the process-wide one (see
+        configure_kv_mirror()).
+        """
+        if self._mirror is not None:
+            return self._mirror
+        return get_kv_mirror()
+
+    @mirror.setter
+    def mirror(self, mirror: Optional[KVMirror]) -> None:
+        self._mirror = mirror
+
+    def _pending_writes(self) -> Optional[Dict[str, str]]:
+        writes: Optional[Dict[str, str]] = getattr(self._batch, 'writes', None)
+        return writes
+
+    def has_pending_writes(self, prefix: str) -> bool:
+        """
+        Returns True if the current thread has the batched writes of the keys
+        starting with the given prefix that are not flushed yet.
+        """
+        writes = self._pending_writes() or {}
+        return any(k.startswith(prefix) for k in writes)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Accumulates the kv_put() calls made by the current thread within the
+        context into a write set and flushes it via KV transactions (up to
+        MAX_TXN_OPS operations per transaction) on exit. The batched values
+        are visible to kv_get() of the same thread before the flush.
+
+        kv_put() reports the batched writes as done, so the write set is
+        flushed even if the context exits with an exception (the same way
+        the writes would be done without the batch). Every transaction is
+        retried until it succeeds (see _flush_chunk()).
+        Nested contexts join the outermost one.
+        """
+        if self._pending_writes() is not None:
+            yield
+            return
+        writes: Dict[str, str] = OrderedDict()
+        self._batch.writes = writes
+        try:
+            with pending_kv_writes(writes):
+                yield
+        finally:
+            self._batch.writes = None
+            self._flush_writes(writes)
+
+    def _flush_pending_writes(self) -> None:
+        writes = self._pending_writes()
+        if writes:
+            pending = OrderedDict(writes)
+            writes.clear()
+            self._flush_writes(pending)
+
+    def _flush_writes(self, writes: Dict[str, str]) -> None:
+        ops = [TxPutKV(key=k, value=v, cas=None) for k, v in writes.items()]
+        if ops:
+            LOG.debug('Flushing %d batched KV writes', len(ops))
+        for i in range(0, len(ops), MAX_TXN_OPS):
+            self._flush_chunk(ops[i:i + MAX_TXN_OPS])
+
+    @repeat_if_fails()
+    def _flush_chunk(self, chunk: List[TxPutKV]) -> None:
+        # Note: the writes are unconditional, so the whole chunk can be
+        # written again if Consul fails in the middle.
+        if not self.kv_put_in_transaction(chunk):
+            LOG.warning('KV transaction of %d writes rejected, writing '
+                        'the keys one by one', len(chunk))
+            for op in chunk:
+                self._put(op.key, op.value)
+
+    @staticmethod
+    def _apply_pending_writes(key: str, data: Any, writes: Dict[str, str],
+                              recurse: bool) -> Any:
+        def overlay(k: str, item: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            new_item = dict(item or {'Key': k})
+            new_item['Value'] = writes[k].encode()
+            return new_item
+
+        if not recurse:
+            return overlay(key, data) if key in writes else data
+        found = {item['Key']: item for item in data or []}
+        for k in writes:
+            if k.startswith(key):
+                found[k] = overlay(k, found.get(k))
+        if not found:
+            return None
+        return [found[k] for k in sorted(found)]
 
     def kv_get_raw(self, key: str, **kwargs) -> Tuple[int, Any]:
         """
@@ -216,6 +415,7 @@ class KVAdapter:
         we want to invoke Consul.kv.get()
         """
         assert key
+        record_kv_read(key, recurse=kwargs.get('recurse', False))
         try:
             return self.cns.kv.get(key, **kwargs)
         except (ConsulException, HTTPError, RequestException) as e:
@@ -225,22 +425,55 @@ class KVAdapter:
     def kv_get(self, key: str, kv_cache=None,
                allow_null=False, **kwargs) -> Any:
         LOG.debug('KVGET key=%s, kwargs=%s', key, kwargs)
-        data = self.kv_get_raw(key, **kwargs)[1]
+        mirror = self.mirror
+        recurse = kwargs.get('recurse', False)
+        # Note: the mirrored data is at least as fresh as the one of a stale
+        # read, but may lag behind the leader.
+        if mirror is not None and mirror.covers(key) and \
+                not set(kwargs) - {'recurse', 'consistency'} and \
+                kwargs.get('consistency') != 'consistent':
+            record_kv_read(key, recurse=recurse)
+            data = mirror.get(key, recurse=recurse)
+        else:
+            data = self.kv_get_raw(key, **kwargs)[1]
+        writes = self._pending_writes()
+        if writes:
+            data = self._apply_pending_writes(key, data, writes, recurse)
         if data is None and allow_null is False:
             raise HAConsistencyException('Could not get data from Consul KV')
         return data
 
-    @invalidates_consul_cache
     def kv_put(self, key: str, data: str, kv_cache=None, **kwargs) -> bool:
         """
         Helper method that should be used by default in this class whenver
         we want to invoke Consul.kv.put()
         """
         assert key
+        # The cached values that depend on the key are dropped even if the
+        # put fails: the actual value in KV is unknown then. They are
+        # dropped again once the value is written (see _put()), since the
+        # concurrent readers may have cached the old value meanwhile.
+        invalidate_kv_key(key, kv_cache=kv_cache)
+        writes = self._pending_writes()
+        if writes is not None and not kwargs:
+            writes.pop(key, None)
+            writes[key] = data
+            return True
+        # Conditional writes (cas, acquire etc) can't be postponed; the
+        # batched writes must not be reordered with them.
+        self._flush_pending_writes()
+        return self._put(key, data, **kwargs)
+
+    def _put(self, key: str, data: str, **kwargs) -> bool:
         try:
-            return self.cns.kv.put(key, data, **kwargs)
+            result = self.cns.kv.put(key, data, **kwargs)
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException('Failed to put value to KV') from e
+        if result:
+            if self.mirror is not None:
+                self.mirror.put_local(key, data)
+            invalidate_kv_key(key)
+        return result
 
     def kv_put_in_transaction(self, tx_payload: List[TxPutKV]) -> bool:
         def to_payload(v: TxPutKV) -> Dict[str, Any]:
@@ -258,9 +491,11 @@ class KVAdapter:
                 }
             return {'KV': {'Key': v.key, 'Value': b64_str, 'Verb': 'set'}}
 
+        self._flush_pending_writes()
+        for item in tx_payload:
+            invalidate_kv_key(item.key)
         try:
             self.cns.txn.put([to_payload(i) for i in tx_payload])
-            return True
         except ClientError:
             # If a transaction fails, Consul returns HTTP 409 with the
             # JSON payload describing the reason why the transaction
@@ -270,16 +505,23 @@ class KVAdapter:
             return False
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException('Failed to put value to KV') from e
+        for item in tx_payload:
+            if self.mirror is not None:
+                self.mirror.put_local(item.key, item.value)
+            invalidate_kv_key(item.key)
+        return True
 
-    @repeat_if_fails(max_retries=5)
+    @repeat_if_fails(max_retries=5, max_wait_seconds=5)
     def kv_delete_in_transaction(self, tx_payload: List[KeyDelete]) -> bool:
         def to_payload(v: KeyDelete) -> Dict[str, Any]:
             return {'KV': {'Key': v.name, 'Verb':
                            'delete-tree' if v.recurse else 'delete'}}
 
+        self._flush_pending_writes()
+        for item in tx_payload:
+            invalidate_kv_key(item.name, recurse=item.recurse)
         try:
             self.cns.txn.put([to_payload(i) for i in tx_payload])
-            return True
         except ClientError:
             # If a transaction fails, Consul returns HTTP 409 with the
             # JSON payload describing the reason why the transaction
@@ -290,20 +532,26 @@ class KVAdapter:
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException(f'Failed to delete key(s)'
                                          f' from KV, error: {e}')
+        for item in tx_payload:
+            if self.mirror is not None:
+                self.mirror.delete_local(item.name, recurse=item.recurse)
+            invalidate_kv_key(item.name, recurse=item.recurse)
+        return True
 
 
 class CatalogAdapter:
     def __init__(self, cns: Optional[Consul] = None):
         self.cns: Consul = cns or Consul()
 
-    def get_node_names(self) -> List[str]:
+    def get_node_names(self, consistency: Optional[str] = None) -> List[str]:
         """
         Return full list of service names currently registered in Consul
         server.
         """
         try:
             node_names: List[str] = []
-            nodes: List[Dict[str, Any]] = self.cns.catalog.nodes()[1]
+            nodes: List[Dict[str, Any]] = self.cns.catalog.nodes(
+                consistency=consistency)[1]
             for node in nodes:
                 node_names.append(str(node['Node']))
             return node_names
@@ -311,30 +559,43 @@ class CatalogAdapter:
             raise HAConsistencyException(
                 'Cannot access Consul catalog') from e
 
-    def get_service_names(self) -> List[str]:
+    def get_service_names(self,
+                          consistency: Optional[str] = None) -> List[str]:
         """
         Return full list of service names currently registered in Consul
         server.
         """
         try:
-            services: Dict[str, List[Any]] = self.cns.catalog.services()[1]
+            services: Dict[str, List[Any]] = self.cns.catalog.services(
+                consistency=consistency)[1]
             return list(services.keys())
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException(
                 'Cannot access Consul catalog') from e
 
-    def get_services(self, svc_name: str) -> List[Dict[str, Any]]:
+    def get_services(
+            self,
+            svc_name: str,
+            consistency: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Return service(s) registered in Consul by the given name.
+
+        consistency - read consistency mode: 'default', 'stale' or
+             'consistent'; the mode of the Consul client is used if None.
         """
         try:
             # TODO refactor catalog operations into a separate class
-            return self.cns.catalog.service(service=svc_name)[1]
+            return self.cns.catalog.service(service=svc_name,
+                                            consistency=consistency)[1]
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException(
                 'Could not access Consul Catalog') from e
 
 
+# The Consul calls made by the adapters are attributed to their callers
+skip_frames_of(KVAdapter, CatalogAdapter)
+
+
 class ProcessGroup:
     def __init__(self, buckets_count: int):
         self.buckets: int = buckets_count
@@ -351,11 +612,18 @@ class ProcessGroup:
         self.process_locks[group].release()
 
 
+@keyed_by_class
 class ConsulUtil:
-    def __init__(self, raw_client: Optional[Consul] = None):
+    def __init__(self,
+                 raw_client: Optional[Consul] = None,
+                 health_max_age: float = 1.0):
         self.cns: Consul = raw_client or Consul()
         self.kv = KVAdapter(cns=self.cns)
         self.catalog = CatalogAdapter(cns=self.cns)
+        # All the health questions are answered from the snapshot of the
+        # cluster-wide health checks that is at most health_max_age seconds
+        # old.
+        self.health = HealthSnapshot(self.cns, max_age=health_max_age)
         self.lock = Lock()
         self.object_state_getters = {
             ObjT.SDEV.name: self.get_sdev_state,
@@ -365,11 +633,18 @@ class ConsulUtil:
             ObjT.CONTROLLER.name: self.get_ctrl_state
         }
         self.all_node_items: Dict[Any, Any] = {}
+        self.topology: Optional[Topology] = None
+        self.sites_topology: Optional[Topology] = None
+        # (KV mirror version, topology built from the mirror)
+        self.mirror_topology: Optional[Tuple[int, Topology]] = None
+        # process fidk -> ProcessClosure
+        self.process_closures: Dict[int, ProcessClosure] = {}
 
     def get_consul_node(self, node: str) -> Optional[str]:
         LOG.debug('fetching consul node for node: %s', node)
         consul_node_data = self.kv.kv_get(f'consul/node/{node}',
-                                          allow_null=True)
+                                          allow_null=True,
+                                          consistency=STATIC_READ)
         if consul_node_data:
             consul_node_val: bytes = consul_node_data['Value']
             consul_node = consul_node_val.decode('utf-8')
@@ -425,7 +700,8 @@ class ConsulUtil:
     @uses_consul_cache
     def _service_data(self, kv_cache=None) -> ServiceData:
         my_fidk = self.get_hax_fid(kv_cache=kv_cache).key
-        services = self.catalog.get_services('hax')
+        services = self.catalog.get_services('hax',
+                                             consistency=STATIC_READ)
         for svc in services:
             if int(svc['ServiceID']) == my_fidk:
                 return mkServiceData(svc)
@@ -451,14 +727,21 @@ class ConsulUtil:
 
     @repeat_if_fails()
     @uses_consul_cache
-    def get_rm_fid(self, kv_cache=None) -> Fid:
-        rm_node = self.get_session_node(self.get_leader_session())
+    def get_rm_fid(self,
+                   rm_node: Optional[str] = None,
+                   kv_cache=None) -> Fid:
+        """
+        Returns the fid of the principal RM service. rm_node is the node of
+        the RC leader session; it is looked up if not given.
+        """
+        rm_node = rm_node or self.get_session_node(self.get_leader_session())
         confd = self._service_by_name(rm_node, 'confd')
         if not confd or confd is None:
             raise HAConsistencyException('Error fetching confd svc')
         pfidk = int(confd['ServiceID'])
         fidk = self.kv.kv_get(f'm0conf/nodes/{rm_node}/processes/{pfidk}/'
-                              'services/rms', kv_cache=kv_cache)
+                              'services/rms', kv_cache=kv_cache,
+                              consistency=STATIC_READ)
         return mk_fid(ObjT.SERVICE, int(fidk['Value']))
 
     @uses_consul_cache
@@ -494,7 +777,8 @@ class ConsulUtil:
     @repeat_if_fails()
     def get_hax_ssl_config(self, kv_cache=None) -> Optional[Dict[str, str]]:
         ssl_data = self.kv.kv_get('ssl/hax', kv_cache=kv_cache,
-                                  allow_null=True)
+                                  allow_null=True,
+                                  consistency=STATIC_READ)
         if not ssl_data:
             return None
         data: Optional[Dict[str, str]] = json.loads(ssl_data['Value'])
@@ -503,17 +787,7 @@ class ConsulUtil:
     @repeat_if_fails()
     def fid_to_endpoint(self, proc_fid: Fid) -> Optional[str]:
         pfidk = int(proc_fid.key)
-        process_items = self.get_all_nodes_cached()
-        regex = re.compile(
-            f'^m0conf\\/.*\\/processes\\/{pfidk}\\/endpoint')
-        for proc_item in process_items:
-            match_result = re.match(regex, proc_item['Key'])
-            if not match_result:
-                continue
-            proc_item_val = self.kv.kv_get(proc_item['Key'])
-            process_ep: bytes = proc_item_val['Value']
-            return process_ep.decode('utf-8')
-        return None
+        return self.get_topology().get_process_endpoint(pfidk)
 
     @repeat_if_fails()
     def get_leader_node(self) -> str:
@@ -589,6 +863,79 @@ class ConsulUtil:
             self.all_node_items = self.get_all_nodes()
         return self.all_node_items
 
+    def get_topology(self) -> Topology:
+        """
+        Returns the indexed m0conf/nodes topology.
+
+        The topology is built from get_all_nodes_cached() only once, so it
+        must be used for the static conf objects hierarchy only. Use
+        get_nodes_topology() to read the states of the objects.
+        """
+        topology = self.topology
+        if topology is None:
+            topology = Topology(self.get_all_nodes_cached())
+            if not topology.is_empty():
+                self.topology = topology
+        return topology
+
+    def get_sites_topology(self) -> Topology:
+        """
+        Returns the indexed m0conf/sites topology (sites, racks, enclosures,
+        controllers and drives) together with the drive <-> sdev and
+        enclosure <-> node reverse indexes.
+
+        Like get_topology(), the result is built once and must be used for
+        the static conf objects hierarchy only.
+        """
+        topology = self.sites_topology
+        if topology is None:
+            topology = Topology(self.get_all_sites())
+            if not topology.is_empty():
+                self.sites_topology = topology
+        return topology
+
+    @uses_consul_cache
+    def get_nodes_topology(self, kv_cache=None) -> Topology:
+        """
+        Returns the m0conf/nodes topology built from the actual KV contents.
+        The topology is shared by all the calls within the given kv_cache.
+        If the KV mirror is attached, the topology is rebuilt only when the
+        mirrored m0conf/ subtree changes.
+        """
+        mirror = self.kv.mirror
+        if mirror is None or not mirror.covers('m0conf/nodes') or \
+                self.kv.has_pending_writes('m0conf/nodes'):
+            return Topology(self.get_all_nodes(kv_cache=kv_cache))
+        version = mirror.get_version('m0conf/nodes')
+        cached = self.mirror_topology
+        if cached is None or cached[0] != version:
+            cached = (version,
+                      Topology(mirror.get('m0conf/nodes', recurse=True)))
+            self.mirror_topology = cached
+        return cached[1]
+
+    def attach_kv_mirror(self, mirror: KVMirror) -> None:
+        """
+        Makes the KV reads of this instance served by the given mirror
+        (when the mirrored data is fresh enough).
+        """
+        mirror.add_listener(self._on_kv_mirror_changed)
+        self.kv.mirror = mirror
+
+    def _on_kv_mirror_changed(self, prefix: str, structural: Set[str],
+                              modified: Set[str]) -> None:
+        # The conf objects hierarchy is cached forever, so it must be
+        # re-read if the m0conf/nodes keys have been added or removed.
+        if any(k.startswith('m0conf/nodes') for k in structural):
+            LOG.info('m0conf/nodes structure changed, resetting topology')
+            self.all_node_items = {}
+            self.topology = None
+            self.process_closures = {}
+        if any(k.startswith('m0conf/sites') for k in structural):
+            LOG.info('m0conf/sites structure changed, resetting topology')
+            self.sites_topology = None
+            self.process_closures = {}
+
     def get_session_node(self, session_id: str) -> str:
         try:
             session = self.cns.session.info(session_id)[1]
@@ -620,9 +967,9 @@ class ConsulUtil:
         if not motr_services:
             motr_services = set(['ios'])
         result = []
-        for service_name in self.catalog.get_service_names():
-            if service_name not in motr_services:
-                continue
+        # Note: no catalog lookup is needed to find out which services are
+        # registered; an unknown service just has no instances.
+        for service_name in sorted(motr_services):
             data = self.get_service_data_by_name(service_name)
             LOG.log(TRACE, 'svc data: %s', data)
             for item in data:
@@ -634,7 +981,8 @@ class ConsulUtil:
         return result
 
     def get_service_data_by_name(self, name: str) -> List[ServiceData]:
-        services = self.catalog.get_services(name)
+        services = self.catalog.get_services(name,
+                                             consistency=STATIC_READ)
         LOG.log(TRACE, 'Services "%s" received: %s', name, services)
         services_dict = {}
         for svc in services:
@@ -660,89 +1008,101 @@ class ConsulUtil:
     def get_services_by_parent_process(self,
                                        process_fid: Fid,
                                        kv_cache=None) -> List[FidWithType]:
-        node_items = self.get_all_nodes_cached()
-        fidk = str(process_fid.key)
-
-        # This is the RegExp to match the keys in Consul KV that describe
-        # the Motr services that are enclosed into the Motr process that has
-        # the given fidk.
+        # The services of the Motr process are described by the keys like
+        #   m0conf/nodes/cmu/processes/6/services/ha
+        #   m0conf/nodes/cmu/processes/6/services/rms
         #
         # Note: we assume that fidk uniquely identifies the given process
         # within the whole cluster (that's why we are not interested in the
         # hostnames here).
-        #
-        # Examples of the key that will match:
-        #   m0conf/nodes/cmu/processes/6/services/ha
-        #   m0conf/nodes/cmu/processes/6/services/rms
-        regex = re.compile(
-            f'^m0conf\\/.*\\/processes\\/{fidk}\\/services\\/(.+)$')
-        services = []
-        for node in node_items:
-            match_result = re.match(regex, node['Key'])
-            if not match_result:
-                continue
-            srv_type = match_result.group(1)
-            srv_fidk = int(node['Value'])
-            services.append(
-                FidWithType(fid=mk_fid(ObjT.SERVICE, srv_fidk),
-                            service_type=srv_type))
-        return services
+        services = self.get_topology().get_process_services(process_fid.key)
+        return [
+            FidWithType(fid=mk_fid(ObjT.SERVICE, srv_fidk),
+                        service_type=srv_type)
+            for srv_type, srv_fidk in services
+        ]
 
     def get_disks_by_parent_process(self,
                                     process_fid: Fid,
                                     svc_fid: Fid) -> List[Fid]:
-        node_items = self.get_all_nodes_cached()
-        # This is the RegExp to match the keys in Consul KV that describe
-        # the Motr processes and services that are enclosed into the Motr
-        # process that has the given process_fid.
+        # The disks of the service are described by the keys like
+        #   m0conf/nodes/0x6e00000000000001:0x3b/processes/
+        #       0x7200000000000001:0x44/services/0x7300000000000001:0x46/
+        #       sdevs/0x6400000000000001:0x47
         #
         # Note: we assume that process_fid uniquely identifies the given
         # process within the whole cluster (that's why we are not interested
         # in the hostnames here).
-        #
-        # Examples of the key that will match:
-        #   m0conf/nodes/0x6e00000000000001:0x3b/processes/
-        #       0x7200000000000001:0x44/services/0x7300000000000001:0x46
-        regex = re.compile(
-            f'^m0conf\\/.*\\/processes\\/{process_fid}\\/services\\/'
-            f'{svc_fid}\\/sdevs\\/([^/]+)$')
+        topology = self.get_topology()
+        svc = topology.get(svc_fid)
+        if svc is None or svc.parent != process_fid:
+            return []
         disks = []
-        for node in node_items:
-            match_result = re.match(regex, node['Key'])
-            if not match_result:
-                continue
-            sdev_fid_item = match_result.group(1)
-            sdev_fidk = Fid.parse(sdev_fid_item).key
-            sdev_fid = create_sdev_fid(sdev_fidk)
+        for sdev in topology.get_children(svc_fid):
+            sdev_fid = create_sdev_fid(sdev.fid.key)
             disk_fid = self.sdev_to_drive_fid(sdev_fid)
             disks.append(disk_fid)
         return disks
 
+    @uses_consul_cache
+    def get_process_closure(self,
+                            proc_fid: Fid,
+                            kv_cache=None) -> ProcessClosure:
+        """
+        Returns the services, drives, controller, enclosure and node of the
+        given process. They depend on the configuration only, so the
+        closure is computed once per process and kept until the conf
+        objects hierarchy changes (see _on_kv_mirror_changed()).
+        """
+        # Note: the reference is taken before the lookups, so that the
+        # closure computed from the outdated configuration is not stored
+        # into the cache that has just been reset.
+        closures = self.process_closures
+        closure = closures.get(proc_fid.key)
+        if closure is not None:
+            return closure
+        node = self.get_process_node(proc_fid, kv_cache=kv_cache)
+        node_fid = self.get_node_fid(node, kv_cache=kv_cache)
+        if node_fid is None:
+            raise HAConsistencyException(f'Failed to get fid of node {node}')
+        services = self.get_services_by_parent_process(proc_fid,
+                                                       kv_cache=kv_cache)
+        drives: List[Fid] = []
+        for svc in services:
+            drives += self.get_disks_by_parent_process(proc_fid, svc.fid)
+        closure = ProcessClosure(
+            node=node,
+            node_fid=node_fid,
+            encl_fid=self.get_node_encl_fid(node, kv_cache=kv_cache),
+            ctrl_fid=self.get_ioservice_ctrl_fid(proc_fid, kv_cache=kv_cache),
+            services=services,
+            service_fids=[
+                self.get_obj_full_fid(x.fid) or x.fid for x in services
+            ],
+            drives=drives)
+        closures[proc_fid.key] = closure
+        return closure
+
+    @uses_consul_cache
+    def precompute_process_closures(self, kv_cache=None) -> None:
+        """
+        Computes the closures of all the processes of the configuration, so
+        that the first state change of every process doesn't have to wait
+        for the lookups.
+        """
+        processes = self.get_topology().get_objects(ObjT.PROCESS)
+        for proc in processes:
+            self.get_process_closure(proc.fid, kv_cache=kv_cache)
+        LOG.debug('Precomputed the closures of %d processes', len(processes))
+
     @repeat_if_fails()
     def is_proc_client(self, process_fid: Fid) -> bool:
-        node_items = self.get_all_nodes_cached()
-        client_types = self.get_m0_client_types()
-        fidk = str(process_fid.key)
-
-        # This is the RegExp to match the keys in Consul KV that describe
-        # the Motr services that are enclosed into the Motr process that has
-        # the given fidk.
         # We filter out motr client entries to check if the given process fid
-        # corresponds to a motr client or server process.
-        #
-        # Note: we assume that fidk uniquely identifies the given process
-        # within the whole cluster (that's why we are not interested in the
-        # hostnames here).
-        #
-        # Examples of the key that will match:
+        # corresponds to a motr client or server process, e.g.
         #   m0conf/nodes/srvnode-1/processes/39/services/m0_client_s3
-        regex = re.compile(
-            f'^m0conf\\/.*\\/processes\\/{fidk}\\/services\\/(.+)$')
-        for node in node_items:
-            match_result = re.match(regex, node['Key'])
-            if not match_result:
-                continue
-            srv_type = match_result.group(1)
+        services = self.get_topology().get_process_services(process_fid.key)
+        client_types = self.get_m0_client_types()
+        for srv_type, _ in services:
             if srv_type in client_types:
                 return True
         return False
@@ -800,18 +1160,10 @@ class ConsulUtil:
 
         obj_state: int = HaNoteStruct.M0_NC_ONLINE
         if obj_t.name in (ObjT.PROCESS.name, ObjT.SERVICE.name):
-            # 'node/<node_name>/process/<process_fidk>/service/type'
-            node_items = self.get_all_nodes_cached()
-            # TODO [KN] This code is too cryptic. To be refactored.
-            keys = getattr(self, 'get_{}_keys'.format(obj_t.name.lower()))(
-                node_items, fidk)
-            if len(keys) != 1:
-                raise RuntimeError(f'XXX fidk:{fidk} len:{len(keys)}')
-            key = keys[0].split('/')
-            node_key = ('/'.join(key[:3]))
-            node_val = self.kv.kv_get(node_key, kv_cache=kv_cache)
-            data = node_val['Value']
-            node_name: str = json.loads(data)['name']
+            node_name = self.get_conf_obj_node_name(mk_fid(obj_t, fidk),
+                                                    kv_cache=kv_cache)
+            if node_name is None:
+                raise RuntimeError(f'No node found for fidk:{fidk}')
             if (self.get_node_health_status(node_name, kv_cache=kv_cache) !=
                     'passing'):
                 obj_state = ObjHealth.OFFLINE.to_ha_note_status()
@@ -828,6 +1180,81 @@ class ConsulUtil:
 
         return obj_state
 
+    @repeat_if_fails()
+    @uses_consul_cache
+    def get_conf_obj_statuses(self, fids: List[Fid],
+                              kv_cache=None) -> List[int]:
+        """
+        Vectorized version of get_conf_obj_status(): returns the states of
+        the given conf objects (in the same order).
+
+        All the objects are resolved against a single snapshot: the health
+        checks come from the cluster-wide HealthSnapshot, the Motr process
+        statuses are read from KV with one recursive request, and every
+        process is evaluated once no matter how many of its services are
+        given.
+        """
+        states: List[int] = []
+        proc_svc_types = (ObjT.PROCESS, ObjT.SERVICE)
+        obj_types = [FidTypeToObjT[fid.container] for fid in fids]
+        if not any(t in proc_svc_types for t in obj_types):
+            return [self.get_conf_obj_status(t, fid.key, kv_cache=kv_cache)
+                    for t, fid in zip(obj_types, fids)]
+
+        proc_states: Dict[str, MotrConsulProcInfo] = {}
+        for item in self.kv.kv_get('processes/',
+                                   recurse=True,
+                                   kv_cache=kv_cache,
+                                   allow_null=True) or []:
+            key_split = item['Key'].split('/')
+            if len(key_split) != 2:
+                continue
+            val = json.loads(item['Value'])
+            proc_states[key_split[1]] = MotrConsulProcInfo(
+                val['state'], val['type'])
+        unknown = MotrConsulProcInfo('Unknown', 'Unknown')
+        local_node = self.get_local_nodename()
+        online_fids = {x.fid for x in self.get_confd_list()}
+        online_fids.add(self.get_hax_fid(kv_cache=kv_cache))
+        health_checks: Dict[str, Optional[List[Dict[str, Any]]]] = {}
+        proc_health: Dict[Fid, int] = {}
+
+        def get_proc_state(pfid: Fid) -> int:
+            proc_node = self.get_process_node(pfid, kv_cache=kv_cache)
+            if proc_node not in health_checks:
+                health_checks[proc_node] = self.get_node_health_details(
+                    proc_node, kv_cache=kv_cache)
+            status = self._get_service_health(
+                health_checks[proc_node], pfid.key,
+                lambda: proc_states.get(str(self.get_base_fid(pfid)),
+                                        unknown),
+                lambda: proc_node == local_node)
+            # Report ONLINE for hax and confd if they are already started.
+            if status == ObjHealth.RECOVERING and pfid in online_fids:
+                return HaNoteStruct.M0_NC_ONLINE
+            return status.to_ha_note_status()
+
+        for obj_t, fid in zip(obj_types, fids):
+            if obj_t not in proc_svc_types:
+                states.append(
+                    self.get_conf_obj_status(obj_t, fid.key,
+                                             kv_cache=kv_cache))
+                continue
+            if self.get_conf_obj_node_name(mk_fid(obj_t, fid.key),
+                                           kv_cache=kv_cache) is None:
+                raise RuntimeError(f'No node found for fidk:{fid.key}')
+            if obj_t == ObjT.SERVICE:
+                pfid = self.get_service_process_fid(
+                    create_service_fid(fid.key), kv_cache=kv_cache)
+            else:
+                pfid = create_process_fid(fid.key)
+            if pfid not in proc_health:
+                proc_health[pfid] = get_proc_state(pfid)
+            states.append(proc_health[pfid])
+        LOG.debug('Resolved %d conf objects (%d processes, %d nodes)',
+                  len(fids), len(proc_health), len(health_checks))
+        return states
+
     @uses_consul_cache
     def get_proc_svc_conf_obj_status(self,
                                      obj_t: ObjT,
@@ -849,22 +1276,23 @@ class ConsulUtil:
             return HaNoteStruct.M0_NC_ONLINE
         return proc_status.to_ha_note_status()
 
-    @staticmethod
-    def get_process_keys(node_items: List[Any], fidk: int) -> List[Any]:
-        fid = mk_fid(ObjT.PROCESS, fidk)
-        return [
-            x['Key'] for x in node_items
-            if f'{fid}' == x['Key'].split('/')[-1]
-        ]
-
-    @staticmethod
-    def get_service_keys(node_items: List[Any], fidk: int) -> List[Any]:
-        fid = mk_fid(ObjT.SERVICE, fidk)
-        LOG.debug('fid: %s, fidk: %d', fid, fidk)
-        return [
-            x['Key'] for x in node_items
-            if f'{fid}' == x['Key'].split('/')[-1]
-        ]
+    @uses_consul_cache
+    def get_conf_obj_node_name(self, obj_fid: Fid,
+                               kv_cache=None) -> Optional[str]:
+        """
+        Returns the name of the node that encloses the given conf object
+        (e.g. process or service) or None if the object is unknown.
+        """
+        topology = self.get_topology()
+        node_fid = topology.get_parent_fid(obj_fid, ObjT.NODE)
+        if node_fid is None:
+            return None
+        node = topology.get(node_fid)
+        if node is not None and 'name' in node.value:
+            return str(node.value['name'])
+        name: Optional[str] = self.get_node_name_by_fid(node_fid,
+                                                        kv_cache=kv_cache)
+        return name
 
     @uses_consul_cache
     def is_node_alive(self, node: str, kv_cache=None) -> bool:
@@ -917,13 +1345,14 @@ class ConsulUtil:
         """
         Returns the list of health checks (as it is reported by Consul, see
         'Health: node' section at
-        https://python-consul.readthedocs.io/en/latest/).
+        https://python-consul.readthedocs.io/en/latest/). The checks are
+        taken from the cluster-wide snapshot (see HealthSnapshot).
         """
         try:
             consul_node = self.get_consul_node(node)
             if not consul_node or consul_node is None:
                 return None
-            return self.cns.health.node(consul_node)[1]
+            return self.health.get_node_checks(consul_node)
         except (ConsulException, HTTPError, RequestException) as e:
             raise HAConsistencyException(
                 f'Failed to get {node} node health: {e}')
@@ -972,21 +1401,10 @@ class ConsulUtil:
         # 0x6e00000000000001:0x3:{"name": "ssc-vm-1623.colo.seagate.com",
         #                         "state": "M0_NC_UNKNOWN"}
         if not use_cache:
-            node_items = self.get_all_nodes(kv_cache=kv_cache)
+            topology = self.get_nodes_topology(kv_cache=kv_cache)
         else:
-            node_items = self.get_all_nodes_cached()
-        for item in node_items:
-            key = item['Key']
-            key_split = key.split('/')
-            if len(key_split) != 3:
-                # Although we make a recurse scan, we don't need anything
-                # deeper than 1 level down (see Example above).
-                continue
-            item_value = json.loads(item['Value'])
-            if 'name' in item_value and item_value['name'] == node:
-                node_fid: str = str(key_split[2])
-                return Fid.parse(node_fid)
-        return None
+            topology = self.get_topology()
+        return topology.get_node_fid(node)
 
     @repeat_if_fails()
     @uses_consul_cache
@@ -998,7 +1416,8 @@ class ConsulUtil:
         correspond to any node.
         """
         node_data = self.kv.kv_get(f'm0conf/nodes/{node_fid}',
-                                   kv_cache=kv_cache)
+                                   kv_cache=kv_cache,
+                                   consistency=STATIC_READ)
         if node_data:
             parsed = json.loads(node_data['Value'])
             name: str = parsed['name']
@@ -1016,7 +1435,8 @@ class ConsulUtil:
         machine id doesn't correspond to any node.
         """
         mid_key = self.kv.kv_get(machineid, kv_cache=kv_cache,
-                                 allow_null=allow_null)
+                                 allow_null=allow_null,
+                                 consistency=STATIC_READ)
         if mid_key:
             name: bytes = mid_key['Value']
             return name.decode('utf-8')
@@ -1032,7 +1452,8 @@ class ConsulUtil:
         node-name doesn't correspond to any node.
         """
         node_key = self.kv.kv_get(nodename, kv_cache=kv_cache,
-                                  allow_null=allow_null)
+                                  allow_null=allow_null,
+                                  consistency=STATIC_READ)
         if node_key:
             machineid: bytes = node_key['Value']
             return machineid.decode('utf-8')
@@ -1056,18 +1477,11 @@ class ConsulUtil:
         encl_fid = self.get_node_encl_fid(node, kv_cache=kv_cache)
         if not encl_fid:
             return None
-        ctrl_items = self.get_all_sites(kv_cache=kv_cache)
-        regex = re.compile(
-            f'^m0conf\\/.*\\/racks\\/.*\\/encls\\/{encl_fid}\\/ctrls\\/'
-            '([^/]+)$')
-        list_fids: List[Fid] = []
-        for ctrl in ctrl_items:
-            match_result = re.match(regex, ctrl['Key'])
-            if not match_result:
-                continue
-            ctrl_fid: str = match_result.group(1)
-            list_fids.append(Fid.parse(ctrl_fid))
-        return list_fids
+        return [
+            ctrl.fid
+            for ctrl in self.get_sites_topology().get_children(encl_fid)
+            if ctrl.fid.container == ObjT.CONTROLLER.value
+        ]
 
     def get_node_hare_motr_s3_fids(self, node: str) -> List[Fid]:
         """
@@ -1097,18 +1511,8 @@ class ConsulUtil:
         # Example key m0conf/nodes/0x6e00000000000001:0x3/processes/
         #   0x7200000000000001:0x15/services/0x7300000000000001:0x17/sdevs/
         #   0x6400000000000001:0x18:{"path": "/dev/sdc", "state": "offline"}
-        sdev_items = self.get_all_nodes_cached()
-        regex = re.compile(
-            f'^m0conf\\/.*\\/processes\\/{ioservice_fid}\\/.*\\/sdevs\\/.*$')
-        sdev_fids = []
-        for sdev in sdev_items:
-            match_result = re.match(regex, sdev['Key'])
-            if not match_result:
-                continue
-            sdev_key: str = match_result.group(0)
-            key = sdev_key.split('/')
-            sdev_fids.append(key[8])
-        return sdev_fids
+        sdevs = self.get_topology().get_descendants(ioservice_fid, ObjT.SDEV)
+        return [str(sdev.fid) for sdev in sdevs]
 
     @repeat_if_fails()
     @uses_consul_cache
@@ -1122,17 +1526,12 @@ class ConsulUtil:
         #    0x6100000000000001:0x2/encls/0x6500000000000001:0x4/ctrls/
         #    0x6300000000000001:0x5/drives/0x6b00000000000001:0x38:
         #    {"sdev": "0x6400000000000001:0x37", "state": "M0_NC_UNKNOWN"}
-        sites_items = self.get_all_sites(kv_cache=kv_cache)
-
-        for item in sites_items:
-            if 'sdev' not in json.loads(item['Value']).keys():
-                continue
-
-            if json.loads(item['Value'])['sdev'] == f'{sdev_fid}':
-                key = item['Key'].split('/')
-                return key[8]
-
-        return None
+        topology = self.get_sites_topology()
+        drive_fid = topology.get_drive_by_sdev(Fid.parse(str(sdev_fid)))
+        if drive_fid is None:
+            return None
+        ctrl_fid = topology.get_parent_fid(drive_fid, ObjT.CONTROLLER)
+        return str(ctrl_fid) if ctrl_fid is not None else None
 
     @repeat_if_fails()
     @uses_consul_cache
@@ -1145,8 +1544,7 @@ class ConsulUtil:
         Parameters:
             ioservice_fid : Fid of IO service for which ctrl fid is required.
 
-        TODO: Instead of comparing devices, add a mapping from controller
-              to I/O service
+        The controller is found via the first device of the service.
         """
         if not ioservice_fid:
             return None
@@ -1222,7 +1620,8 @@ class ConsulUtil:
         if resource_type is ObjT.NODE:
             children = self.kv.kv_get(f'm0conf/nodes/{fid}/processes',
                                       recurse=True,
-                                      kv_cache=kv_cache)
+                                      kv_cache=kv_cache,
+                                      consistency=STATIC_READ)
             search_filter: List[str] = ['ios', 'confd']
         else:
             return None
@@ -1275,20 +1674,7 @@ class ConsulUtil:
         node_fid = self.get_node_fid(node, kv_cache=kv_cache)
         if not node_fid:
             return None
-        encl_items = self.kv.kv_get('m0conf/sites',
-                                    recurse=True,
-                                    kv_cache=kv_cache)
-        regex = re.compile(
-            '^m0conf\\/.*\\/racks\\/.*\\/encls\\/([^/]+)$')
-        for encl in encl_items:
-            match_result = re.match(regex, encl['Key'])
-            if not match_result:
-                continue
-            encl_value = json.loads(encl['Value'])
-            if 'node' in encl_value and encl_value['node'] == str(node_fid):
-                encl_fid: str = match_result.group(1)
-                return Fid.parse(encl_fid)
-        return None
+        return self.get_sites_topology().get_encl_by_node(node_fid)
 
     def get_device_ha_state(self, status: ObjHealth) -> str:
 
@@ -1586,22 +1972,17 @@ class ConsulUtil:
                               device_event=True,
                               kv_cache=None) -> List[PutKV]:
         LOG.debug('Setting sdev=%s in KV with state=%s', sdev_fid, state)
-        sdev_items = self.get_all_nodes(kv_cache=kv_cache)
-        regex = re.compile(f'^m0conf\\/.*\\/sdevs\\/{sdev_fid}$')
-        result: List[PutKV] = []
-        for sdev in sdev_items:
-            match_result = re.match(regex, sdev['Key'])
-            if not match_result:
-                continue
-            value = json.loads(sdev['Value'])
-            if not device_event and value['state'] in ('failed',
+        sdev = self.get_nodes_topology(kv_cache=kv_cache).get(sdev_fid)
+        if sdev is None or sdev.fid.container != ObjT.SDEV.value:
+            return []
+        value = dict(sdev.value)
+        if not device_event and value.get('state') in ('failed',
                                                        'repairing',
                                                        'repaired',
                                                        'rebalancing'):
-                continue
-            value['state'] = state
-            result.append(PutKV(key=sdev['Key'], value=json.dumps(value)))
-        return result
+            return []
+        value['state'] = state
+        return [PutKV(key=sdev.key, value=json.dumps(value))]
 
     @repeat_if_fails()
     @uses_consul_cache
@@ -1621,22 +2002,14 @@ class ConsulUtil:
             sdev_fid = self.drive_to_sdev_fid(drive_fid, kv_cache=kv_cache)
         else:
             sdev_fid = create_sdev_fid(fidk)
-        sdev_items = self.get_all_nodes(kv_cache=kv_cache)
-        regex = re.compile(
-            f'^m0conf\\/.*\\/sdevs\\/{sdev_fid}$')
-        for sdev in sdev_items:
-            match_result = re.match(regex, sdev['Key'])
-            if not match_result:
-                continue
-            val = json.loads(sdev['Value'])
-            LOG.debug('Sdev=%s state=%s', str(sdev_fid), val['state'])
-            if str(val['state']).lower() in ['unknown', 'm0_nc_unknown',
-                                             'dtm_recovering']:
-                return HaNoteStruct.M0_NC_ONLINE
-            else:
-                return drive_to_ha_state_map[str(val['state']).lower()]
-
-        return HaNoteStruct.M0_NC_ONLINE
+        sdev = self.get_nodes_topology(kv_cache=kv_cache).get(sdev_fid)
+        if sdev is None or sdev.fid.container != ObjT.SDEV.value:
+            return HaNoteStruct.M0_NC_ONLINE
+        state = str(sdev.value['state']).lower()
+        LOG.debug('Sdev=%s state=%s', str(sdev_fid), state)
+        if state in ['unknown', 'm0_nc_unknown', 'dtm_recovering']:
+            return HaNoteStruct.M0_NC_ONLINE
+        return drive_to_ha_state_map[state]
 
     @repeat_if_fails()
     @uses_consul_cache
@@ -1650,21 +2023,10 @@ class ConsulUtil:
         # 2. Fetch Consul kv for sdev fid
         # 3. Extract sdev fid key from the sdev fid.
         # 4. Create sdev fid from fid key.
-        sdev_fid: Fid = Fid(0, 0)
-        sdev_items = self.kv.kv_get('m0conf/sites',
-                                    recurse=True,
-                                    kv_cache=kv_cache)
-        regex = re.compile(
-            f'^m0conf\\/.*\\/drives/{drive_fid}$')
-        for x in sdev_items:
-            match_result = re.match(regex, x['Key'])
-            if not match_result:
-                continue
-            sdev_fid_item = json.loads(x['Value'])['sdev']
-            sdev_fidk = Fid.parse(sdev_fid_item).key
-            sdev_fid = create_sdev_fid(sdev_fidk)
-            break
-        return sdev_fid
+        sdev = self.get_sites_topology().get_sdev_by_drive(drive_fid)
+        if sdev is None:
+            return Fid(0, 0)
+        return create_sdev_fid(sdev.key)
 
     @repeat_if_fails()
     def sdev_to_drive_fid(self, sdev_fid: Fid):
@@ -1677,19 +2039,10 @@ class ConsulUtil:
         # 2. Fetch Consul kv for drive fid
         # 3. Extract drive fid key from the drive fid.
         # 4. Create drive fid from fid key.
-        drive_fid: Fid = Fid(0, 0)
-        drive_items = self.kv.kv_get('m0conf/sites', recurse=True)
-        for x in drive_items:
-            if '/drives/' in x['Key']:
-                if json.loads(x['Value'])['sdev'] == f'{sdev_fid}':
-                    # Using constant index 10 for the drive fid.
-                    # Fix this by changing the Consul schema to have
-                    # mapping of sdev fid to drive fid direct mapping.
-                    drive_fid_item = x['Key'].split('/')[10]
-                    drive_fidk = Fid.parse(drive_fid_item).key
-                    drive_fid = create_drive_fid(drive_fidk)
-                    break
-        return drive_fid
+        drive = self.get_sites_topology().get_drive_by_sdev(sdev_fid)
+        if drive is None:
+            return Fid(0, 0)
+        return create_drive_fid(drive.key)
 
     @repeat_if_fails()
     def node_to_drive_fid(self, node_name: str, drive: str):
@@ -1838,6 +2191,32 @@ class ConsulUtil:
         Returns current status of a Consul service identified by the given
         svc_id for a given node.
         """
+        pfid = create_process_fid(svc_id)
+
+        def is_local() -> bool:
+            proc_node = self.get_process_node(pfid, kv_cache=kv_cache)
+            return bool(proc_node == self.get_local_nodename())
+
+        try:
+            node_data = self.get_node_health_details(
+                node, kv_cache=kv_cache)
+            return self._get_service_health(
+                node_data, svc_id,
+                lambda: self.get_process_status(pfid, kv_cache=kv_cache),
+                is_local)
+        except (ConsulException, HTTPError, RequestException) as e:
+            raise HAConsistencyException('Failed to communicate '
+                                         'to Consul Agent') from e
+
+    def _get_service_health(
+            self, node_data: Optional[List[Dict[str, Any]]], svc_id: int,
+            get_proc_status: Callable[[], MotrConsulProcInfo],
+            is_local: Callable[[], bool]) -> ObjHealth:
+        """
+        Derives the service status from the health checks of its node and
+        from the Motr process status (the latter is only requested if the
+        Consul service is passing).
+        """
         # Maps consul service status and motr process status to the
         # corresponding ha status to be notified.
         # Respective values are for local and remote nodes.
@@ -1884,89 +2263,55 @@ class ConsulUtil:
             cur_consul_status('warning', 'Unknown'):
             local_remote_health_ret(ObjHealth.OFFLINE,
                                     ObjHealth.OFFLINE)}
-        try:
-            node_data = self.get_node_health_details(
-                node, kv_cache=kv_cache)
-            if not node_data:
-                return ObjHealth.OFFLINE
-            LOG.debug('node data: %s', node_data)
-            node_status = str(node_data[0]['Status'])
-            if node_status != 'passing':
-                return ObjHealth.OFFLINE
-            status = ObjHealth.UNKNOWN
-            for item in node_data:
-                if item['ServiceID'] == str(svc_id):
-                    pfid = create_process_fid(svc_id)
-                    LOG.debug('item.status %s svc id: %s',
-                              item['Status'], str(svc_id))
-                    if item['Status'] in ('critical', 'warning'):
-                        return ObjHealth.OFFLINE
-                    cns_status = self.get_process_status(pfid,
-                                                         kv_cache=kv_cache)
-                    svc_health = svc_to_motr_status_map[
-                        MotrConsulProcStatus(
-                            item['Status'],
-                            cns_status.proc_status)]
-                    LOG.debug('consul.status %s svc_health: %s',
-                              cns_status, svc_health)
-                    local_node = self.get_local_nodename()
-                    proc_node = self.get_process_node(pfid, kv_cache=kv_cache)
-                    if proc_node == local_node:
-                        status = svc_health.motr_proc_status_local
-                    else:
-                        status = svc_health.motr_proc_status_remote
-                    return status
-        except (ConsulException, HTTPError, RequestException) as e:
-            raise HAConsistencyException('Failed to communicate '
-                                         'to Consul Agent') from e
-        return status
+        if not node_data:
+            return ObjHealth.OFFLINE
+        LOG.debug('node data: %s', node_data)
+        node_status = str(node_data[0]['Status'])
+        if node_status != 'passing':
+            return ObjHealth.OFFLINE
+        for item in node_data:
+            if item['ServiceID'] == str(svc_id):
+                LOG.debug('item.status %s svc id: %s',
+                          item['Status'], str(svc_id))
+                if item['Status'] in ('critical', 'warning'):
+                    return ObjHealth.OFFLINE
+                cns_status = get_proc_status()
+                svc_health = svc_to_motr_status_map[
+                    MotrConsulProcStatus(
+                        item['Status'],
+                        cns_status.proc_status)]
+                LOG.debug('consul.status %s svc_health: %s',
+                          cns_status, svc_health)
+                if is_local():
+                    return svc_health.motr_proc_status_local
+                return svc_health.motr_proc_status_remote
+        return ObjHealth.UNKNOWN
 
     @repeat_if_fails()
     @uses_consul_cache
     def get_process_node(self, proc_fid: Fid, kv_cache=None) -> str:
         try:
             proc_base_fid = self.get_base_fid(proc_fid)
-            fidk = proc_base_fid.key
-            # 'node/<node_name>/process/<process_fidk>/service/type'
-            # node_items = self.kv.kv_get('m0conf/nodes',
-            #                             recurse=True,
-            #                             kv_cache=kv_cache)
-            node_items = self.get_all_nodes_cached()
-            LOG.log(TRACE, 'node items: %s', node_items)
-            if ObjT.PROCESS.value == proc_base_fid.container:
-                keys = self.get_process_keys(node_items, fidk)
-            elif ObjT.SERVICE.value == proc_base_fid.container:
-                keys = self.get_service_keys(node_items, fidk)
-            LOG.debug('proc_fid: %s keys: %s', proc_base_fid, keys)
-            if not keys:
+            node_name = self.get_conf_obj_node_name(proc_base_fid,
+                                                    kv_cache=kv_cache)
+            LOG.debug('proc_fid: %s node: %s', proc_base_fid, node_name)
+            if node_name is None:
                 raise HAConsistencyException('Failed to get process node')
-            key = keys[0].split('/')
-            node_key = ('/'.join(key[:3]))
-            node_val = self.kv.kv_get(node_key, kv_cache=kv_cache)
-            data = node_val['Value']
         except Exception as e:
             raise HAConsistencyException('failed to get process node') from e
-        return str(json.loads(data)['name'])
+        return node_name
 
     @repeat_if_fails()
     @uses_consul_cache
     def get_encl_node(self, encl: Fid, kv_cache=None) -> str:
         # 'node/<node_name>/process/<process_fidk>/service/type'
-        site_items = self.kv.kv_get('m0conf/sites',
-                                    recurse=True,
-                                    kv_cache=kv_cache)
-        LOG.debug('site_items: %s', site_items)
-        encl_key = [
-            x['Key'] for x in site_items
-            if f'{encl}' == x['Key'].split('/')[-1]
-        ]
-
-        LOG.debug('encl_key: %s', encl_key)
-        encl_val = self.kv.kv_get(encl_key[0], kv_cache=kv_cache)
-        data = encl_val['Value']
-        node_fid = str(json.loads(data)['node'])
+        encl_obj = self.get_sites_topology().get(encl)
+        if encl_obj is None or 'node' not in encl_obj.value:
+            raise RuntimeError(f'Enclosure {encl} not found in m0conf/sites')
+        node_fid = str(encl_obj.value['node'])
         node_val = self.kv.kv_get(f'm0conf/nodes/{node_fid}',
-                                  kv_cache=kv_cache)
+                                  kv_cache=kv_cache,
+                                  consistency=STATIC_READ)
         node_data = node_val['Value']
         node_name = str(json.loads(node_data)['name'])
         LOG.debug('encl fid: %s node fid: %s node_name:%s',
@@ -1976,15 +2321,10 @@ class ConsulUtil:
     @repeat_if_fails()
     @uses_consul_cache
     def get_ctrl_encl(self, ctrl: Fid, kv_cache=None) -> Fid:
-        site_items = self.kv.kv_get('m0conf/sites',
-                                    recurse=True,
-                                    kv_cache=kv_cache)
-        ctrl_keys = [
-            x['Key'] for x in site_items
-            if f'{ctrl}' == x['Key'].split('/')[-1]
-        ]
-        encl_fid_str = ctrl_keys[0].split('/')[6]
-        encl_fid = Fid.parse(encl_fid_str)
+        encl_fid = self.get_sites_topology().get_parent_fid(
+            ctrl, ObjT.ENCLOSURE)
+        if encl_fid is None:
+            raise RuntimeError(f'Controller {ctrl} not found in m0conf/sites')
 
         LOG.debug('ctrl fid: %s encl fid: %s',
                   ctrl, encl_fid)
@@ -2002,12 +2342,9 @@ class ConsulUtil:
 
     def get_service_process_fid(self, svc_fid: Fid, kv_cache=None) -> Fid:
         assert ObjT.SERVICE.value == svc_fid.container
-        node_items = self.get_all_nodes_cached()
-        keys = self.get_service_keys(node_items, svc_fid.key)
-        if len(keys) != 1:
-            raise RuntimeError(f'svc_fid:{svc_fid} len:{len(keys)}')
-        process_fid: str = keys[0].split('/')[4]
-        pfid = Fid.parse(process_fid)
+        pfid = self.get_topology().get_parent_fid(svc_fid, ObjT.PROCESS)
+        if pfid is None:
+            raise RuntimeError(f'No process found for svc_fid:{svc_fid}')
         return pfid
 
     @repeat_if_fails()
@@ -2021,7 +2358,8 @@ class ConsulUtil:
         result: List[Profile] = []
         for x in self.kv.kv_get('m0conf/profiles/',
                                 recurse=True,
-                                kv_cache=kv_cache):
+                                kv_cache=kv_cache,
+                                consistency=STATIC_READ):
             fidstr = x['Key'].split('/')[-1]
             payload = simplejson.loads(x['Value'])
             result.append(to_profile(fidstr, payload))
@@ -2070,7 +2408,8 @@ class ConsulUtil:
             all_procs[fid] = state
 
         node_procs = self.kv.kv_get(f'm0conf/nodes/{node_fid}/processes',
-                                    recurse=True)
+                                    recurse=True,
+                                    consistency=STATIC_READ)
         total_processes = 0
         started_processes = 0
         for item in node_procs:
@@ -2212,7 +2551,8 @@ class ConsulUtil:
     @repeat_if_fails()
     def get_configpath(self, allow_null=False):
         logging.info('Getting config_path')
-        config_path = self.kv.kv_get('config_path', allow_null=allow_null)
+        config_path = self.kv.kv_get('config_path', allow_null=allow_null,
+                                     consistency=STATIC_READ)
 
         if config_path is None:
             return None
@@ -2235,7 +2575,8 @@ class ConsulUtil:
             raise HAConsistencyException(
                 f'node fid not available yet for {local_node}')
         children = self.kv.kv_get(f'm0conf/nodes/{fid}/processes',
-                                  recurse=True)
+                                  recurse=True,
+                                  consistency=STATIC_READ)
         for item in children or []:
             if 'name' not in json.loads(item['Value']).keys():
                 continue
@@ -2377,7 +2718,8 @@ class ConsulUtil:
 
     @repeat_if_fails()
     def get_m0_client_types(self) -> List[str]:
-        m0_client_types = self.kv.kv_get('m0_client_types')
+        m0_client_types = self.kv.kv_get('m0_client_types',
+                                         consistency=STATIC_READ)
         client_types = []
         for client_type in json.loads(m0_client_types['Value']):
             client_types.append(client_type)
@@ -16,8 +16,16 @@
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 #
 
+from time import sleep
+from unittest.mock import Mock
+
 import pytest
-from hax.consul.cache import uses_consul_cache
+from hax.consul import cache as consul_cache
+from hax.consul.cache import (InvocationCache, invalidate_kv_key,
+                              pending_kv_writes, record_kv_read,
+                              supports_consul_cache, uses_consul_cache)
+from hax.consul.health import HealthSnapshot
+from hax.util import KVAdapter
 
 from .testutils import AssertionPlan, tr_method, trace_call
 
@@ -63,3 +71,180 @@ def test_arguments_considered_by_cache(testable):
         'Cache spoils returned values'
 
     assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 2
+
+
+@pytest.fixture
+def shared_cache():
+    cache = consul_cache.configure_shared_cache(ttl=60, max_size=100)
+    yield cache
+    consul_cache._shared_cache = None
+
+
+def test_ttl_expires_entries():
+    cache = InvocationCache(ttl=0.05)
+    cache.put('fn', 'value', 1)
+    assert cache.get('fn', 1) == 'value'
+    sleep(0.1)
+    assert not cache.has('fn', 1)
+
+
+def test_lru_eviction():
+    cache = InvocationCache(max_size=2)
+    cache.put('fn', 'a', 1)
+    cache.put('fn', 'b', 2)
+    assert cache.get('fn', 1) == 'a'
+    cache.put('fn', 'c', 3)
+    assert cache.has('fn', 1)
+    assert not cache.has('fn', 2)
+    assert cache.has('fn', 3)
+
+
+def test_unhashable_arguments_supported():
+    cache = InvocationCache()
+    cache.put('fn', 'value', [1, 2])
+    assert cache.get('fn', [1, 2]) == 'value'
+    assert not cache.has('fn', [1, 3])
+
+
+def test_invalidation_scoped_to_kv_keys(testable):
+    @uses_consul_cache
+    def read_key(key, kv_cache=None):
+        record_kv_read(key)
+        return testable.heavy_method(key)
+
+    @uses_consul_cache
+    def read_tree(key, kv_cache=None):
+        record_kv_read(key, recurse=True)
+        return testable.heavy_method(key)
+
+    @uses_consul_cache
+    def read_nested(kv_cache=None):
+        return read_key('processes/1', kv_cache=kv_cache)
+
+    cache = InvocationCache()
+    read_key('failvec', kv_cache=cache)
+    read_tree('m0conf/nodes', kv_cache=cache)
+    read_nested(kv_cache=cache)
+    assert len(cache) == 4
+
+    invalidate_kv_key('m0conf/nodes/0x6e00000000000001:0x3', kv_cache=cache)
+    assert len(cache) == 3
+    invalidate_kv_key('processes/1', kv_cache=cache)
+    # Both the direct reader and the nested one are dropped.
+    assert len(cache) == 1
+    invalidate_kv_key('failvec', kv_cache=cache)
+    assert len(cache) == 0
+
+
+def test_shared_cache_reused_across_calls(testable, shared_cache):
+    @uses_consul_cache
+    def business_op(param1, kv_cache=None):
+        record_kv_read('failvec')
+        return testable.heavy_method(param1)
+
+    @supports_consul_cache
+    def handle_event(kv_cache=None):
+        return business_op('result', kv_cache=kv_cache)
+
+    assert handle_event() == 'result'
+    assert handle_event() == 'result'
+    assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 1
+
+    invalidate_kv_key('failvec')
+    assert handle_event() == 'result'
+    assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 2
+
+
+def test_value_invalidated_while_computed_not_stored(testable):
+    @uses_consul_cache
+    def read_key(key, kv_cache=None):
+        record_kv_read(key)
+        # A concurrent writer
+        invalidate_kv_key('failvec', kv_cache=kv_cache)
+        return testable.heavy_method(key)
+
+    cache = InvocationCache()
+    read_key('failvec', kv_cache=cache)
+    assert len(cache) == 0
+    read_key('leader', kv_cache=cache)
+    assert len(cache) == 1
+
+
+def test_forgotten_invalidations_considered():
+    cache = InvocationCache()
+    epoch = cache.epoch
+    for i in range(InvocationCache.MAX_INVALIDATIONS + 1):
+        cache.invalidate(f'key{i}')
+    cache.put('fn', 'value', 1, kv_deps=frozenset([('leader', False)]),
+              since_epoch=epoch)
+    assert not cache.has('fn', 1)
+
+
+def test_cached_reads_repeated_after_write(shared_cache):
+    cns = Mock()
+    cns.kv.get.return_value = (1, {'Key': 'failvec', 'Value': b'old'})
+    kv = KVAdapter(cns=cns)
+
+    @supports_consul_cache
+    def read(kv_cache=None):
+        return kv.kv_get('failvec', kv_cache=kv_cache)['Value']
+
+    def put(key, data, **kwargs):
+        # A concurrent reader caches the value before it gets written
+        assert read() == b'old'
+        cns.kv.get.return_value = (2, {'Key': 'failvec', 'Value': b'new'})
+        return True
+
+    cns.kv.put.side_effect = put
+    kv.kv_put('failvec', 'new')
+    assert read() == b'new'
+
+
+def test_pending_writes_bypass_cache(testable, shared_cache):
+    @uses_consul_cache
+    def read_key(key, kv_cache=None):
+        record_kv_read(key)
+        return testable.heavy_method(key)
+
+    read_key('processes/1', kv_cache=shared_cache)
+    read_key('failvec', kv_cache=shared_cache)
+    with pending_kv_writes({'processes/1': 'online'}):
+        read_key('processes/1', kv_cache=shared_cache)
+        read_key('failvec', kv_cache=shared_cache)
+    assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 3
+    # The value computed while the writes were pending is not stored
+    read_key('processes/1', kv_cache=shared_cache)
+    assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 3
+
+
+def test_health_based_values_not_shared(testable, shared_cache):
+    cns = Mock()
+    cns.health.state.return_value = (1, [{'Node': 'srvnode-1',
+                                          'Status': 'passing'}])
+    health = HealthSnapshot(cns)
+
+    @uses_consul_cache
+    def node_status(node, kv_cache=None):
+        checks = health.get_node_checks(node)
+        return testable.heavy_method(checks[0]['Status'])
+
+    @uses_consul_cache
+    def outer(kv_cache=None):
+        record_kv_read('failvec')
+        return node_status('srvnode-1', kv_cache=kv_cache)
+
+    assert outer(kv_cache=shared_cache) == 'passing'
+    assert outer(kv_cache=shared_cache) == 'passing'
+    # Neither the health based value nor its caller is stored
+    assert len(shared_cache) == 0
+    assert AssertionPlan(tr_method('heavy_method')).count(testable.traces) == 2
+
+
+def test_entries_shared_by_instances(shared_cache):
+    cns = Mock()
+    cns.kv.get.return_value = (1, {'Key': 'leader', 'Value': b'node'})
+    for _ in range(2):
+        kv = KVAdapter(cns=cns)
+        assert kv.kv_get('leader', kv_cache=shared_cache)['Value'] == b'node'
+    cns.kv.get.assert_called_once()
+    assert len(shared_cache) == 1
@@ -22,6 +22,8 @@ import inject
 import pytest
 from hax.common import HaxGlobalState
 from hax.exception import HAConsistencyException
+from hax.types import Fid, HaNoteStruct, ObjT
+from hax.util import FidWithType, PutKV
 
 
 @pytest.fixture
@@ -69,3 +71,186 @@ def test_get_leader_node_raises_ha_consistency_when_no_value(
                         side_effect=[new_kv('leader', None)])
     with pytest.raises(HAConsistencyException):
         consul_util.get_leader_node()
+
+
+NODE_KEY = 'm0conf/nodes/0x6e00000000000001:0x3'
+SDEV_KEY = (NODE_KEY + '/processes/0x7200000000000001:0x15'
+            '/services/0x7300000000000001:0x17'
+            '/sdevs/0x6400000000000001:0x18')
+SITE_KEY = 'm0conf/sites/0x5300000000000001:0x1'
+ENCL_KEY = (SITE_KEY + '/racks/0x6100000000000001:0x2'
+            '/encls/0x6500000000000001:0x4')
+CTRL_KEY = ENCL_KEY + '/ctrls/0x6300000000000001:0x5'
+
+
+def topology_stub_get(key: str, recurse: bool = False, **kwds):
+    if key == 'm0conf/nodes' and recurse:
+        return [
+            new_kv(NODE_KEY, b'{"name": "srvnode-1", "state": "online"}'),
+            new_kv(NODE_KEY + '/processes/0x7200000000000001:0x15',
+                   b'{"name": "m0_server", "state": "online"}'),
+            new_kv(NODE_KEY + '/processes/0x7200000000000001:0x15'
+                   '/services/0x7300000000000001:0x17',
+                   b'{"name": "ios", "state": "online"}'),
+            new_kv(SDEV_KEY, b'{"path": "/dev/sdc", "state": "failed"}'),
+            new_kv('m0conf/nodes/srvnode-1/processes/21/services/ios', b'23'),
+            new_kv('m0conf/nodes/srvnode-1/processes/21/services/'
+                   'm0_client_s3', b'24')
+        ]
+    if key == 'm0conf/sites' and recurse:
+        return [
+            new_kv(SITE_KEY, b'{"state": "online"}'),
+            new_kv(ENCL_KEY,
+                   b'{"node": "0x6e00000000000001:0x3", "state": "online"}'),
+            new_kv(CTRL_KEY, b'{"state": "online"}'),
+            new_kv(CTRL_KEY + '/drives/0x6b00000000000001:0x19',
+                   b'{"sdev": "0x6400000000000001:0x18", "state": "online"}')
+        ]
+    if key == 'm0_client_types':
+        return new_kv(key, b'["m0_client_s3"]')
+    raise RuntimeError(f'Unexpected call: key={key}, recurse={recurse}')
+
+
+def test_topology_lookups_fetch_nodes_once(mocker, consul_util):
+    kv_get = mocker.patch.object(consul_util.kv,
+                                 'kv_get',
+                                 side_effect=topology_stub_get)
+    proc_fid = Fid(0x7200000000000001, 0x15)
+
+    assert consul_util.get_node_fid('srvnode-1') == Fid(
+        0x6e00000000000001, 0x3)
+    assert consul_util.get_process_node(proc_fid) == 'srvnode-1'
+    assert consul_util.get_service_process_fid(
+        Fid(0x7300000000000001, 0x17)) == proc_fid
+    assert consul_util.get_io_service_devices(proc_fid) == [
+        '0x6400000000000001:0x18'
+    ]
+    assert consul_util.get_services_by_parent_process(
+        Fid(0x7200000000000001, 21)) == [
+            FidWithType(fid=Fid(0x7300000000000001, 23), service_type='ios'),
+            FidWithType(fid=Fid(0x7300000000000001, 24),
+                        service_type='m0_client_s3')
+    ]
+    assert consul_util.is_proc_client(Fid(0x7200000000000001, 21))
+    assert not consul_util.is_proc_client(Fid(0x7200000000000001, 22))
+    recursive_gets = [
+        c for c in kv_get.call_args_list if c[0][0] == 'm0conf/nodes'
+    ]
+    assert len(recursive_gets) == 1
+
+
+def test_sdev_state_read_from_nodes_topology(mocker, consul_util):
+    mocker.patch.object(consul_util.kv,
+                        'kv_get',
+                        side_effect=topology_stub_get)
+    sdev_fid = Fid(0x6400000000000001, 0x18)
+
+    assert consul_util.get_sdev_state(
+        ObjT.SDEV, 0x18) == HaNoteStruct.M0_NC_FAILED
+    assert consul_util.get_sdev_state(
+        ObjT.SDEV, 0x99) == HaNoteStruct.M0_NC_ONLINE
+    assert consul_util.get_sdev_state_update(sdev_fid,
+                                             'offline',
+                                             device_event=False) == []
+    assert consul_util.get_sdev_state_update(sdev_fid, 'online') == [
+        PutKV(key=SDEV_KEY, value='{"path": "/dev/sdc", "state": "online"}')
+    ]
+
+
+def test_sites_reverse_lookups_fetch_sites_once(mocker, consul_util):
+    kv_get = mocker.patch.object(consul_util.kv,
+                                 'kv_get',
+                                 side_effect=topology_stub_get)
+    sdev_fid = Fid(0x6400000000000001, 0x18)
+    drive_fid = Fid(0x6b00000000000001, 0x19)
+    ctrl_fid = Fid(0x6300000000000001, 0x5)
+    encl_fid = Fid(0x6500000000000001, 0x4)
+
+    assert consul_util.drive_to_sdev_fid(drive_fid) == sdev_fid
+    assert consul_util.sdev_to_drive_fid(sdev_fid) == drive_fid
+    assert consul_util.sdev_to_drive_fid(
+        Fid(0x6400000000000001, 0x99)) == Fid(0, 0)
+    assert consul_util.get_device_controller(str(sdev_fid)) == str(ctrl_fid)
+    assert consul_util.get_ioservice_ctrl_fid(
+        Fid(0x7200000000000001, 0x15)) == ctrl_fid
+    assert consul_util.get_node_encl_fid('srvnode-1') == encl_fid
+    assert consul_util.get_node_ctrl_fids('srvnode-1') == [ctrl_fid]
+    assert consul_util.get_ctrl_encl(ctrl_fid) == encl_fid
+    recursive_gets = [
+        c for c in kv_get.call_args_list if c[0][0] == 'm0conf/sites'
+    ]
+    assert len(recursive_gets) == 1
+
+
+def test_process_closure_computed_once(mocker, consul_util):
+    def stub_get(key: str, recurse: bool = False, **kwds):
+        if key.startswith('0x'):
+            # No full fid is stored for the service
+            return None
+        return topology_stub_get(key, recurse=recurse, **kwds)
+
+    kv_get = mocker.patch.object(consul_util.kv,
+                                 'kv_get',
+                                 side_effect=stub_get)
+    proc_fid = Fid(0x7200000000000001, 0x15)
+    svc_fid = Fid(0x7300000000000001, 0x17)
+
+    closure = consul_util.get_process_closure(proc_fid)
+    assert closure.node == 'srvnode-1'
+    assert closure.node_fid == Fid(0x6e00000000000001, 0x3)
+    assert closure.encl_fid == Fid(0x6500000000000001, 0x4)
+    assert closure.ctrl_fid == Fid(0x6300000000000001, 0x5)
+    assert closure.services == consul_util.get_services_by_parent_process(
+        proc_fid)
+    assert svc_fid in closure.service_fids
+    assert closure.service_fids == [x.fid for x in closure.services]
+    assert closure.drives == [Fid(0x6b00000000000001, 0x19)]
+
+    nr_gets = kv_get.call_count
+    assert consul_util.get_process_closure(proc_fid) is closure
+    assert kv_get.call_count == nr_gets
+
+    # The closure is recomputed once the conf objects hierarchy changes
+    consul_util._on_kv_mirror_changed('m0conf/', {SDEV_KEY}, set())
+    assert consul_util.get_process_closure(proc_fid) is not closure
+
+
+def test_conf_obj_statuses_resolved_against_one_snapshot(mocker, consul_util):
+    proc_fid = Fid(0x7200000000000001, 0x15)
+
+    def stub_get(key: str, recurse: bool = False, **kwds):
+        if key == 'processes/' and recurse:
+            return [
+                new_kv(f'processes/{proc_fid}',
+                       b'{"state": "M0_CONF_HA_PROCESS_STARTED",'
+                       b' "type": "M0_CONF_HA_PROCESS_M0D"}')
+            ]
+        return topology_stub_get(key, recurse=recurse, **kwds)
+
+    kv_get = mocker.patch.object(consul_util.kv,
+                                 'kv_get',
+                                 side_effect=stub_get)
+    mocker.patch.object(consul_util,
+                        'get_local_nodename',
+                        return_value='srvnode-1')
+    mocker.patch.object(consul_util, 'get_confd_list', return_value=[])
+    mocker.patch.object(consul_util, 'get_hax_fid', return_value=proc_fid)
+    health = mocker.patch.object(consul_util,
+                                 'get_node_health_details',
+                                 return_value=[{
+                                     'Status': 'passing',
+                                     'ServiceID': '21'
+                                 }])
+
+    states = consul_util.get_conf_obj_statuses([
+        proc_fid,
+        Fid(0x7300000000000001, 0x17),
+        Fid(0x6b00000000000001, 0x19)
+    ])
+    # The started hax process is reported ONLINE, so is its service
+    assert states == [
+        HaNoteStruct.M0_NC_ONLINE, HaNoteStruct.M0_NC_ONLINE,
+        HaNoteStruct.M0_NC_FAILED
+    ]
+    health.assert_called_once()
+    assert [c[0][0] for c in kv_get.call_args_list].count('processes/') == 1
@@ -28,10 +28,13 @@ from hax.common import HaxGlobalState
 from hax.message import BroadcastHAStates, StobId, StobIoqError
 from hax.motr import WorkPlanner, Motr
 from hax.motr.delivery import DeliveryHerald
-from hax.server import ServerRunner
+from hax.server import (MAX_PLANNER_BACKLOG, PLANNER_RETRY_AFTER,
+                        ServerRunner)
 from hax.types import Fid, HAState, MessageId, ObjHealth
 from hax.util import dump_json
 
+from ..test_topology import NODE, new_kv, node_items
+
 
 @pytest.fixture
 def herald(mocker):
@@ -142,7 +145,7 @@ async def test_bq_stob_message_type_recognized(hax_client, planner, herald,
         ret = {'bq-delivered/localhost': ''}
         return ret[key]
 
-    mocker.patch.object(herald, 'wait_for_any')
+    mocker.patch.object(herald, 'watch_any')
     #
     # InboxFilter will try to read epoch - let's mock KV operations
     mocker.patch.object(consul_util.kv, 'kv_put')
@@ -186,7 +189,7 @@ async def test_bq_stob_message_deserialized(hax_client, planner, herald,
         ret = {'bq-delivered/localhost': ''}
         return ret[key]
 
-    mocker.patch.object(herald, 'wait_for_any')
+    mocker.patch.object(herald, 'watch_any')
     #
     # InboxFilter will try to read epoch - let's mock KV operations
     stob = StobId(Fid(12, 13), Fid(14, 15))
@@ -231,3 +234,136 @@ async def test_bq_stob_message_deserialized(hax_client, planner, herald,
     planner.add_command.assert_called_once_with(
         ContainsStates(
             [HAState(fid=Fid(0x103, 0x204), status=ObjHealth.FAILED)]))
+
+
+async def test_cluster_status_served_with_etag(hax_client, consul_util,
+                                               mocker):
+    items = node_items() + [{
+        'Key': 'processes/0x7200000000000001:0x15',
+        'Value': b'{"state": "M0_CONF_HA_PROCESS_STARTED"}'
+    }, {
+        'Key': 'm0conf/pools/0x6f00000000000001:0x9',
+        'Value': b'the pool'
+    }]
+
+    def fake_get(key, recurse=False, **kwds):
+        found = [i for i in items if i['Key'].startswith(key)]
+        if recurse:
+            return found
+        return found[0] if found else None
+
+    mocker.patch.object(consul_util.kv, 'kv_get', side_effect=fake_get)
+    mocker.patch.object(consul_util,
+                        'get_node_health_status',
+                        return_value='passing')
+    resp = await hax_client.get('/v1/cluster/status')
+    assert resp.status == 200
+    status = await resp.json()
+    assert status['pools'] == [{
+        'fid': '0x6f00000000000001:0x9',
+        'name': 'the pool'
+    }]
+    assert status['nodes'] == [{
+        'name': 'srvnode-1',
+        'svcs': [{
+            'name': 'ioservice',
+            'fid': '0x7200000000000001:0x15',
+            'ep': 'inet:tcp:192.168.0.1@3001',
+            'status': 'started'
+        }]
+    }]
+    etag = resp.headers['ETag']
+
+    resp = await hax_client.get('/v1/cluster/status',
+                                headers={'If-None-Match': etag})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == etag
+
+
+async def test_fids_computed_in_process(hax_client, consul_util, mocker):
+    ha_proc = NODE + '/processes/0x7200000000000001:0x6'
+    items = node_items() + [
+        new_kv(ha_proc, b'{"name": "hax"}'),
+        new_kv('m0conf/nodes/srvnode-1/processes/6/services/ha', b'7'),
+        new_kv('m0conf/nodes/srvnode-1/processes/6/endpoint',
+               b'inet:tcp:192.168.0.1@22001'),
+        new_kv('m0conf/profiles/0x7000000000000001:0x59', b'{}'),
+        new_kv('m0_client_types', b'["m0_client_s3"]'),
+    ]
+
+    def fake_get(key, recurse=False, **kwds):
+        found = [i for i in items if i['Key'].startswith(key)]
+        if recurse:
+            return found
+        return found[0] if found else None
+
+    mocker.patch.object(consul_util.kv, 'kv_get', side_effect=fake_get)
+    resp = await hax_client.get('/v1/cluster/fetch-fids')
+    assert resp.status == 200
+    nodes = await resp.json()
+    assert len(nodes) == 1
+    node = nodes[0]
+    ha_ep = 'inet:tcp:192.168.0.1@22001'
+    assert (node['name'], node['ha_ep']) == ('srvnode-1', ha_ep)
+    assert node['svcs'] == [{
+        'name': 'ioservice',
+        'fid': '0x7200000000000001:0x15',
+        'ep': 'inet:tcp:192.168.0.1@3001',
+        'ha_ep': ha_ep,
+        'uuid': node['uuid'],
+        'be_seg_path': '/dev/vg'
+    }, {
+        'name': 'm0_client_s3',
+        'fid': '0x7200000000000001:0x15',
+        'ep': 'inet:tcp:192.168.0.1@3001',
+        'ha_ep': ha_ep,
+        'profile_fid': '0x7000000000000001:0x59'
+    }, {
+        'name': 'hax',
+        'fid': '0x7200000000000001:0x6',
+        'ep': ha_ep
+    }]
+
+
+async def test_rejected_when_planner_backlog_is_long(hax_client, planner,
+                                                     mocker):
+    mocker.patch.object(planner,
+                        'get_backlog_size',
+                        return_value=MAX_PLANNER_BACKLOG)
+    resp = await hax_client.post('/api/v1/sns/repair-start',
+                                 json={'fid': '0x6f00000000000001:0x9'})
+    assert resp.status == 503
+    assert resp.headers['Retry-After'] == str(PLANNER_RETRY_AFTER)
+    assert not planner.add_command.called
+
+
+async def test_watch_handlers_not_rejected(hax_client, planner, mocker):
+    # Consul doesn't retry the http watch handlers
+    mocker.patch.object(planner,
+                        'get_backlog_size',
+                        return_value=MAX_PLANNER_BACKLOG)
+    resp = await hax_client.post('/', json=[])
+    assert resp.status == 200
+    assert planner.add_command.called
+
+
+async def test_handler_stats_available(hax_client):
+    resp = await hax_client.get('/v1/hax/handlers')
+    assert resp.status == 200
+    stats = await resp.json()
+    assert stats['watch'] == {
+        'queued': 0,
+        'running': 0,
+        'completed': 0,
+        'rejected': 0
+    }
+
+
+async def test_metrics_exposed(hax_client, planner):
+    resp = await hax_client.get('/metrics')
+    assert resp.status == 200
+    assert resp.headers['Content-Type'].startswith('text/plain')
+    text = await resp.text()
+    assert 'hax_planner_queued_commands{queue="backlog"} 0' in text
+    assert 'hax_delivery_pending_promises 0' in text
+    assert 'hax_http_handlers{pool="watch",state="queued"} 0' in text
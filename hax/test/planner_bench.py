@@ -0,0 +1,442 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+"""
+WorkPlanner benchmark.
+
+Drives WorkPlanner with a number of consumer threads (like ConsumerThread
+in hax does) and a synthetic or recorded flow of commands. No Motr is
+needed: the execution of a command is simulated by sleeping for its
+service time.
+
+Usage (from the hax/ directory):
+
+    python3 -m test.planner_bench --threads 32 --profile node-loss
+    python3 -m test.planner_bench --trace trace.jsonl --json
+
+The trace is a JSON Lines file, one command per line:
+
+    {"t": 0.125, "type": "BroadcastHAStates", "fid": "0x7200000000000001:0x15",
+     "states": 1}
+
+where "t" is the time (seconds) when the command is added to the planner
+relative to the beginning of the trace, "type" is one of COMMAND_TYPES,
+"fid" is the related fid (optional) and "states" is the number of HA states
+of a BroadcastHAStates command (optional, defaults to 1). The commands of
+other types are skipped.
+
+hax records such a trace of the commands it gets when HARE_HAX_PLANNER_TRACE
+environment variable is set to the path of the trace file (see
+CommandRecorder in hax.motr.planner).
+
+The report contains:
+- throughput: number of commands processed per second (the commands merged
+  by the planner count as processed);
+- queueing latency percentiles: time from add_command() till the moment a
+  consumer thread gets the command (till the command it is merged into
+  gets started);
+- lock contention: how many b_lock acquisitions had to wait and the total
+  time spent waiting.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from hax.message import (BaseMessage, BroadcastHAStates, Die,
+                         EntrypointRequest, HaNvecGetEvent, ProcessEvent,
+                         SnsRepairStart)
+from hax.motr.planner import WorkPlanner
+from hax.types import ConfHaProcess, Fid, HAState, ObjHealth, Uint128
+
+COMMAND_TYPES = ['BroadcastHAStates', 'EntrypointRequest', 'ProcessEvent',
+                 'HaNvecGetEvent', 'SnsRepairStart']
+
+# Simulated execution time (seconds) per command type
+SERVICE_TIME: Dict[str, float] = {
+    'BroadcastHAStates': 0.002,
+    'EntrypointRequest': 0.001,
+    'ProcessEvent': 0.001,
+    'HaNvecGetEvent': 0.0005,
+    'SnsRepairStart': 0.005,
+}
+# Additional execution time of BroadcastHAStates per HA state
+SERVICE_TIME_PER_STATE = 0.0001
+
+# Synthetic load profiles: command type -> weight
+PROFILES: Dict[str, Dict[str, int]] = {
+    # Cluster bootstrap: every process asks for the entrypoint, the process
+    # states are broadcast as they start.
+    'bootstrap': {
+        'BroadcastHAStates': 40,
+        'EntrypointRequest': 30,
+        'ProcessEvent': 25,
+        'HaNvecGetEvent': 5,
+    },
+    # A node is lost: a storm of single-state broadcasts from the watchers.
+    'node-loss': {
+        'BroadcastHAStates': 80,
+        'ProcessEvent': 10,
+        'HaNvecGetEvent': 10,
+    },
+    # Repair/rebalance in progress.
+    'sns': {
+        'BroadcastHAStates': 20,
+        'HaNvecGetEvent': 60,
+        'SnsRepairStart': 5,
+        'EntrypointRequest': 15,
+    },
+}
+
+
+@dataclass
+class TraceItem:
+    # Time (seconds) since the beginning of the trace
+    t: float
+    type: str
+    fid: Fid
+    states: int = 1
+
+
+@dataclass
+class Report:
+    threads: int
+    commands: int
+    elapsed: float
+    throughput: float
+    latency: Dict[str, float]
+    latency_by_type: Dict[str, Dict[str, float]]
+    executed: int
+    lock_acquisitions: int
+    lock_contended: int
+    lock_wait_total: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class ContentionTrackingRLock:
+    """
+    RLock that counts the acquisitions that had to wait for another thread.
+    Can be passed to threading.Condition.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            self._account(0.0, False)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        result = self._lock.acquire(True, timeout)
+        if result:
+            self._account(time.perf_counter() - start, True)
+        return result
+
+    def _account(self, waited: float, contended: bool) -> None:
+        with self._stats_lock:
+            self.acquisitions += 1
+            if contended:
+                self.contended += 1
+                self.wait_total += waited
+
+    __enter__ = acquire
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+    def release(self) -> None:
+        self._lock.release()
+
+    # The methods below are used by threading.Condition
+    def _release_save(self):
+        return self._lock._release_save()
+
+    def _acquire_restore(self, state) -> None:
+        start = time.perf_counter()
+        self._lock._acquire_restore(state)
+        waited = time.perf_counter() - start
+        self._account(waited, waited > 0.0001)
+
+    def _is_owned(self) -> bool:
+        return self._lock._is_owned()
+
+
+def synthetic_trace(profile: str,
+                    count: int,
+                    rate: float,
+                    processes: int = 64,
+                    seed: int = 1) -> List[TraceItem]:
+    """
+    Generates `count` commands according to the profile. The commands
+    arrive at `rate` commands per second (0 means all at once). The fids
+    are taken from a pool of `processes` process fids.
+    """
+    rnd = random.Random(seed)
+    weights = PROFILES[profile]
+    types = list(weights)
+    fids = [Fid(0x7200000000000001, i + 1) for i in range(processes)]
+    items = []
+    for i in range(count):
+        t = i / rate if rate else 0.0
+        items.append(
+            TraceItem(t=t,
+                      type=rnd.choices(types,
+                                       [weights[x] for x in types])[0],
+                      fid=rnd.choice(fids)))
+    return items
+
+
+def load_trace(path: str) -> List[TraceItem]:
+    items = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data['type'] not in COMMAND_TYPES:
+                # Not simulated by the benchmark
+                continue
+            fid = data.get('fid')
+            items.append(
+                TraceItem(t=float(data['t']),
+                          type=data['type'],
+                          fid=Fid.parse(fid) if fid else Fid(0, 0),
+                          states=int(data.get('states', 1))))
+    items.sort(key=lambda x: x.t)
+    return items
+
+
+@dataclass
+class _Sample:
+    type: str
+    added: float
+    started: Optional[float] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class _Reply:
+    """
+    Stands for the reply_to queue of a BroadcastHAStates, so that the
+    commands merged by WorkPlanner can be tracked too.
+    """
+    def __init__(self, sample: _Sample):
+        self.sample = sample
+
+    def put(self, item: Any) -> None:
+        self.sample.done.set()
+
+
+def _create_command(item: TraceItem, sample: _Sample) -> BaseMessage:
+    if item.type == 'BroadcastHAStates':
+        states = [HAState(fid=Fid(item.fid.container, item.fid.key + i),
+                          status=ObjHealth.OFFLINE)
+                  for i in range(item.states)]
+        return BroadcastHAStates(states=states, reply_to=_Reply(sample))
+    if item.type == 'EntrypointRequest':
+        return EntrypointRequest(reply_context=None,
+                                 req_id=Uint128(0, 1),
+                                 remote_rpc_endpoint='bench',
+                                 process_fid=item.fid,
+                                 git_rev='bench',
+                                 pid=0,
+                                 is_first_request=False)
+    if item.type == 'ProcessEvent':
+        return ProcessEvent(
+            ConfHaProcess(chp_event=0, chp_type=0, chp_pid=0, fid=item.fid))
+    if item.type == 'HaNvecGetEvent':
+        return HaNvecGetEvent(hax_msg=0, nvec=[])
+    if item.type == 'SnsRepairStart':
+        return SnsRepairStart(fid=item.fid)
+    raise ValueError(f'Unsupported command type: {item.type}')
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p: float) -> float:
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        'p50': pct(0.50),
+        'p90': pct(0.90),
+        'p99': pct(0.99),
+        'max': values[-1]
+    }
+
+
+def run(trace: List[TraceItem],
+        threads: int = 32,
+        time_scale: float = 1.0) -> Report:
+    """
+    Replays the trace against a fresh WorkPlanner processed by `threads`
+    consumer threads. Service times are multiplied by time_scale.
+    """
+    planner = WorkPlanner()
+    lock = ContentionTrackingRLock()
+    planner.b_lock = threading.Condition(lock)
+    # id(command) -> reply of the commands other than BroadcastHAStates
+    replies: Dict[int, _Reply] = {}
+    executed = 0
+    executed_lock = threading.Lock()
+
+    def service_time(cmd: BaseMessage) -> float:
+        name = type(cmd).__name__
+        t = SERVICE_TIME.get(name, 0.0)
+        if isinstance(cmd, BroadcastHAStates):
+            t += SERVICE_TIME_PER_STATE * len(cmd.states)
+        return t * time_scale
+
+    def consume():
+        nonlocal executed
+        while True:
+            cmd = planner.get_next_command()
+            if isinstance(cmd, Die):
+                planner.notify_finished(cmd)
+                break
+            now = time.perf_counter()
+            with executed_lock:
+                executed += 1
+                if isinstance(cmd, BroadcastHAStates):
+                    # The merged commands get started together with the
+                    # command they are merged into.
+                    cmd_replies = cmd.reply_queues()
+                else:
+                    cmd_replies = [replies.pop(id(cmd))]
+            for reply in cmd_replies:
+                reply.sample.started = now
+            time.sleep(service_time(cmd))
+            for reply in cmd_replies:
+                reply.put([])
+            planner.notify_finished(cmd)
+
+    workers = [
+        threading.Thread(target=consume, name=f'bench-consumer-{i}')
+        for i in range(threads)
+    ]
+    for w in workers:
+        w.start()
+
+    all_samples: List[_Sample] = []
+    start = time.perf_counter()
+    for item in trace:
+        delay = start + item.t - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sample = _Sample(type=item.type, added=time.perf_counter())
+        cmd = _create_command(item, sample)
+        if not isinstance(cmd, BroadcastHAStates):
+            with executed_lock:
+                replies[id(cmd)] = _Reply(sample)
+        all_samples.append(sample)
+        planner.add_command(cmd)
+
+    for sample in all_samples:
+        sample.done.wait()
+    elapsed = time.perf_counter() - start
+    planner.shutdown()
+    for w in workers:
+        w.join()
+
+    def latencies(items: Iterator[_Sample]) -> List[float]:
+        return [s.started - s.added for s in items if s.started is not None]
+
+    by_type: Dict[str, Dict[str, float]] = {}
+    for name in COMMAND_TYPES:
+        lat = latencies(s for s in all_samples if s.type == name)
+        if lat:
+            by_type[name] = _percentiles(lat)
+
+    return Report(threads=threads,
+                  commands=len(trace),
+                  elapsed=elapsed,
+                  throughput=len(trace) / elapsed if elapsed else 0.0,
+                  latency=_percentiles(latencies(iter(all_samples))),
+                  latency_by_type=by_type,
+                  executed=executed,
+                  lock_acquisitions=lock.acquisitions,
+                  lock_contended=lock.contended,
+                  lock_wait_total=lock.wait_total)
+
+
+def _print_report(report: Report) -> None:
+    def fmt(p: Dict[str, float]) -> str:
+        return ' '.join(f'{k}={v * 1000:.2f}ms' for k, v in p.items())
+
+    print(f'threads:            {report.threads}')
+    print(f'commands:           {report.commands} '
+          f'(executed as {report.executed})')
+    print(f'elapsed:            {report.elapsed:.3f}s')
+    print(f'throughput:         {report.throughput:.1f} commands/s')
+    print(f'queueing latency:   {fmt(report.latency)}')
+    for name, p in report.latency_by_type.items():
+        print(f'  {name + ":":<18}{fmt(p)}')
+    print(f'lock acquisitions:  {report.lock_acquisitions} '
+          f'({report.lock_contended} contended, '
+          f'{report.lock_wait_total * 1000:.2f}ms waited)')
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description='WorkPlanner benchmark')
+    p.add_argument('--threads', type=int, default=32,
+                   help='Number of consumer threads (default: %(default)s)')
+    p.add_argument('--profile', choices=sorted(PROFILES),
+                   default='node-loss',
+                   help='Synthetic load profile (default: %(default)s)')
+    p.add_argument('--commands', type=int, default=5000,
+                   help='Number of synthetic commands (default: %(default)s)')
+    p.add_argument('--rate', type=float, default=0,
+                   help='Arrival rate of synthetic commands per second, '
+                   '0 means all at once (default: %(default)s)')
+    p.add_argument('--trace', help='JSON Lines trace to replay instead of '
+                   'the synthetic load')
+    p.add_argument('--time-scale', type=float, default=1.0,
+                   help='Multiplier of the simulated service times '
+                   '(default: %(default)s)')
+    p.add_argument('--json', action='store_true',
+                   help='Print the report as JSON')
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    opts = _parse_args(argv)
+    if opts.trace:
+        trace = load_trace(opts.trace)
+    else:
+        trace = synthetic_trace(opts.profile, opts.commands, opts.rate)
+    report = run(trace, threads=opts.threads, time_scale=opts.time_scale)
+    if opts.json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import unittest
+from unittest.mock import Mock
+
+from hax.consul.trace import ConsulTracer, get_key_prefix
+from hax.util import ConsulUtil
+
+
+class TestConsulTracer(unittest.TestCase):
+    def test_key_prefix(self):
+        self.assertEqual(
+            'm0conf/nodes',
+            get_key_prefix('m0conf/nodes/0x6e00000000000001:0x3/processes'))
+        self.assertEqual('processes',
+                         get_key_prefix('processes/0x7200000000000001:0x15'))
+        self.assertEqual('leader', get_key_prefix('leader'))
+        self.assertEqual('stats/filesystem',
+                         get_key_prefix('stats/filesystem'))
+
+    def test_call_attributed_to_adapter_caller(self):
+        tracer = ConsulTracer()
+
+        def kv_get(key, **kwargs):
+            tracer.record('/v1/kv', 'GET', f'/v1/kv/{key}', [], 42, 0.01,
+                          False)
+            return (1, {'Key': key, 'Session': 'abc', 'Value': None})
+
+        cns = Mock()
+        cns.kv.get.side_effect = kv_get
+        util = ConsulUtil(raw_client=cns)
+        tracer.set_message('EntrypointRequest')
+        self.assertEqual('abc', util.get_leader_session_no_wait())
+        tracer.set_message(None)
+
+        calls = tracer.dump()['calls']
+        self.assertEqual(1, len(calls))
+        # Note: the class name is known since Python 3.11 (co_qualname)
+        self.assertRegex(calls[0]['caller'],
+                         r'^hax\.util:(ConsulUtil\.)?get_leader_session_no_wait$')
+        self.assertEqual('EntrypointRequest', calls[0]['message'])
+        self.assertEqual('leader', calls[0]['key_prefix'])
+        self.assertEqual(42, calls[0]['bytes'])
+
+    def test_calls_aggregated(self):
+        tracer = ConsulTracer(slow_threshold=0.5)
+        for _ in range(3):
+            tracer.record('/v1/kv', 'GET', '/v1/kv/m0conf/nodes',
+                          [('recurse', '1')], 100, 0.1, False)
+        tracer.record('/v1/kv', 'GET', '/v1/kv/m0conf/nodes',
+                      [('recurse', '1')], 100, 0.7, True)
+        tracer.record('/v1/kv', 'GET', '/v1/kv/m0conf/nodes',
+                      [('recurse', '1'), ('index', '5')], 0, 10, False)
+
+        data = tracer.dump()
+        calls = data['calls']
+        self.assertEqual(2, len(calls))
+        # The most time consuming first
+        self.assertEqual(1, calls[0]['count'])
+        self.assertEqual(4, calls[1]['count'])
+        self.assertEqual(1, calls[1]['errors'])
+        self.assertEqual(400, calls[1]['bytes'])
+        self.assertAlmostEqual(0.7, calls[1]['max_seconds'])
+        self.assertTrue(calls[1]['recurse'])
+        # Blocking queries are not slow
+        self.assertEqual([0.7], [c['seconds'] for c in data['slow_calls']])
+
+        tracer.reset()
+        self.assertEqual([], tracer.dump()['calls'])
+
+    def test_max_entries(self):
+        tracer = ConsulTracer(max_entries=1)
+        tracer.record('/v1/kv', 'GET', '/v1/kv/leader', [], 0, 0.1, False)
+        tracer.record('/v1/kv', 'GET', '/v1/kv/ssl/hax', [], 0, 0.1, False)
+        tracer.record('/v1/kv', 'GET', '/v1/kv/bytecount', [], 0, 0.1, False)
+        calls = tracer.dump()['calls']
+        self.assertEqual(2, len(calls))
+        self.assertEqual([('<other>', 2), ('<unknown>', 1)],
+                         [(c['caller'], c['count']) for c in calls])
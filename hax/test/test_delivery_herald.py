@@ -531,3 +531,132 @@ class TestDeliveryHeraldAll(unittest.TestCase):
             'Awaiting thread was unblocked only by a timeout. It means '
             'that unsorted_deliveries was analyzed too late.'
         )
+
+
+class TestDeliveryHeraldIndex(unittest.TestCase):
+    def test_unawaited_deliveries_expire(self):
+        herald = DeliveryHerald(unsorted_ttl_msec=100)
+        now = [1000]
+        herald.get_now_ts = lambda: now[0]
+        herald.notify_delivered(MessageId(100, 1))
+        now[0] = 1050
+        herald.notify_delivered(MessageId(100, 2))
+        now[0] = 1120
+        with herald.lock:
+            herald.groom_unsorted()
+        self.assertEqual([MessageId(100, 2)],
+                         list(herald.unsorted_deliveries))
+        with self.assertRaises(NotDelivered):
+            herald.wait_for_any(HaLinkMessagePromise([MessageId(100, 1)]),
+                                timeout_sec=0.1)
+        herald.wait_for_any(HaLinkMessagePromise([MessageId(100, 2)]),
+                            timeout_sec=0.1)
+        self.assertFalse(herald.unsorted_deliveries)
+
+    def test_no_waiters_left_behind(self):
+        herald = DeliveryHerald()
+
+        def fn():
+            sleep(0.2)
+            herald.notify_delivered(MessageId(100, 2))
+
+        t = Thread(target=fn)
+        t.start()
+        promise = HaLinkMessagePromise([MessageId(100, 1), MessageId(100, 2)])
+        herald.wait_for_any(promise, timeout_sec=5)
+        t.join()
+        self.assertEqual([MessageId(100, 1)], list(promise))
+        self.assertFalse(herald.waiting_clients)
+        self.assertFalse(herald.awaited)
+        # The rest of the promise is not awaited anymore
+        herald.notify_delivered(MessageId(100, 1))
+        self.assertEqual([MessageId(100, 1)],
+                         list(herald.unsorted_deliveries))
+
+    def test_overlapping_promises_notified(self):
+        herald = DeliveryHerald()
+        errors: Queue = Queue()
+
+        def wait(promise):
+            try:
+                herald.wait_for_any(promise, timeout_sec=5)
+            except Exception as e:
+                errors.put(e)
+
+        threads = [
+            Thread(target=wait,
+                   args=(HaLinkMessagePromise([MessageId(100, 1)]), )),
+            Thread(target=wait,
+                   args=(HaLinkMessagePromise(
+                       [MessageId(100, 1), MessageId(100, 2)]), ))
+        ]
+        for t in threads:
+            t.start()
+        while len(herald.waiting_clients) < 2:
+            sleep(0.01)
+        herald.notify_delivered(MessageId(100, 1))
+        for t in threads:
+            t.join()
+        self.assertTrue(errors.empty())
+        self.assertFalse(herald.waiting_clients)
+        self.assertFalse(herald.awaited)
+
+    def test_overlapping_futures_resolved(self):
+        herald = DeliveryHerald()
+        first = herald.watch_any(HaLinkMessagePromise([MessageId(100, 1)]))
+        second = herald.watch_all(
+            HaLinkMessagePromise([MessageId(100, 1), MessageId(100, 2)]))
+        herald.notify_delivered(MessageId(100, 1))
+        self.assertEqual([MessageId(100, 1)], first.result(timeout=0))
+        self.assertFalse(second.done())
+        self.assertEqual([MessageId(100, 2)], list(herald.awaited))
+        herald.notify_delivered(MessageId(100, 2))
+        self.assertEqual({MessageId(100, 1), MessageId(100, 2)},
+                         set(second.result(timeout=0)))
+        self.assertFalse(herald.awaited)
+
+
+class TestDeliveryHeraldFutures(unittest.TestCase):
+    def test_future_resolved_on_delivery(self):
+        herald = DeliveryHerald()
+        herald.notify_delivered(MessageId(100, 1))
+        done = herald.watch_any(HaLinkMessagePromise([MessageId(100, 1)]))
+        self.assertEqual([MessageId(100, 1)], done.result(timeout=0))
+
+        future = herald.watch_all(
+            HaLinkMessagePromise([MessageId(100, 2), MessageId(100, 3)]))
+        herald.notify_delivered(MessageId(100, 3))
+        self.assertFalse(future.done())
+        herald.notify_delivered(MessageId(100, 2))
+        self.assertEqual({MessageId(100, 2), MessageId(100, 3)},
+                         set(future.result(timeout=0)))
+        self.assertFalse(herald.waiting_clients)
+
+    def test_future_fails_by_timeout(self):
+        herald = DeliveryHerald()
+        future = herald.watch_any(HaLinkMessagePromise([MessageId(42, 1)]),
+                                  timeout_sec=0.2)
+        with self.assertRaises(NotDelivered):
+            future.result(timeout=5)
+        self.assertFalse(herald.awaited)
+
+    def test_wait_many(self):
+        herald = DeliveryHerald()
+
+        def fn():
+            sleep(0.2)
+            for i in range(1, 5):
+                herald.notify_delivered(MessageId(100, i))
+
+        t = Thread(target=fn)
+        t.start()
+        started = time()
+        herald.wait_many([HaLinkMessagePromise([MessageId(100, i)])
+                          for i in range(1, 5)],
+                         timeout_sec=5)
+        t.join()
+        self.assertLess(time() - started, 5)
+        with self.assertRaises(NotDelivered):
+            herald.wait_many([HaLinkMessagePromise([MessageId(100, 5)]),
+                              HaLinkMessagePromise([MessageId(100, 6)])],
+                             timeout_sec=0.2)
@@ -0,0 +1,137 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import time
+import unittest
+from threading import Thread
+from unittest.mock import Mock
+
+from hax.message import EntrypointRequest
+from hax.motr.entrypoint import DeferredReplies, EntrypointCache
+from hax.types import Fid, Uint128
+from hax.util import ServiceData
+
+RM_FID = Fid(0x7300000000000001, 0x17)
+
+
+def confd(node: str, fidk: int) -> ServiceData:
+    return ServiceData(node=node,
+                       fid=Fid(0x7200000000000001, fidk),
+                       ip_addr='192.168.0.28',
+                       address=f'192.168.0.28@tcp:12345:44:{fidk}')
+
+
+def new_util(sessions=('s1', ), principal_rm='node1'):
+    util = Mock()
+    util.get_leader_session.side_effect = list(sessions)
+    util.get_session_node.return_value = principal_rm
+    util.get_confd_list.return_value = [confd('node1', 1), confd('node2', 2),
+                                        confd('node3', 3)]
+    util.get_rm_fid.return_value = RM_FID
+    return util
+
+
+class TestEntrypointCache(unittest.TestCase):
+    def test_reused_while_leader_session_is_same(self):
+        util = new_util(sessions=['s1', 's1', 's2'])
+        cache = EntrypointCache(util)
+        info = cache.get()
+        self.assertEqual(RM_FID, info.rm_fid)
+        self.assertEqual(2, info.quorum)
+        self.assertEqual('192.168.0.28@tcp:12345:44:1', info.rm_eps)
+        util.get_rm_fid.assert_called_once_with(rm_node='node1')
+
+        self.assertIs(info, cache.get())
+        self.assertEqual(1, util.get_confd_list.call_count)
+        # New RC leader
+        self.assertIsNot(info, cache.get())
+        self.assertEqual(2, util.get_confd_list.call_count)
+
+    def test_reused_until_expired(self):
+        util = new_util(sessions=['s1'] * 3)
+        cache = EntrypointCache(util, ttl=0.1)
+        cache.get()
+        cache.get()
+        time.sleep(0.15)
+        cache.get()
+        self.assertEqual(2, util.get_confd_list.call_count)
+
+    def test_not_cached_without_rm_endpoint(self):
+        util = new_util(sessions=['s1'] * 2, principal_rm='node4')
+        cache = EntrypointCache(util)
+        self.assertIsNone(cache.get().rm_eps)
+        cache.get()
+        self.assertEqual(2, util.get_confd_list.call_count)
+
+    def test_concurrent_requests_fetched_once(self):
+        util = new_util(sessions=['s1'] * 8)
+
+        def get_confd_list():
+            time.sleep(0.1)
+            return [confd('node1', 1)]
+
+        util.get_confd_list.side_effect = get_confd_list
+        cache = EntrypointCache(util)
+        threads = [Thread(target=cache.get) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, util.get_confd_list.call_count)
+
+
+def new_request(fidk: int = 0x15) -> EntrypointRequest:
+    return EntrypointRequest(reply_context='stub',
+                             req_id=Uint128(0, 1),
+                             remote_rpc_endpoint='ep',
+                             process_fid=Fid(0x7200000000000001, fidk),
+                             git_rev='deadbeef',
+                             pid=123,
+                             is_first_request=False)
+
+
+class TestDeferredReplies(unittest.TestCase):
+    def test_resubmitted_after_delay(self):
+        submit = Mock()
+        replies = DeferredReplies(submit, delay=0.1)
+        req = new_request()
+        self.assertEqual(0.1, replies.defer(req))
+        submit.assert_not_called()
+        time.sleep(0.3)
+        submit.assert_called_once_with(req)
+
+    def test_delay_backs_off_per_process(self):
+        replies = DeferredReplies(Mock(), delay=10, backoff=2, max_delay=30)
+        req = new_request()
+        self.assertEqual([10, 20, 30],
+                         [replies.defer(req) for _ in range(3)])
+        self.assertEqual(10, replies.defer(new_request(0x16)))
+        replies.reset(req.process_fid)
+        self.assertEqual(10, replies.defer(req))
+        replies.stop()
+
+    def test_pending_requests_returned_on_stop(self):
+        submit = Mock()
+        replies = DeferredReplies(submit, delay=10)
+        reqs = [new_request(0x15), new_request(0x16)]
+        for req in reqs:
+            replies.defer(req)
+        self.assertEqual(reqs, replies.stop())
+        time.sleep(0.1)
+        submit.assert_not_called()
@@ -19,7 +19,12 @@
 # flake8: noqa
 import logging
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+import inject
+from consul import ConsulException
+
+from hax.common import di_configuration
 from hax.queue import BQProcessor
 from hax.motr.planner import WorkPlanner
 from hax.motr.delivery import DeliveryHerald
@@ -27,6 +32,7 @@ from hax.message import BroadcastHAStates
 
 from hax.log import TRACE
 from hax.motr import Motr
+from hax.motr.util import NoteSet
 from hax.types import (Fid, HaNoteStruct, HAState, MessageId,
                                ObjHealth, m0HaObjState)
 from hax.util import (FidWithType, PutKV, ConsulUtil)
@@ -213,3 +219,57 @@ class TestFailure(unittest.TestCase):
 
         broadcast_list = motr._ha_broadcast.call_args[0][0]
         self.assertTrue(_has_failed_note(broadcast_list, drive_fid))
+
+
+class TestBatchedUpdates(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        inject.clear_and_configure(di_configuration)
+
+    @classmethod
+    def tearDownClass(cls):
+        inject.clear()
+
+    def test_failed_txn_retried_before_broadcast(self):
+        cns = Mock()
+        cns.txn.put.side_effect = [ConsulException('500 No leader'), None]
+        consul_util = ConsulUtil(raw_client=cns)
+        motr = Motr(Mock(spec=['init_motr_api']), None, None, consul_util)
+        drive_fid = Fid(0x6b00000000000001, 0x11)
+
+        def update_drive_state(fids, status, kv_cache=None):
+            consul_util.kv.kv_put(f'drives/{fids[0]}', 'failed')
+            consul_util.kv.kv_put(f'drives/{fids[0]}/sdev', 'failed')
+
+        consul_util.get_hax_fid = Mock(
+            return_value=Fid(0x7200000000000001, 0x6))
+        consul_util.update_drive_state = Mock(side_effect=update_drive_state)
+        motr._ha_broadcast = Mock(return_value=[])
+
+        with patch('hax.util._sleep_unless_stopping'):
+            motr.broadcast_ha_states(
+                [HAState(fid=drive_fid, status=ObjHealth.FAILED)])
+
+        keys = [[op['KV']['Key'] for op in c[0][0]]
+                for c in cns.txn.put.call_args_list]
+        expected = [f'drives/{drive_fid}', f'drives/{drive_fid}/sdev']
+        self.assertEqual([expected, expected], keys)
+        broadcast_list = motr._ha_broadcast.call_args[0][0]
+        self.assertTrue(_has_failed_note(broadcast_list, drive_fid))
+
+
+class TestNoteSet(unittest.TestCase):
+    def test_last_state_wins(self):
+        def note(key, state):
+            return HaNoteStruct(Fid(0x6e00000000000001, key).to_c(), state)
+
+        notes = NoteSet()
+        notes.add(note(1, HaNoteStruct.M0_NC_TRANSIENT))
+        notes.extend([note(2, HaNoteStruct.M0_NC_ONLINE),
+                      note(1, HaNoteStruct.M0_NC_FAILED)])
+        self.assertEqual(2, len(notes))
+        self.assertEqual(1, notes.nr_duplicates)
+        self.assertEqual([(1, HaNoteStruct.M0_NC_FAILED),
+                          (2, HaNoteStruct.M0_NC_ONLINE)],
+                         [(n.no_id.f_key, n.no_state)
+                          for n in notes.to_list()])
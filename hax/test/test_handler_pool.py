@@ -0,0 +1,91 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import asyncio
+import unittest
+from threading import Event
+
+from aiohttp import web
+
+from hax.handler_pool import HandlerPool
+
+
+class TestHandlerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = HandlerPool('test', max_workers=1, max_queued=1)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.loop.close()
+
+    def test_result_returned(self):
+        result = self.loop.run_until_complete(self.pool.run(sum, [1, 2]))
+        self.assertEqual(3, result)
+        stats = self.pool.get_stats()
+        self.assertEqual((0, 0, 1, 0), (stats.queued, stats.running,
+                                        stats.completed, stats.rejected))
+
+    def test_rejected_when_queue_is_full(self):
+        release = Event()
+        started = Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        async def scenario():
+            running = asyncio.ensure_future(self.pool.run(blocker))
+            await asyncio.get_event_loop().run_in_executor(
+                None, started.wait, 5)
+            queued = asyncio.ensure_future(self.pool.run(blocker))
+            await asyncio.sleep(0)
+            stats = self.pool.get_stats()
+            self.assertEqual((1, 1), (stats.queued, stats.running))
+            with self.assertRaises(web.HTTPTooManyRequests) as ctx:
+                await self.pool.run(blocker)
+            self.assertEqual('1', ctx.exception.headers['Retry-After'])
+            release.set()
+            await asyncio.gather(running, queued)
+
+        self.loop.run_until_complete(scenario())
+        stats = self.pool.get_stats()
+        self.assertEqual((0, 0, 2, 1), (stats.queued, stats.running,
+                                        stats.completed, stats.rejected))
+
+    def test_unbounded_queue_never_rejects(self):
+        pool = HandlerPool('unbounded', max_workers=1, max_queued=None)
+        release = Event()
+
+        async def scenario():
+            handlers = [
+                asyncio.ensure_future(pool.run(release.wait, 5))
+                for _ in range(10)
+            ]
+            await asyncio.sleep(0)
+            self.assertGreaterEqual(pool.get_stats().queued, 9)
+            release.set()
+            await asyncio.gather(*handlers)
+
+        try:
+            self.loop.run_until_complete(scenario())
+        finally:
+            pool.shutdown()
+        stats = pool.get_stats()
+        self.assertEqual((10, 0), (stats.completed, stats.rejected))
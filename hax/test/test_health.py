@@ -0,0 +1,78 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import time
+import unittest
+from unittest.mock import Mock
+
+from consul import ConsulException
+
+from hax.consul.health import HealthSnapshot
+from hax.exception import HAConsistencyException
+
+
+def check(node: str, status: str, svc_id: str = ''):
+    return {
+        'Node': node,
+        'CheckID': f'service:{svc_id}' if svc_id else 'serfHealth',
+        'Status': status,
+        'ServiceID': svc_id,
+        'ServiceName': 'ios' if svc_id else ''
+    }
+
+
+CHECKS = [
+    check('srvnode-1', 'passing', '12'),
+    check('srvnode-1', 'passing'),
+    check('srvnode-2', 'critical'),
+    check('srvnode-2', 'critical', '15')
+]
+
+
+class TestHealthSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.cns = Mock()
+        self.cns.health.state.return_value = (1, CHECKS)
+
+    def test_checks_indexed_by_node_and_service(self):
+        health = HealthSnapshot(self.cns)
+        checks = health.get_node_checks('srvnode-1')
+        # The node-level check goes first, as in /v1/health/node responses
+        self.assertEqual(['', '12'], [c['ServiceID'] for c in checks])
+        self.assertEqual([], health.get_node_checks('srvnode-3'))
+        self.assertEqual('critical',
+                         health.get_service_checks('15')[0]['Status'])
+        self.cns.health.state.assert_called_once_with('any')
+
+    def test_refetched_when_outdated(self):
+        health = HealthSnapshot(self.cns, max_age=0.1)
+        health.get_node_checks('srvnode-1')
+        health.get_node_checks('srvnode-2')
+        self.assertEqual(1, self.cns.health.state.call_count)
+        time.sleep(0.15)
+        health.get_node_checks('srvnode-1')
+        self.assertEqual(2, self.cns.health.state.call_count)
+        health.invalidate()
+        health.get_node_checks('srvnode-1')
+        self.assertEqual(3, self.cns.health.state.call_count)
+
+    def test_consul_errors_wrapped(self):
+        self.cns.health.state.side_effect = ConsulException('boom')
+        with self.assertRaises(HAConsistencyException):
+            HealthSnapshot(self.cns).get_node_checks('srvnode-1')
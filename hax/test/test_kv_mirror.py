@@ -0,0 +1,276 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import unittest
+from unittest.mock import Mock, patch
+
+import inject
+
+from consul import ConsulException
+from consul.base import ClientError
+
+from hax.common import di_configuration
+from hax.consul import mirror as kv_mirror
+from hax.consul.mirror import KVMirror, configure_kv_mirror
+from hax.consul.watcher import KVWatcher
+from hax.util import MAX_TXN_OPS, STATIC_READ, KVAdapter, TxPutKV
+
+
+def new_kv(key: str, val: bytes, index: int = 1):
+    return {'Key': key, 'Value': val, 'ModifyIndex': index}
+
+
+class TestKVMirror(unittest.TestCase):
+    def test_not_covered_until_synced(self):
+        mirror = KVMirror(['m0conf/', 'failvec'])
+        self.assertFalse(mirror.covers('m0conf/nodes'))
+        mirror.apply('m0conf/', 10, [])
+        self.assertTrue(mirror.covers('m0conf/nodes'))
+        self.assertFalse(mirror.covers('failvec'))
+        self.assertFalse(mirror.covers('leader'))
+        mirror.mark_stale('m0conf/')
+        self.assertFalse(mirror.covers('m0conf/nodes'))
+
+    def test_stale_after_timeout(self):
+        mirror = KVMirror(['m0conf/'], max_staleness=0)
+        mirror.apply('m0conf/', 10, [])
+        self.assertFalse(mirror.covers('m0conf/nodes'))
+
+    def test_get_mimics_consul(self):
+        mirror = KVMirror(['m0conf/'])
+        mirror.apply('m0conf/', 10, [
+            new_kv('m0conf/sites/s1', b'{}'),
+            new_kv('m0conf/nodes/n2', b'{"name": "b"}'),
+            new_kv('m0conf/nodes/n1', b'{"name": "a"}'),
+        ])
+        self.assertEqual(b'{"name": "a"}',
+                         mirror.get('m0conf/nodes/n1')['Value'])
+        self.assertIsNone(mirror.get('m0conf/nodes/n3'))
+        self.assertEqual(['m0conf/nodes/n1', 'm0conf/nodes/n2'],
+                         [i['Key'] for i in mirror.get('m0conf/nodes',
+                                                       recurse=True)])
+        self.assertIsNone(mirror.get('m0conf/profiles', recurse=True))
+
+    def test_subtree_reads_follow_updates(self):
+        mirror = KVMirror(['m0conf/', 'processes/'])
+        mirror.apply('processes/', 5, [new_kv('processes/p1', b'1')])
+        mirror.apply('m0conf/', 10, [
+            new_kv('m0conf/nodes/n1', b'1'),
+            new_kv('m0conf/nodes/n2', b'2'),
+            new_kv('m0conf/sites/s1', b'3'),
+        ])
+        mirror.apply('m0conf/', 11, [
+            new_kv('m0conf/nodes/n3', b'4'),
+            new_kv('m0conf/nodes/n1', b'1'),
+            new_kv('m0conf/sites/s1', b'3'),
+        ])
+        self.assertEqual(['m0conf/nodes/n1', 'm0conf/nodes/n3'],
+                         [i['Key'] for i in mirror.get('m0conf/nodes',
+                                                       recurse=True)])
+        self.assertEqual(['processes/p1'],
+                         [i['Key'] for i in mirror.get('processes/',
+                                                       recurse=True)])
+        mirror.put_local('m0conf/nodes/n2', 'local')
+        mirror.delete_local('m0conf/nodes/n3')
+        self.assertEqual([('m0conf/nodes/n1', b'1'),
+                          ('m0conf/nodes/n2', b'local')],
+                         [(i['Key'], i['Value'])
+                          for i in mirror.get('m0conf/nodes', recurse=True)])
+
+    def test_listeners_get_changed_keys(self):
+        mirror = KVMirror(['m0conf/'])
+        listener = Mock()
+        mirror.add_listener(listener)
+        mirror.apply('m0conf/', 10, [new_kv('m0conf/a', b'1')])
+        listener.assert_called_with('m0conf/', {'m0conf/a'}, set())
+        listener.reset_mock()
+        # Same index: nothing has changed
+        mirror.apply('m0conf/', 10, [new_kv('m0conf/a', b'1')])
+        listener.assert_not_called()
+        mirror.apply('m0conf/', 11, [new_kv('m0conf/a', b'2', index=11)])
+        listener.assert_called_with('m0conf/', set(), {'m0conf/a'})
+        self.assertEqual(2, mirror.get_version('m0conf/a'))
+
+    def test_local_writes_visible_until_watcher_catches_up(self):
+        mirror = KVMirror(['processes/'])
+        mirror.apply('processes/', 10, [new_kv('processes/p1', b'old')])
+        mirror.put_local('processes/p1', 'new')
+        self.assertEqual(b'new', mirror.get('processes/p1')['Value'])
+        # The snapshot taken before the write doesn't override it
+        mirror.apply('processes/', 11, [new_kv('processes/p1', b'old')])
+        self.assertEqual(b'new', mirror.get('processes/p1')['Value'])
+        mirror.apply('processes/', 12,
+                     [new_kv('processes/p1', b'new', index=12)])
+        self.assertEqual(12, mirror.get('processes/p1')['ModifyIndex'])
+        mirror.delete_local('processes/', recurse=True)
+        self.assertIsNone(mirror.get('processes/', recurse=True))
+
+
+class TestKVAdapterWithMirror(unittest.TestCase):
+    def test_reads_served_by_mirror_when_fresh(self):
+        cns = Mock()
+        cns.kv.get.return_value = (5, new_kv('failvec', b'consul'))
+        cns.kv.put.return_value = True
+        kv = KVAdapter(cns=cns)
+        kv.mirror = KVMirror(['failvec'])
+
+        self.assertEqual(b'consul', kv.kv_get('failvec')['Value'])
+        self.assertEqual(1, cns.kv.get.call_count)
+
+        kv.mirror.apply('failvec', 5, [new_kv('failvec', b'mirror')])
+        self.assertEqual(b'mirror', kv.kv_get('failvec')['Value'])
+        self.assertEqual(1, cns.kv.get.call_count)
+
+        kv.kv_put('failvec', 'written')
+        self.assertEqual(b'written', kv.kv_get('failvec')['Value'])
+        self.assertEqual(1, cns.kv.get.call_count)
+
+    def test_shared_mirror_used_by_default(self):
+        cns = Mock()
+        try:
+            mirror = configure_kv_mirror(['failvec'])
+            mirror.apply('failvec', 5, [new_kv('failvec', b'mirror')])
+            kv = KVAdapter(cns=cns)
+            self.assertIs(mirror, kv.mirror)
+            self.assertEqual(b'mirror', kv.kv_get('failvec')['Value'])
+            cns.kv.get.assert_not_called()
+        finally:
+            kv_mirror._mirror = None
+
+    def test_consistent_reads_bypass_mirror(self):
+        cns = Mock()
+        cns.kv.get.return_value = (5, new_kv('m0conf/a', b'consul'))
+        kv = KVAdapter(cns=cns)
+        kv.mirror = KVMirror(['m0conf/'])
+        kv.mirror.apply('m0conf/', 5, [new_kv('m0conf/a', b'mirror')])
+
+        self.assertEqual(
+            b'mirror',
+            kv.kv_get('m0conf/a', consistency=STATIC_READ)['Value'])
+        cns.kv.get.assert_not_called()
+
+        self.assertEqual(
+            b'consul',
+            kv.kv_get('m0conf/a', consistency='consistent')['Value'])
+        cns.kv.get.assert_called_once_with('m0conf/a',
+                                           consistency='consistent')
+
+
+class TestKVAdapterBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        inject.clear_and_configure(di_configuration)
+
+    @classmethod
+    def tearDownClass(cls):
+        inject.clear()
+
+    def setUp(self):
+        self.cns = Mock()
+        self.cns.kv.get.return_value = (5, None)
+        self.cns.kv.put.return_value = True
+        self.kv = KVAdapter(cns=self.cns)
+
+    def txn_keys(self):
+        return [[op['KV']['Key'] for op in c[0][0]]
+                for c in self.cns.txn.put.call_args_list]
+
+    def test_writes_flushed_on_exit(self):
+        with self.kv.batch():
+            self.kv.kv_put('processes/a', '1')
+            self.kv.kv_put('processes/b', '2')
+            self.kv.kv_put('processes/a', '3')
+            self.cns.txn.put.assert_not_called()
+            self.assertEqual(b'3', self.kv.kv_get('processes/a')['Value'])
+            self.assertEqual(['processes/a', 'processes/b'],
+                             [i['Key'] for i in self.kv.kv_get(
+                                 'processes/', recurse=True)])
+        self.cns.kv.put.assert_not_called()
+        self.assertEqual([['processes/b', 'processes/a']], self.txn_keys())
+
+    def test_writes_chunked(self):
+        with self.kv.batch():
+            with self.kv.batch():
+                for i in range(MAX_TXN_OPS + 1):
+                    self.kv.kv_put(f'k{i}', str(i))
+            self.cns.txn.put.assert_not_called()
+        self.assertEqual([MAX_TXN_OPS, 1],
+                         [len(keys) for keys in self.txn_keys()])
+
+    def test_rejected_txn_falls_back_to_puts(self):
+        self.cns.txn.put.side_effect = ClientError('409')
+        with self.kv.batch():
+            self.kv.kv_put('a', '1')
+            self.kv.kv_put('b', '2')
+        self.assertEqual(['a', 'b'],
+                         [c[0][0] for c in self.cns.kv.put.call_args_list])
+
+    def test_writes_flushed_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.kv.batch():
+                self.kv.kv_put('a', '1')
+                raise RuntimeError('boom')
+        self.assertEqual([['a']], self.txn_keys())
+        self.assertFalse(self.kv.has_pending_writes(''))
+
+    def test_failed_txn_retried(self):
+        self.cns.txn.put.side_effect = [ConsulException('500 No leader'), None]
+        with patch('hax.util._sleep_unless_stopping') as sleep:
+            with self.kv.batch():
+                self.kv.kv_put('a', '1')
+                self.kv.kv_put('b', '2')
+        sleep.assert_called_once()
+        self.assertEqual([['a', 'b'], ['a', 'b']], self.txn_keys())
+
+    def test_conditional_put_flushes_batch(self):
+        with self.kv.batch():
+            self.kv.kv_put('a', '1')
+            self.assertTrue(self.kv.has_pending_writes('a'))
+            self.kv.kv_put('b', '2', cas=0)
+            self.assertFalse(self.kv.has_pending_writes('a'))
+            self.assertEqual([['a']], self.txn_keys())
+            self.kv.kv_put_in_transaction(
+                [TxPutKV(key='c', value='3', cas=None)])
+        self.cns.kv.put.assert_called_once_with('b', '2', cas=0)
+        self.assertEqual([['a'], ['c']], self.txn_keys())
+
+
+class TestKVWatcher(unittest.TestCase):
+    def test_blocking_queries_feed_mirror(self):
+        mirror = KVMirror(['m0conf/'])
+        kv = Mock()
+        responses = [(10, [new_kv('m0conf/a', b'1')]),
+                     (12, [new_kv('m0conf/a', b'2', index=12)])]
+
+        def get_raw(key, **kwargs):
+            if len(responses) == 1:
+                watcher.stop()
+            return responses.pop(0)
+
+        kv.kv_get_raw.side_effect = get_raw
+        watcher = KVWatcher(kv, mirror, 'm0conf/')
+        watcher.start()
+        watcher.join()
+
+        calls = kv.kv_get_raw.call_args_list
+        self.assertIsNone(calls[0][1]['index'])
+        self.assertEqual(10, calls[1][1]['index'])
+        self.assertEqual(b'1', mirror.get('m0conf/a')['Value'])
+        # The watcher is stopped, so the mirror must not be used anymore.
+        self.assertFalse(mirror.covers('m0conf/a'))
@@ -0,0 +1,85 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import unittest
+
+from hax.consul.client import Consul, Transport, get_api_name, get_transport
+from hax.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_text_format(self):
+        registry = Registry()
+        calls = registry.counter('calls_total', 'Calls', ['api'])
+        calls.inc('/v1/kv')
+        calls.inc('/v1/kv', amount=2)
+        queued = registry.gauge('queued', 'Queued commands', ['queue'])
+        queued.set_function(lambda: 7, 'asap')
+        latency = registry.histogram('latency_seconds', 'Latency',
+                                     buckets=[0.1, 1])
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        self.assertEqual(
+            '\n'.join([
+                '# HELP calls_total Calls',
+                '# TYPE calls_total counter',
+                'calls_total{api="/v1/kv"} 3',
+                '# HELP latency_seconds Latency',
+                '# TYPE latency_seconds histogram',
+                'latency_seconds_bucket{le="0.1"} 1',
+                'latency_seconds_bucket{le="1.0"} 2',
+                'latency_seconds_bucket{le="+Inf"} 3',
+                'latency_seconds_sum 5.55',
+                'latency_seconds_count 3',
+                '# HELP queued Queued commands',
+                '# TYPE queued gauge',
+                'queued{queue="asap"} 7',
+            ]) + '\n', registry.render())
+
+    def test_labels_checked(self):
+        registry = Registry()
+        calls = registry.counter('calls_total', 'Calls', ['api'])
+        with self.assertRaises(ValueError):
+            calls.inc()
+        with self.assertRaises(ValueError):
+            registry.gauge('calls_total', 'Duplicate')
+
+    def test_consul_api_name(self):
+        self.assertEqual('/v1/kv', get_api_name('/v1/kv/processes/0x72:0x1'))
+        self.assertEqual('/v1/health/node',
+                         get_api_name('/v1/health/node/srvnode-1'))
+        self.assertEqual('/v1/txn', get_api_name('/v1/txn'))
+
+    def test_consul_transport_timeout(self):
+        transport = Transport(pool_size=2, timeout=10.0)
+        self.assertEqual(10.0, transport.get_timeout(None))
+        self.assertEqual(10.0, transport.get_timeout([('recurse', 1)]))
+        self.assertEqual(10.0 + 17,
+                         transport.get_timeout([('index', 5), ('wait', '16s')]))
+        self.assertEqual(10.0 + 0.5 * 17 / 16,
+                         transport.get_timeout({'wait': '500ms'}))
+        transport.close()
+
+    def test_consul_clients_share_transport(self):
+        cns1 = Consul()
+        cns2 = Consul()
+        self.assertIsNot(cns1.http, cns2.http)
+        self.assertIs(get_transport(), get_transport())
@@ -0,0 +1,165 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import inject
+
+from hax.common import di_configuration
+from hax.exception import HAConsistencyException
+from hax.retry import CircuitBreaker, RetryBudget, backoff_delay
+from hax.util import repeat_if_fails
+
+
+def call(fn):
+    def wrapped():
+        return fn()
+
+    return wrapped
+
+
+class TestBackoff(unittest.TestCase):
+    def test_delay_grows_up_to_max(self):
+        for attempt, expected in [(1, 1), (2, 2), (3, 4), (4, 8), (5, 10),
+                                  (1000, 10)]:
+            delay = backoff_delay(attempt, 1, 10)
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=3,
+                                 open_seconds=0.1)
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(0, breaker.check())
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertGreater(breaker.check(), 0)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    def test_single_probe_when_half_open(self):
+        breaker = CircuitBreaker('test', failure_threshold=1,
+                                 open_seconds=0.1)
+        breaker.record_failure()
+        time.sleep(0.15)
+        # The first caller probes, the others wait
+        self.assertEqual(0, breaker.check())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertGreater(breaker.check(), 0)
+
+        # Failed probe opens the breaker for longer
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertGreater(breaker.check(), 0.1)
+
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertEqual(0, breaker.check())
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_retries_spread_when_exhausted(self):
+        budget = RetryBudget(rate=10, burst=2)
+        self.assertEqual(0, budget.reserve())
+        self.assertEqual(0, budget.reserve())
+        self.assertAlmostEqual(0.1, budget.reserve(), delta=0.01)
+        self.assertAlmostEqual(0.2, budget.reserve(), delta=0.01)
+
+
+class TestRepeatIfFails(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        inject.clear_and_configure(di_configuration)
+
+    @classmethod
+    def tearDownClass(cls):
+        inject.clear()
+
+    def test_gives_up_after_max_retries(self):
+        fn = Mock(side_effect=HAConsistencyException('boom'))
+        sleep = Mock()
+        with patch('hax.util._sleep_unless_stopping', sleep):
+            with self.assertRaises(HAConsistencyException):
+                repeat_if_fails(wait_seconds=1, max_retries=3)(call(fn))()
+        self.assertEqual(4, fn.call_count)
+        delays = [c[0][1] for c in sleep.call_args_list]
+        self.assertEqual(3, len(delays))
+        self.assertLessEqual(delays[0], 1)
+        self.assertGreaterEqual(delays[2], 2)
+
+    def test_not_invoked_while_breaker_open(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=5)
+        breaker.record_failure()
+        fn = Mock(return_value=42)
+        sleep = Mock()
+        with patch('hax.util.CONSUL_BREAKER', breaker), \
+                patch('hax.util._sleep_unless_stopping', sleep):
+            with self.assertRaises(HAConsistencyException):
+                repeat_if_fails(wait_seconds=1, max_retries=1)(call(fn))()
+            fn.assert_not_called()
+            # The caller waits for the breaker rather than for the backoff
+            self.assertGreater(sleep.call_args[0][1], 4)
+
+            breaker.record_success()
+            self.assertEqual(42, repeat_if_fails(max_retries=1)(call(fn))())
+
+    def test_delay_bounded_by_max_wait(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=30)
+        breaker.record_failure()
+        fn = Mock(side_effect=HAConsistencyException('boom'))
+        sleep = Mock()
+        with patch('hax.util.CONSUL_BREAKER', breaker), \
+                patch('hax.util._sleep_unless_stopping', sleep):
+            with self.assertRaises(HAConsistencyException):
+                repeat_if_fails(wait_seconds=2, max_retries=5,
+                                max_wait_seconds=2)(call(fn))()
+        delays = [c[0][1] for c in sleep.call_args_list]
+        self.assertEqual(5, len(delays))
+        self.assertTrue(all(d <= 2 for d in delays))
+
+    def test_nested_calls_part_of_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1,
+                                 open_seconds=0.05)
+        breaker.record_failure()
+        time.sleep(0.1)
+
+        inner = repeat_if_fails(max_retries=1)(call(Mock(return_value=42)))
+
+        def outer_fn():
+            # The outer call holds the probe, the nested one must not wait
+            # for it.
+            self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+            return inner()
+
+        sleep = Mock()
+        with patch('hax.util.CONSUL_BREAKER', breaker), \
+                patch('hax.util._sleep_unless_stopping', sleep):
+            outer = repeat_if_fails(max_retries=1)(call(outer_fn))
+            self.assertEqual(42, outer())
+        sleep.assert_not_called()
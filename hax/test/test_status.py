@@ -0,0 +1,70 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import time
+import unittest
+from threading import Thread
+from unittest.mock import Mock
+
+from hax.status import Document, DocumentCache
+
+
+class TestDocument(unittest.TestCase):
+    def test_etag_depends_on_content(self):
+        doc = Document.from_data({'a': 1})
+        self.assertEqual(doc.etag, Document.from_data({'a': 1}).etag)
+        self.assertNotEqual(doc.etag, Document.from_data({'a': 2}).etag)
+        self.assertTrue(doc.etag.startswith('"'))
+
+
+class TestDocumentCache(unittest.TestCase):
+    def test_reused_until_expired(self):
+        compute = Mock(side_effect=lambda: Document.from_text('x'))
+        cache = DocumentCache(compute, ttl=0.1)
+        cache.get()
+        cache.get()
+        self.assertEqual(1, compute.call_count)
+        time.sleep(0.15)
+        cache.get()
+        self.assertEqual(2, compute.call_count)
+
+    def test_recomputed_on_version_change(self):
+        version = [1]
+        compute = Mock(side_effect=lambda: Document.from_text('x'))
+        cache = DocumentCache(compute, ttl=60, version_fn=lambda: version[0])
+        cache.get()
+        cache.get()
+        self.assertEqual(1, compute.call_count)
+        version[0] = 2
+        cache.get()
+        self.assertEqual(2, compute.call_count)
+
+    def test_concurrent_requests_computed_once(self):
+        def compute():
+            time.sleep(0.1)
+            return Document.from_text('x')
+
+        mock = Mock(side_effect=compute)
+        cache = DocumentCache(mock, ttl=60)
+        threads = [Thread(target=cache.get) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, mock.call_count)
@@ -0,0 +1,118 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+import unittest
+
+from hax.consul.topology import Topology
+from hax.types import Fid, ObjT
+
+
+NODE = 'm0conf/nodes/0x6e00000000000001:0x3'
+PROC = NODE + '/processes/0x7200000000000001:0x15'
+SVC = PROC + '/services/0x7300000000000001:0x17'
+SDEV = SVC + '/sdevs/0x6400000000000001:0x18'
+SITE = 'm0conf/sites/0x5300000000000001:0x1'
+ENCL = SITE + '/racks/0x6100000000000001:0x2/encls/0x6500000000000001:0x4'
+CTRL = ENCL + '/ctrls/0x6300000000000001:0x5'
+DRIVE = CTRL + '/drives/0x6b00000000000001:0x19'
+
+
+def new_kv(key: str, val):
+    return {'Key': key, 'Value': val}
+
+
+def node_items():
+    return [
+        new_kv(NODE, b'{"name": "srvnode-1", "state": "M0_NC_UNKNOWN"}'),
+        new_kv(PROC, '{"name": "m0_server", "state": "M0_NC_UNKNOWN"}'),
+        new_kv(SVC, '{"name": "ios", "state": "M0_NC_UNKNOWN"}'),
+        new_kv(SDEV, '{"path": "/dev/sdc", "state": "failed"}'),
+        new_kv('m0conf/nodes/srvnode-1/processes/21/services/ios', b'23'),
+        new_kv('m0conf/nodes/srvnode-1/processes/21/services/m0_client_s3',
+               '24'),
+        new_kv('m0conf/nodes/srvnode-1/processes/21/endpoint',
+               b'inet:tcp:192.168.0.1@3001'),
+        new_kv('m0conf/nodes/srvnode-1/processes/21/meta_data', '/dev/vg'),
+    ]
+
+
+def site_items():
+    return [
+        new_kv(SITE, '{"state": "M0_NC_UNKNOWN"}'),
+        new_kv(ENCL, '{"node": "0x6e00000000000001:0x3", "state": "x"}'),
+        new_kv(CTRL, '{"state": "M0_NC_UNKNOWN"}'),
+        new_kv(DRIVE, '{"sdev": "0x6400000000000001:0x18", "state": "x"}'),
+    ]
+
+
+class TestTopology(unittest.TestCase):
+    def test_fid_based_objects_indexed(self):
+        topology = Topology(node_items() + site_items())
+        sdev = topology.get(Fid(0x6400000000000001, 0x18))
+        self.assertIsNotNone(sdev)
+        self.assertEqual(SDEV, sdev.key)
+        self.assertEqual('failed', sdev.value['state'])
+        self.assertEqual(Fid(0x7300000000000001, 0x17), sdev.parent)
+        self.assertEqual(Fid(0x6e00000000000001, 0x3),
+                         topology.get_parent_fid(sdev.fid, ObjT.NODE))
+        self.assertEqual(Fid(0x6500000000000001, 0x4),
+                         topology.get_parent_fid(
+                             Fid(0x6b00000000000001, 0x19), ObjT.ENCLOSURE))
+        self.assertIsNone(topology.get(Fid(0x6400000000000001, 0x99)))
+
+    def test_descendants(self):
+        topology = Topology(node_items())
+        sdevs = topology.get_descendants(Fid(0x7200000000000001, 0x15),
+                                         ObjT.SDEV)
+        self.assertEqual([Fid(0x6400000000000001, 0x18)],
+                         [s.fid for s in sdevs])
+        self.assertEqual([], topology.get_descendants(
+            Fid(0x7200000000000001, 0x99), ObjT.SDEV))
+
+    def test_node_fid_by_name(self):
+        topology = Topology(node_items())
+        self.assertEqual(Fid(0x6e00000000000001, 0x3),
+                         topology.get_node_fid('srvnode-1'))
+        self.assertIsNone(topology.get_node_fid('srvnode-2'))
+
+    def test_legacy_keys(self):
+        topology = Topology(node_items())
+        self.assertEqual([('ios', 23), ('m0_client_s3', 24)],
+                         topology.get_process_services(21))
+        self.assertEqual('inet:tcp:192.168.0.1@3001',
+                         topology.get_process_endpoint(21))
+        self.assertEqual('/dev/vg', topology.get_process_meta_data(21))
+        self.assertEqual([], topology.get_process_services(22))
+
+    def test_empty(self):
+        self.assertTrue(Topology(None).is_empty())
+        self.assertTrue(Topology([]).is_empty())
+        self.assertFalse(Topology(node_items()).is_empty())
+
+    def test_reverse_indexes(self):
+        topology = Topology(node_items() + site_items())
+        sdev = Fid(0x6400000000000001, 0x18)
+        drive = Fid(0x6b00000000000001, 0x19)
+        self.assertEqual(drive, topology.get_drive_by_sdev(sdev))
+        self.assertEqual(sdev, topology.get_sdev_by_drive(drive))
+        self.assertEqual(Fid(0x6500000000000001, 0x4),
+                         topology.get_encl_by_node(
+                             Fid(0x6e00000000000001, 0x3)))
+        self.assertIsNone(topology.get_drive_by_sdev(
+            Fid(0x6400000000000001, 0x99)))
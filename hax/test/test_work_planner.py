@@ -18,20 +18,25 @@
 
 # flake8: noqa
 import logging
+import tempfile
 import time
 import unittest
 from queue import Queue
 from threading import Condition, Thread
 from typing import Any, List
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from hax.log import TRACE
 from hax.message import (BaseMessage, BroadcastHAStates, Die,
                          EntrypointRequest,
-                         HaNvecGetEvent, ProcessEvent)
+                         HaNvecGetEvent, ProcessEvent, ProcessHaEvent,
+                         SnsRepairStatus)
 from hax.motr.planner import WorkPlanner, State
 from hax.motr.util import LinkedList
-from hax.types import Fid, Uint128, ConfHaProcess
+from hax.types import (ConfHaProcess, Fid, HAState, ObjHealth, Uint128,
+                       m0HaProcessType)
+
+from . import planner_bench
 
 LOG = logging.getLogger('hax')
 
@@ -81,12 +86,18 @@ def nvec_get():
     return HaNvecGetEvent(hax_msg=1, nvec=[])
 
 
-def process_event():
+def process_ha_event():
+    return ProcessHaEvent(fid=Fid(0, 0),
+                          proc_type=m0HaProcessType.M0_CONF_HA_PROCESS_M0D,
+                          states=[])
+
+
+def process_event(fid: Fid = Fid(0, 0)):
     return ProcessEvent(
                ConfHaProcess(chp_event=0,
                              chp_type=0,
                              chp_pid=0,
-                             fid=Fid(0, 0)))
+                             fid=fid))
 
 
 class TestMessageOrder(unittest.TestCase):
@@ -168,6 +179,78 @@ class TestMessageOrder(unittest.TestCase):
         self.assertEqual([0, 0, 2, 0], [m.group for (m, _) in msgs_after_ep])
         self.assertEqual([0, 0, 0, 0], [m.group for (m, _) in msgs_after_nvec])
 
+    def test_queued_broadcasts_merged(self):
+        planner = WorkPlanner()
+        fid1, fid2, fid3 = Fid(0x72, 1), Fid(0x72, 2), Fid(0x72, 3)
+        q1: Queue = Queue()
+        q2: Queue = Queue()
+        planner.add_command(
+            BroadcastHAStates(states=[HAState(fid1, ObjHealth.OFFLINE),
+                                      HAState(fid2, ObjHealth.OFFLINE)],
+                              reply_to=q1))
+        planner.add_command(entrypoint())
+        planner.add_command(
+            BroadcastHAStates(states=[HAState(fid1, ObjHealth.OK),
+                                      HAState(fid3, ObjHealth.OK)],
+                              reply_to=q2))
+
+        self.assertEqual(1, len(planner.backlog))
+        cmd = planner.backlog[0]
+        self.assertEqual([HAState(fid2, ObjHealth.OFFLINE),
+                          HAState(fid1, ObjHealth.OK),
+                          HAState(fid3, ObjHealth.OK)], cmd.states)
+        self.assertEqual([q1, q2], cmd.reply_queues())
+
+    def test_broadcast_not_merged_across_other_commands(self):
+        planner = WorkPlanner()
+        planner.add_command(broadcast())
+        planner.add_command(process_ha_event())
+        planner.add_command(broadcast())
+        self.assertEqual([0, 1, 2], [c.group for c in planner.backlog])
+
+    def test_started_broadcast_not_merged(self):
+        planner = WorkPlanner()
+        planner.add_command(broadcast())
+        cmd = planner.get_next_command()
+        planner.add_command(
+            BroadcastHAStates(states=[HAState(Fid(0x72, 1), ObjHealth.OK)],
+                              reply_to=None))
+        self.assertEqual([], cmd.states)
+        self.assertEqual(1, len(planner.backlog))
+
+    def test_group_sizes_tracked(self):
+        planner = WorkPlanner()
+        planner.add_command(broadcast())
+        planner.add_command(process_ha_event())
+        planner.add_command(Die())
+        self.assertEqual({0: 1, 1: 2}, planner.state.group_sizes)
+
+        cmd = planner.get_next_command()
+        self.assertEqual({1: 2}, planner.state.group_sizes)
+        planner.notify_finished(cmd)
+        self.assertEqual(1, planner.state.current_group_id)
+
+    def test_asap_commands_skip_conflicting_head(self):
+        planner = WorkPlanner()
+        fid1, fid2 = Fid(0x72, 1), Fid(0x72, 2)
+        first = process_event(fid1)
+        blocked = process_event(fid1)
+        ep = entrypoint()
+        after_blocked = process_event(fid1)
+        other = process_event(fid2)
+        for cmd in [first, blocked, ep, after_blocked, other]:
+            planner.add_command(cmd)
+
+        self.assertIs(first, planner.get_next_command())
+        self.assertEqual({fid1: 1}, planner.state.active_fids)
+        self.assertIs(ep, planner.get_next_command())
+        # The events of fid1 keep their order, fid2 is not blocked by them
+        self.assertIs(other, planner.get_next_command())
+        planner.notify_finished(first)
+        self.assertIs(blocked, planner.get_next_command())
+        planner.notify_finished(blocked)
+        self.assertIs(after_blocked, planner.get_next_command())
+
 
 class TestWorkPlanner(unittest.TestCase):
     @classmethod
@@ -448,8 +531,10 @@ class TestWorkPlanner(unittest.TestCase):
 
         tracker = GroupTracker()
         thread_count = 1
+        # Note: the subsequent BroadcastHAStates would be merged into a single
+        # command, so another group-forming command is used here.
         for i in range(10):
-            planner.add_command(broadcast())
+            planner.add_command(process_ha_event())
 
         for j in range(thread_count):
             planner.add_command(Die())
@@ -495,3 +580,75 @@ class TestWorkPlanner(unittest.TestCase):
         self.assertEqual([99999, 10**5, 0, 1, 2, 3, 4,
                           5, 6, 7], groups_processed)
 
+    def test_blocked_asap_command_picked_after_conflict_finished(self):
+        planner = WorkPlanner()
+        planner.add_command(process_event())
+        planner.add_command(process_event())
+        first = planner.get_next_command()
+        taken = []
+
+        def fn():
+            taken.append(planner.get_next_command())
+
+        worker = Thread(target=fn)
+        worker.start()
+        # The second ProcessEvent has the same fid, so it must wait
+        worker.join(0.2)
+        self.assertEqual([], taken)
+        planner.notify_finished(first)
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(1, len(taken))
+
+
+class TestPlannerBench(unittest.TestCase):
+    def test_synthetic_load_processed(self):
+        for profile in planner_bench.PROFILES:
+            trace = planner_bench.synthetic_trace(profile, 300, rate=0)
+            report = planner_bench.run(trace, threads=4, time_scale=0)
+            self.assertEqual(300, report.commands)
+            self.assertLessEqual(report.executed, 300)
+            self.assertIn('p99', report.latency)
+            self.assertGreater(report.lock_acquisitions, 0)
+
+    def test_trace_replayed(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write('{"t": 0.01, "type": "EntrypointRequest", '
+                    '"fid": "0x7200000000000001:0x15"}\n'
+                    '{"t": 0, "type": "BroadcastHAStates", "states": 3}\n')
+            f.flush()
+            trace = planner_bench.load_trace(f.name)
+        self.assertEqual(['BroadcastHAStates', 'EntrypointRequest'],
+                         [i.type for i in trace])
+        report = planner_bench.run(trace, threads=2, time_scale=0)
+        self.assertEqual(2, report.executed)
+        self.assertEqual({'BroadcastHAStates', 'EntrypointRequest'},
+                         set(report.latency_by_type))
+
+    def test_recorded_trace_replayed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/trace.jsonl'
+            with patch.dict('os.environ', {'HARE_HAX_PLANNER_TRACE': path}):
+                planner = WorkPlanner()
+            fid = Fid(0x7200000000000001, 0x15)
+            planner.add_command(
+                BroadcastHAStates(states=[
+                    HAState(fid=fid, status=ObjHealth.OK),
+                    HAState(fid=Fid(0x7200000000000001, 0x16),
+                            status=ObjHealth.OK)
+                ], reply_to=None))
+            planner.add_command(
+                ProcessEvent(
+                    ConfHaProcess(chp_event=0,
+                                  chp_type=0,
+                                  chp_pid=0,
+                                  fid=fid)))
+            # Not simulated by the benchmark
+            planner.add_command(SnsRepairStatus(fid=fid, reply_to=None))
+            planner.shutdown()
+            trace = planner_bench.load_trace(path)
+        self.assertEqual([('BroadcastHAStates', 2), ('ProcessEvent', 1)],
+                         [(i.type, i.states) for i in trace])
+        self.assertEqual(fid, trace[1].fid)
+        report = planner_bench.run(trace, threads=2, time_scale=0)
+        self.assertEqual(2, report.commands)
@@ -24,15 +24,18 @@ import json
 import io
 import os
 import logging
-from typing import List
+from typing import Deque, Dict, Iterator, List, Tuple
 from functools import wraps
 from distutils.dir_util import copy_tree
 import shutil
-from time import sleep
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import local
+from time import perf_counter, sleep
 from urllib.parse import urlparse
 
 from cortx.utils.cortx import Const
-from hax.util import repeat_if_fails, KVAdapter
+from hax.util import MAX_TXN_OPS, KVAdapter, TxPutKV, repeat_if_fails
 from helper.exec import Program, Executor
 
 from hare_mp.store import ValueProvider
@@ -40,6 +43,14 @@ from hare_mp.types import Disk, DList, Maybe, Text
 
 LOG_DIR_EXT = '/hare/log/'
 
+# Number of parallel KV transactions issued by Utils.import_kv()
+KV_IMPORT_WORKERS = 8
+# How often (in number of KV entries) Utils.import_kv() reports its progress
+KV_IMPORT_PROGRESS_STEP = 5000
+# Key whose presence means that consul-kv.json is imported (see
+# is_kv_imported() in main.py); it is written after all other keys.
+KV_IMPORTED_MARKER = 'leader'
+
 
 def func_enter(func):
     """Logs function entry point."""
@@ -288,13 +299,97 @@ class Utils:
                       for dev_path in data_devs.value], 'List Disk')
 
     @func_log(func_enter, func_leave)
-    def import_kv(self, conf_dir_path: str):
-        with open(f'{conf_dir_path}/consul-kv.json') as f:
-            data = json.load(f)
-            for item in data:
-                item_data = json.loads(json.dumps(item))
-                self.kv.kv_put(item_data['key'],
-                               str(item_data['value']))
+    def import_kv(self, conf_dir_path: str,
+                  workers: int = KV_IMPORT_WORKERS):
+        """
+        Imports consul-kv.json into Consul KV.
+
+        The entries are written by KV transactions of up to MAX_TXN_OPS
+        keys each; the transactions are issued by `workers` threads in
+        parallel. KV_IMPORTED_MARKER is written only after all the other
+        keys are in the KV, so that an interrupted import is not mistaken
+        for a complete one. Once written, the imported values are read
+        back and verified.
+        """
+        start = perf_counter()
+        imported: Dict[str, str] = {}
+        marker: List[TxPutKV] = []
+        kv_local = local()
+
+        def put_batch(batch: List[TxPutKV]) -> int:
+            if not hasattr(kv_local, 'kv'):
+                # Every thread talks to Consul via its own HTTP session.
+                kv_local.kv = KVAdapter()
+            self._put_kv_batch(kv_local.kv, batch)
+            return len(batch)
+
+        def batches() -> Iterator[List[TxPutKV]]:
+            batch: List[TxPutKV] = []
+            for key, value in _iter_kv_entries(
+                    f'{conf_dir_path}/consul-kv.json'):
+                imported[key] = value
+                op = TxPutKV(key=key, value=value, cas=None)
+                if key == KV_IMPORTED_MARKER:
+                    marker.append(op)
+                    continue
+                batch.append(op)
+                if len(batch) == MAX_TXN_OPS:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        done = 0
+        reported = 0
+        # Only a few batches are kept in flight, the rest of the file is not
+        # read until the workers are ready to take it.
+        in_flight: Deque[Future] = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in batches():
+                in_flight.append(executor.submit(put_batch, batch))
+                if len(in_flight) < 2 * workers:
+                    continue
+                done += in_flight.popleft().result()
+                if done - reported >= KV_IMPORT_PROGRESS_STEP:
+                    logging.info('Imported %d KV entries so far', done)
+                    reported = done
+            while in_flight:
+                done += in_flight.popleft().result()
+        if marker:
+            self._put_kv_batch(self.kv, marker)
+        elapsed = perf_counter() - start
+        logging.info('Imported %d KV entries in %.2f seconds', len(imported),
+                     elapsed)
+        self._verify_kv(imported)
+
+    @repeat_if_fails()
+    def _put_kv_batch(self, kv: KVAdapter, batch: List[TxPutKV]) -> None:
+        if not kv.kv_put_in_transaction(batch):
+            # The transaction is rejected by Consul (e.g. some value is too
+            # large to fit the transaction); write the keys one by one.
+            logging.warning('KV transaction rejected, importing %d keys '
+                            'one by one', len(batch))
+            for op in batch:
+                kv.kv_put(op.key, op.value)
+
+    @repeat_if_fails()
+    def _verify_kv(self, expected: Dict[str, str]) -> None:
+        """
+        Reads the imported subtrees back from Consul KV and checks that all
+        the imported keys have the expected values.
+        """
+        actual: Dict[str, str] = {}
+        for prefix in sorted({k.split('/', 1)[0] for k in expected}):
+            for item in self.kv.kv_get(prefix, recurse=True,
+                                       allow_null=True) or []:
+                value = item['Value']
+                actual[item['Key']] = value.decode() if value else ''
+        mismatched = [k for k, v in expected.items() if actual.get(k) != v]
+        if mismatched:
+            raise RuntimeError(
+                f'{len(mismatched)} KV entries were not imported correctly '
+                f'(e.g. {mismatched[0]})')
+        logging.info('Verified %d imported KV entries', len(expected))
 
     @func_log(func_enter, func_leave)
     def copy_conf_files(self, conf_dir_path: str):
@@ -310,13 +405,10 @@ class Utils:
 
         copy_tree(f'{conf_dir_path}/sysconfig/motr/{node_name}', dest_motr)
 
-        with open(f'{conf_dir_path}/consul-kv.json') as f:
-            data = json.load(f)
-            for item in data:
-                item_data = json.loads(json.dumps(item))
-                if item_data['key'] == 'm0_client_types':
-                    m0_client_types = item_data['value']
-                    break
+        for key, value in _iter_kv_entries(f'{conf_dir_path}/consul-kv.json'):
+            if key == 'm0_client_types':
+                m0_client_types = value
+                break
 
         for client_type in json.loads(m0_client_types):
             src = f'{conf_dir_path}/sysconfig/{client_type}/{node_name}'
@@ -404,6 +496,47 @@ class LogWriter:
         return self.logging_handler.stream.fileno()
 
 
+def _iter_kv_entries(path: str,
+                     chunk_size: int = 1 << 20) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (key, value) pairs of the JSON array stored in consul-kv.json
+    without loading the whole array into memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buf = ''
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # Skip the whitespace and the array punctuation
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in ','):
+                pos += 1
+            if not started and pos < len(buf):
+                if buf[pos] != '[':
+                    raise ValueError(f'{path}: JSON array expected')
+                started = True
+                pos += 1
+                continue
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos == len(buf):
+                    raise ValueError('No data')
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise ValueError(f'{path}: malformed JSON near '
+                                     f'offset {pos}')
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            yield item['key'], str(item['value'])
+
+
 def execute(cmd: List[str], env=None) -> str:
     p = Program(cmd)
     out = Executor().run(p, env=env)
@@ -0,0 +1,100 @@
+# Copyright (c) 2020 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+#
+
+# flake8: noqa
+#
+import json
+import os
+import tempfile
+import unittest
+from typing import Dict
+from unittest.mock import Mock, patch
+
+import inject
+from hax.common import HaxGlobalState
+
+from hare_mp import utils
+from hare_mp.utils import Utils, _iter_kv_entries
+
+
+class FakeKV:
+    store: Dict[str, str] = {}
+
+    def kv_put_in_transaction(self, batch) -> bool:
+        if any(len(op.value) > 100 for op in batch):
+            return False
+        for op in batch:
+            self.store[op.key] = op.value
+        return True
+
+    def kv_put(self, key: str, value: str) -> bool:
+        self.store[key] = value
+        return True
+
+    def kv_get(self, prefix: str, **kwargs):
+        return [{'Key': k, 'Value': v.encode() or None}
+                for k, v in sorted(self.store.items()) if k.startswith(prefix)]
+
+
+class TestImportKV(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        inject.clear_and_configure(
+            lambda binder: binder.bind(HaxGlobalState, HaxGlobalState()))
+
+    def setUp(self):
+        FakeKV.store = {}
+        self.conf_dir = tempfile.mkdtemp()
+        items = [{'key': f'm0conf/nodes/{i}', 'value': str(i)}
+                 for i in range(500)]
+        items.insert(10, {'key': 'leader', 'value': 'node-1'})
+        items.append({'key': 'm0_client_types', 'value': '["s3"]'})
+        items.append({'key': 'big', 'value': 'x' * 200})
+        items.append({'key': 'empty', 'value': ''})
+        self.items = items
+        with open(os.path.join(self.conf_dir, 'consul-kv.json'), 'w') as f:
+            json.dump(items, f, indent=2)
+
+    def test_entries_streamed(self):
+        path = os.path.join(self.conf_dir, 'consul-kv.json')
+        self.assertEqual([(i['key'], i['value']) for i in self.items],
+                         list(_iter_kv_entries(path, chunk_size=7)))
+
+    def test_malformed_file(self):
+        path = os.path.join(self.conf_dir, 'consul-kv.json')
+        with open(path, 'w') as f:
+            f.write('[{"key": "a", "value": 1}, {"key": ')
+        with self.assertRaises(ValueError):
+            list(_iter_kv_entries(path))
+
+    def test_all_entries_imported(self):
+        with patch.object(utils, 'KVAdapter', FakeKV):
+            Utils(Mock()).import_kv(self.conf_dir, workers=4)
+        self.assertEqual({i['key']: i['value'] for i in self.items},
+                         FakeKV.store)
+        # The marker of the completed import goes last
+        self.assertEqual('leader', list(FakeKV.store)[-1])
+
+    def test_verification_fails(self):
+        class LossyKV(FakeKV):
+            def kv_put(self, key: str, value: str) -> bool:
+                return False
+
+        with patch.object(utils, 'KVAdapter', LossyKV):
+            with self.assertRaises(RuntimeError):
+                Utils(Mock()).import_kv(self.conf_dir)
@@ -15,7 +15,7 @@
 # For any questions about this software or licensing,
 # please email opensource@seagate.com or cortx-questions@seagate.com.
 
-from typing import Any, Tuple, Dict, List
+from typing import Any, Tuple, Dict, List, Optional
 
 # This is a stub file for `python-consul` module so that mypy will be able
 # to validate the code leveraging the library.
@@ -40,13 +40,23 @@ class Health:
         dc: str = None,
         token: str = None,
     ) -> Tuple[int, List[Dict[str, Any]]]: ...
+    def state(
+        self,
+        name: str,
+        index: int = None,
+        wait: str = None,
+        dc: str = None,
+        near: str = None,
+        token: str = None,
+        node_meta: Dict[str, str] = None,
+    ) -> Tuple[int, List[Dict[str, Any]]]: ...
 
 class Catalog:
     def nodes(
         self,
         index: int = None,
         wait: str = None,
-        consistency: str = None,
+        consistency: Optional[str] = None,
         dc: str = None,
         near: str = None,
         token: str = None,
@@ -58,7 +68,7 @@ class Catalog:
         index: int = None,
         wait: str = None,
         tag: str = None,
-        consistency: str = None,
+        consistency: Optional[str] = None,
         dc: str = None,
         near: str = None,
         token: str = None,
@@ -68,7 +78,7 @@ class Catalog:
         index: int = None,
         wait: str = None,
         tag: str = None,
-        consistency: str = None,
+        consistency: Optional[str] = None,
         dc: str = None,
         near: str = None,
         token: str = None,
@@ -90,6 +100,7 @@ class KV:
         keys: bool = False,
         separator: str = None,
         dc: str = None,
+        consistency: Optional[str] = None,
     ) -> Tuple[int, Any]: ...
     def put(
         self,
@@ -0,0 +1,79 @@
+# Copyright (c) 2021 Seagate Technology LLC and/or its Affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For any questions about this software or licensing,
+# please email opensource@seagate.com or cortx-questions@seagate.com.
+
+from typing import Any, Callable, Optional
+
+import consul
+
+class HTTPClient:
+    host: str
+    port: int
+    scheme: str
+    verify: Any
+    cert: Any
+    base_uri: str
+    def __init__(
+        self,
+        host: str = ...,
+        port: int = ...,
+        scheme: str = ...,
+        verify: Any = ...,
+        cert: Any = ...,
+    ) -> None: ...
+    def uri(self, path: str, params: Any = ...) -> str: ...
+    def response(self, response: Any) -> Any: ...
+    def get(
+        self, callback: Callable[[Any], Any], path: str, params: Any = ...
+    ) -> Any: ...
+    def put(
+        self,
+        callback: Callable[[Any], Any],
+        path: str,
+        params: Any = ...,
+        data: Any = ...,
+    ) -> Any: ...
+    def delete(
+        self, callback: Callable[[Any], Any], path: str, params: Any = ...
+    ) -> Any: ...
+    def post(
+        self,
+        callback: Callable[[Any], Any],
+        path: str,
+        params: Any = ...,
+        data: Any = ...,
+    ) -> Any: ...
+
+class Consul(consul.Consul):
+    def __init__(
+        self,
+        host: str = ...,
+        port: int = ...,
+        token: Optional[str] = ...,
+        scheme: str = ...,
+        consistency: str = ...,
+        dc: Optional[str] = ...,
+        verify: Any = ...,
+        cert: Any = ...,
+    ) -> None: ...
+    def connect(
+        self,
+        host: str,
+        port: int,
+        scheme: str,
+        verify: Any = ...,
+        cert: Any = ...,
+    ) -> HTTPClient: ...